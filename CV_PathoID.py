@@ -5,38 +5,61 @@
 #   on ClinVar, for their clinical significance and (if present)
 #   associated disease condition.
 #
-# Harcoded reading input file format:
+# Input file format:
+#   - The columns of interest are recognized by their header name (see
+#       COLUMN_NAMES, e.g. the ANNOVAR Chr / Start / Gene.refGene / ...);
+#       if any of them is not recognized, the hard-coded columns are used:
 #   - column 2 (index 1): Chromosome
 #   - column 3 (index 2): Position on chromosome
 #   - column 10 (index 9): Gene symbol
 #   - column 8 (index 7): Variant function type (VFT)
 #   - column 11 (index 10): detailed variant annotation
 #   - column 12 (index 11): All SNPs (e.g. rs number)
-#   * For future: maybe attempt to recognize header string in order
-#       to automatically detect which columns are of interest
 #   * Also, be careful that the interest_cols list order and the
 #       Var() constructor input order matches
 #
 #
 # Note to self:
-#   - sys.argv[1] is the input file path
-#   - Only identifies and reads .csv and .output files for now
-#   - The interestd column numbers are hard-coded in read_file
-#   - Problem with newline - not marked by '\n', will need to
-#       manually separate lines via delimiters "\r"
-#       - This is assumed to be the same for both .output and .csv
-#           files, which may or may not cause problems down the road
-#       - However, for now, this seems to be the case and there has not
-#           been any problems running either .csv or .output files yet
+#   - The first command-line argument is the input file path, see
+#       parse_arguments for the optional arguments
+#   - Only identifies and reads .csv, .output and .vcf files for now,
+#       either plain or gzip / bgzip compressed (.csv.gz, .output.bgz,
+#       .vcf.gz, ...); VCF files are read by vcfreader.py, optionally only
+#       for some regions (--region, using a tabix index if present)
+#   - Rows are parsed with the csv module, so quoted .csv fields may
+#       contain commas (.output files are not expected to be quoted)
+#   - The columns of interest are found from the header by find_columns,
+#       falling back to cols_of_interest if any is not recognized
+#   - Rows with a single column (e.g. stray "\r" line ends) are skipped
+#       by iter_rows
+#   - The file is streamed: rows are read, searched and written out in
+#       chunks (see stream_ClinVar), so the whole file is never in memory
+#   - Each chunk is searched by lookup_ClinVar, in this order:
+#       - the local index (--offline, see offline.py) instead of ClinVar
+#       - else the cached positions are refreshed first (--refresh), then
+#           eSearch per chromosome position followed by batched eSummary
+#           (or both via the history server with --history), all through
+#           the response cache (cache.py) and the lookup service
+#           (service.py) if it is running
+#       - a position whose eSearch still fails after the retries is
+#           written as "Search failed" (not "No items found"), while a
+#           failed eSummary stops the search
+#   - Several files (or directories) are searched together in batch mode
+#       (batch_ClinVar): each position is searched once, and the output
+#       files are written in parallel processes
 #   - Outputting an appended file:
-#       - Re-read and split the file, then re-write with the pathogenic
-#           and disease condition status appended to end of each line
-#       - Should probably error check for match
+#       - Each input row is re-written with the pathogenic and disease
+#           condition status appended to the end of the line
+#       - Rows are paired with the Var read from them (same order), so
+#           both output files are written in the same single pass
+#       - Each chunk is written with one (buffered) write per file, and
+#           the files are gzipped with --compress
 #
-# Potential ideas:
-#   - Implement pickle files in order to separate longer search processes
-#       - i.e. check for pre-existing pickle files, separate each
-#           search down to small steps to avoid network errors and such
+#   - The search is journaled in a checkpoint (pickle) file next to the
+#       input file, synced after each chunk, so that a run that stops
+#       half-way can be continued with --resume (same input, assembly and
+#       regions), searching the "Search failed" positions again; see
+#       checkpoint.py
 #
 #
 # Author: Anthony Chen
@@ -46,115 +69,437 @@
 #Harcoded columns of interest to initiate from the file
 #NOTE: if changing this, will also have to change the variant object initialization
 cols_of_interest = [1,2,9,7,10,11]
+#Header names (lowercase) recognized for each of the columns of interest,
+#   in the same order; a name ending with '*' matches any suffix
+COLUMN_NAMES = [
+    ['chr', 'chrom', '#chrom', 'chromosome'],
+    ['start', 'pos', 'position'],
+    ['gene.refgene', 'gene.ensgene', 'gene', 'gene symbol', 'gene symbols', 'gene name'],
+    ['exonicfunc.refgene', 'exonicfunc.ensgene', 'variant function type', 'function type', 'vft'],
+    ['aachange.refgene', 'aachange.ensgene', 'detailed annotation', 'detailed variant annotation'],
+    ['avsnp*', 'snp1*', 'all snps', 'snp', 'dbsnp', 'rs number'],
+]
 
 #Newline delimiter
 NEWLINE_DELIM = '\n'
+#Extension of the compressed input files (gzip, or bgzip as for VCFs), after
+#   the extension of the file type
+COMPRESSED_EXTENSION = r'(\.gz|\.bgz)?$'
+
+#Number of variants read, searched and written out at a time
+STREAM_CHUNK_SIZE = 5000
+#Write buffer size of the output files (bytes), and whether they are gzipped
+OUTPUT_BUFFER_SIZE = 1 << 20
+COMPRESS_OUTPUT = False
+#Format of the columnar export ('parquet' or 'arrow'), or None for none
+COLUMNAR_FORMAT = None
+#Whether to keep only the records matching the allele change of each
+#   variant (--match allele), instead of every record at its position
+MATCH_ALLELES = False
+#Whether to refresh the cached positions incrementally (--refresh), only
+#   requesting the records modified since they were cached
+REFRESH_CACHE = False
 
 
 #System libraries
 import sys
+import os
 import re
 import datetime
 import csv
+import gzip
+import argparse
+import multiprocessing
+import cProfile
 #User-created files
 from variant import Var
 import variant
 import connect
+import cache
+import checkpoint
+import scheduler
+import offline
+import vcfreader
+import decoders
+import transport
+import export
+import metrics
+import matcher
+import service
 
 """### Functions to open the correct type of file and initialize ###"""
-#Function that oversees file input
-def read_file(variant_list, filename, interest_cols):
-    #Initiate the array containing Str data from the file
-    file_content=[]
-    #Identify the type of spreadsheet file via regex
-    if re.search(r'\.output$', filename):
-        #Initialize tab-delimited file format
-        print "[Program] Initializing tab-delimited .output file..."
-        if (read_and_initialize(filename, '\t', interest_cols, file_content) != 0):
-            return 1
-    elif re.search(r'\.csv$', filename):
-        #Initialize comma-separated file format
-        print "[Program] Initializing comma-separated .csv file..."
-        if (read_and_initialize(filename, ',', interest_cols, file_content) != 0):
-            return 1
-    else:
-        print "[ERROR] File extension not recognized, make sure it is 'output' or 'csv'"
+#Function that oversees file input; the columns of interest are found from
+#   the header unless given
+def read_file(variant_list, filename, interest_cols=None):
+    #Identify the type of spreadsheet file
+    delim = get_delimiter(filename)
+    if delim is None:
+        return 0
     #Initialize the content of the file:
-    for r in file_content:
-        variant_list.append(Var(r[0],r[1],r[2],r[3],r[4],r[5]))
-    #Return good
-    return 0
-
-# Function that opens and reads from a file, then initialize and returns
-# a 2D list containing the pre-specified columns of interest
-def read_and_initialize (filename, delim, interest_cols, file_content):
-    #Attempt to open the input stream
     try:
-        f = open(filename, 'r')
+        for row, var in iter_variants(filename, delim, interest_cols):
+            variant_list.append(var)
     #Except for I/O error in case file is not present
     except IOError as e:
         print "[ERROR] I/O error({0}): {1}".format(e.errno, e.strerror)
         return 1
-    #Read the entire file and separate by newline delimiters
-    rows = f.read().split(NEWLINE_DELIM) #NOTE: Be careful here
-    rows.pop(0) #Remove the header (first) row!
-    #Iterate through each now-separated row
-    for r in rows:
-        #Initiate a list containing the current column
-        col_content = []
-        #Separate each row into columns
-        cols = r.split(delim)
-
-        #NOTE: hacky solution to get rid of weird newline delimination
-        if len(cols) == 1: continue
-
-        #Iterate through the list of column numbers of interest
-        for i in interest_cols:
-            col_content.append(cols[i])
-        #Append the content into the returnable content array
-        file_content.append(col_content)
-    #Close the input stream and return good
-    f.close()
+    #Return good
     return 0
 
+#Function to identify the delimiter of the file via its extension; returns
+#   None if the extension is not recognized
+def get_delimiter(filename):
+    if vcfreader.is_vcf(filename):
+        #Initialize VCF file format (tab-delimited)
+        print "[Program] Initializing tab-delimited .vcf file..."
+        return '\t'
+    elif re.search(r'\.output'+COMPRESSED_EXTENSION, filename):
+        #Initialize tab-delimited file format
+        print "[Program] Initializing tab-delimited .output file..."
+        return '\t'
+    elif re.search(r'\.csv'+COMPRESSED_EXTENSION, filename):
+        #Initialize comma-separated file format
+        print "[Program] Initializing comma-separated .csv file..."
+        return ','
+    print "[ERROR] File extension not recognized, make sure it is 'output', 'csv' or 'vcf'"
+    return None
+
+#Function to open an input file, decompressing it if it is gzipped (which
+#   includes bgzip)
+def open_input(filename):
+    if re.search(r'\.(gz|bgz)$', filename):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'r')
+
+#Function to make the csv reader of an input file: quoted fields for .csv
+#   files, no quoting for tab-delimited files
+def make_reader(lines, delim):
+    if delim == '\t':
+        return csv.reader(lines, delimiter=delim, quoting=csv.QUOTE_NONE)
+    return csv.reader(lines, delimiter=delim)
+
+#Function to read the columns of the header (first) row of a file
+def read_header(filename, delim):
+    f = open_input(filename)
+    try:
+        return next(make_reader([f.readline()], delim), [])
+    finally:
+        f.close()
+
+#Function to find the indexes of the columns of interest from the header
+#   of a file; falls back to the hard-coded cols_of_interest if any of them
+#   is not recognized
+def find_columns(filename, delim):
+    header = [name.strip().lower() for name in read_header(filename, delim)]
+    interest_cols = []
+    for names in COLUMN_NAMES:
+        for i in range(0, len(header)):
+            if any((header[i].startswith(n[:-1]) if n.endswith('*') else header[i] == n) for n in names):
+                interest_cols.append(i)
+                break
+        else:
+            return cols_of_interest
+    return interest_cols
+
+#Generator that reads a file one row at a time, yielding the (row, columns)
+#   of every row after the header; the whole file is never held in memory
+def iter_rows(filename, delim):
+    f = open_input(filename)
+    try:
+        f.readline() #Skip the header (first) row!
+        #Lines of the row being parsed (a quoted field can span lines), so
+        #   that the row is kept as it is in the file
+        lines = []
+        def read_lines():
+            for line in f:
+                lines.append(line)
+                yield line
+        for cols in make_reader(read_lines(), delim):
+            row = ''.join(lines)
+            del lines[:]
+            #Remove the newline delimiter
+            if row.endswith(NEWLINE_DELIM):
+                row = row[:-len(NEWLINE_DELIM)]
+            #NOTE: hacky solution to get rid of weird newline delimination
+            if len(cols) <= 1: continue
+            yield row, cols
+    finally:
+        f.close()
+
+#Generator that yields the (row, Var object) of every row of a file; each
+#   Var is numbered by its index in the file. The columns of interest are
+#   found from the header unless given
+def iter_variants(filename, delim, interest_cols=None):
+    #VCF records are read by vcfreader (restricted to its REGIONS, if any)
+    if vcfreader.is_vcf(filename):
+        for item in vcfreader.iter_variants(filename):
+            yield item
+        return
+    if interest_cols is None:
+        interest_cols = find_columns(filename, delim)
+    index = 0
+    for row, cols in iter_rows(filename, delim):
+        r = [cols[i] for i in interest_cols]
+        yield row, Var(r[0],r[1],r[2],r[3],r[4],r[5], index)
+        index += 1
+
+#Generator that groups the items of an iterable into lists of chunk_size
+def iter_chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) != 0:
+        yield chunk
+
+#Find the assembly of the input files from their VCF headers (GRCh37 if none
+#   of them say); returns None if they say different assemblies
+def input_assembly(files):
+    found = {}
+    for filename in files:
+        if not vcfreader.is_vcf(filename): continue
+        assembly = vcfreader.header_assembly(vcfreader.read_header_lines(filename))
+        if assembly is not None:
+            found.setdefault(assembly, filename)
+    if len(found) > 1:
+        print "[ERROR] The input files are on different assemblies (%s); search them separately or give --assembly" % (
+            ', '.join(["%s: %s" % (assembly, filename) for assembly, filename in sorted(found.items())]))
+        return None
+    if len(found) == 1:
+        return found.keys()[0]
+    return 'GRCh37'
+
 
 """################## Function to search ##################"""
-def search_ClinVar(variant_list):
+#Search a list of variants; wanted_genes is the list of genes to filter
+#   for (an empty list for no filtering), or None to ask the user. If a
+#   local index (an offline.LocalIndex) is given, it is searched instead
+#   of ClinVar
+def search_ClinVar(variant_list, use_history=False, wanted_genes=None, local_index=None):
     #Edit the annotations to become searchable
     print "[Program] Formatting variant annotations..."
-    variant.format_variantList(variant_list)
+    with metrics.stage('format'):
+        variant.format_variantList(variant_list, wanted_genes)
+    status = lookup_ClinVar(variant_list, use_history, local_index)
+    if status == 0 and MATCH_ALLELES:
+        match_alleles(variant_list)
+    return status
+
+#Search a list of already formatted variants (see search_ClinVar)
+def lookup_ClinVar(variant_list, use_history=False, local_index=None):
+    #Search the local index, if wanted
+    if local_index is not None:
+        print "[Program] Searching the local ClinVar index..."
+        with metrics.stage('offline'):
+            return offline.ClinVar_Local_Search(variant_list, local_index)
+
+    #Bring the cached positions up to date first, if wanted, so that the
+    #   search below finds them in the cache
+    if REFRESH_CACHE and connect.CACHE is not None:
+        print "[Program] Refreshing the cached positions with the modified ClinVar records..."
+        with metrics.stage('refresh'):
+            if connect.ClinVar_Refresh(variant_list) != 0:
+                return 1
 
+    #Search for IDs and records together via the history server, if wanted
+    if use_history:
+        print "[Program] Beginning ClinVar history server search for records..."
+        with metrics.stage('history'):
+            return connect.ClinVar_History_Search(variant_list)
     #Loop through the variant list to find record IDs via eSearch
     print "[Program] Beginning ClinVar eSearch for record IDs..."
-    connect.ClinVar_Search_Loop(variant_list, 0)
-    #Loop through the variant list to find record information
+    with metrics.stage('esearch'):
+        connect.ClinVar_Search_Loop(variant_list)
+    #Find record information for all variants in batched requests
     print "[Program] Beginning ClinVar eSummary for record information..."
-    if ( connect.ClinVar_Search_Loop(variant_list, 1) != 0):
-        return 1
+    with metrics.stage('esummary'):
+        if ( connect.ClinVar_Batch_Summary(variant_list) != 0):
+            return 1
     #If done, return success
     return 0
 
+#Keep only the records matching the allele change (rs number or HGVS) of
+#   each variant, see matcher.py
+def match_alleles(variant_list):
+    with metrics.stage('match'):
+        dropped = matcher.match_variants(variant_list)
+    print "[Program] Allele matching dropped %d record(s) of other alleles" % (dropped)
+
+#Streaming search: the input file is read, searched and written out in
+#   chunks of chunk_size variants, so that memory use does not grow with the
+#   size of the input file. Returns the numbers of (variants, unresolved
+#   variants), or 1 if the search failed
+def stream_ClinVar(filename, delim, output_type, wanted_genes, use_history, resume, chunk_size=STREAM_CHUNK_SIZE, local_index=None):
+    #Open the output file(s) wanted by the user
+    outputs = open_output_files(filename, delim, output_type)
+    n_variants = 0
+    n_resolved = 0
+    unresolved = 0
+    try:
+        for chunk in metrics.timed_iter('read', iter_chunks(iter_variants(filename, delim), chunk_size)):
+            rows = [row for row, v in chunk]
+            v_list = [v for row, v in chunk]
+            print "[Program] Searching variants %d to %d..." % (n_variants+1, n_variants+len(v_list))
+            n_variants += len(v_list)
+            #Continue from the checkpoint, if resuming
+            if resume:
+                n_resolved += connect.JOURNAL.restore(v_list)
+            if ( search_ClinVar(v_list, use_history, wanted_genes, local_index) != 0 ):
+                return 1
+            #Make sure the results of the chunk are journaled on disk
+            connect.JOURNAL.sync()
+            #Write out the results of the chunk
+            with metrics.stage('write'):
+                write_output_rows(outputs, rows, v_list, delim)
+            unresolved += len([v for v in v_list if v.searchable and v.IdList is None])
+    finally:
+        close_output_files(outputs)
+    if resume:
+        print "[Program] Resumed: %d of %d variants were already resolved" % (n_resolved, n_variants)
+    return (n_variants, unresolved)
+
+"""################## Batch mode (many input files) ##################"""
+#Results of the batch lookup, (IdList, recordLib) by (chromosome, position)
+#   key; set before the writer processes are started, so that they inherit it
+BATCH_RESULTS = {}
+
+#Function to list the input files of the batch: the given files, and the
+#   .output / .csv files of the given directories (other than the output
+#   files of an earlier run)
+def list_batch_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = [name for name in os.listdir(path) if re.search(r'\.(output|csv|vcf)'+COMPRESSED_EXTENSION, name) and not re.search(r'_ClinVar(Appended|ResultSummary)_', name)]
+            files += sorted([os.path.normpath(os.path.join(path, name)) for name in names])
+        else:
+            files.append(path)
+    return files
+
+#Function to find the input files whose output files would overwrite each
+#   other (e.g. in.csv and in.output); returns the sorted lists of such files
+def colliding_stems(files):
+    stems = {}
+    for filename in files:
+        stems.setdefault(output_stem(filename), []).append(filename)
+    return sorted([sorted(names) for names in stems.values() if len(names) > 1])
+
+#Batch search: the files are parsed and formatted in a pool of processes,
+#   their unique (chromosome, position) keys are looked up together (once,
+#   however many files they appear in), then the output files are written in
+#   the pool. Returns the numbers of (variants, unresolved positions), or 1
+#   if the search failed
+def batch_ClinVar(files, output_type, wanted_genes, use_history, chunk_size=STREAM_CHUNK_SIZE, local_index=None, processes=None):
+    pool = multiprocessing.Pool(processes)
+    try:
+        #Parse and format the files, collecting their keys
+        print "[Program] Reading %d files..." % (len(files))
+        with metrics.stage('batch_read'):
+            file_keys = pool.map(collect_batch_keys, [(filename, wanted_genes, chunk_size) for filename in files])
+    finally:
+        pool.close()
+        pool.join()
+    n_variants = sum([n for n, keys in file_keys])
+    keys = set()
+    for n, file_key_list in file_keys:
+        keys.update(file_key_list)
+    keys = sorted(keys)
+    print "[Program] %d unique positions from %d variants in %d files" % (len(keys), n_variants, len(files))
+
+    #Look up the keys, one chunk at a time, using a placeholder Var per key
+    BATCH_RESULTS.clear()
+    for chunk in iter_chunks(keys, chunk_size):
+        v_list = [Var(chromo, str(pos), '', '', '', '', None) for chromo, pos in chunk]
+        if ( lookup_ClinVar(v_list, use_history, local_index) != 0 ):
+            return 1
+        for key, v in zip(chunk, v_list):
+            if v.IdList is not None:
+                BATCH_RESULTS[key] = (v.IdList, v.recordLib)
+    unresolved = len(keys) - len(BATCH_RESULTS)
+
+    #Write the output files (the new processes inherit the results)
+    pool = multiprocessing.Pool(processes)
+    try:
+        with metrics.stage('batch_write'):
+            pool.map(write_batch_file, [(filename, output_type, wanted_genes, chunk_size) for filename in files])
+    finally:
+        pool.close()
+        pool.join()
+    BATCH_RESULTS.clear()
+    return (n_variants, unresolved)
+
+#Batch worker: parse and format a file; returns its number of variants and
+#   the list of the unique keys of its searchable variants
+def collect_batch_keys(job):
+    filename, wanted_genes, chunk_size = job
+    delim = get_delimiter(filename)
+    n_variants = 0
+    keys = set()
+    for chunk in iter_chunks(iter_variants(filename, delim), chunk_size):
+        v_list = [v for row, v in chunk]
+        n_variants += len(v_list)
+        variant.format_variantList(v_list, wanted_genes)
+        keys.update([connect.location_key(v.chromosome, v.position) for v in v_list if v.searchable])
+    return (n_variants, list(keys))
+
+#Batch worker: write the output files of a file, from the batch results
+def write_batch_file(job):
+    filename, output_type, wanted_genes, chunk_size = job
+    delim = get_delimiter(filename)
+    outputs = open_output_files(filename, delim, output_type)
+    try:
+        for chunk in iter_chunks(iter_variants(filename, delim), chunk_size):
+            rows = [row for row, v in chunk]
+            v_list = [v for row, v in chunk]
+            variant.format_variantList(v_list, wanted_genes)
+            for v in v_list:
+                if not v.searchable: continue
+                result = BATCH_RESULTS.get(connect.location_key(v.chromosome, v.position))
+                if result is not None:
+                    v.IdList = list(result[0])
+                    v.recordLib = result[1]
+            if MATCH_ALLELES:
+                match_alleles(v_list)
+            write_output_rows(outputs, rows, v_list, delim)
+    finally:
+        close_output_files(outputs)
+    print "[Program] Done writing output files of %s" % (filename)
+    return 0
+
 """################## Output Functions ##################"""
-#Master file to write output
+#Master file to write output, for a list of variants read as a whole (see
+#   read_file); the input file is re-read once, and both output files are
+#   written in the same pass
 def write_output_file(filename, v_list, output_type):
-    #If the user only wants the short .csv summary file
-    if output_type == 0:
-        print "[Program] Writing .csv ClinVar result summary file..."
-        write_new_csvFile(filename, v_list)
-    #If the user wants to output a file with the ClinVar info appended
-    elif output_type == 1:
-        print "[Program] Appending ClinVar result to new copy of original file..."
-        append_end_column(filename, v_list)
-    #If the user wants both of the above files
-    else:
-        print "[Program] Writing .csv ClinVar result summary file..."
-        write_new_csvFile(filename, v_list)
-        print "[Program] Appending ClinVar result to new copy of original file..."
-        append_end_column(filename, v_list)
+    delim = '\t' if re.search(r'\.(output|vcf)'+COMPRESSED_EXTENSION, filename) else ','
+    outputs = open_output_files(filename, delim, output_type)
+    try:
+        #The input rows are only needed for the appended file
+        if outputs[1] is None:
+            write_output_rows(outputs, None, v_list, delim)
+        else:
+            start = 0
+            for rows in iter_chunks(iter_input_rows(filename, delim), STREAM_CHUNK_SIZE):
+                write_output_rows(outputs, rows, v_list[start:start+len(rows)], delim)
+                start += len(rows)
+    finally:
+        close_output_files(outputs)
     #Prompt user after finishing file writing and return success
     print "[Program] Done writing output files."
     return 0
 
+#Generator over the rows of an input file, one per variant (same rows, and
+#   in the same order, as iter_variants)
+def iter_input_rows(filename, delim):
+    if vcfreader.is_vcf(filename):
+        for row, var in vcfreader.iter_variants(filename):
+            yield row
+    else:
+        for row, cols in iter_rows(filename, delim):
+            yield row
+
 #Ask the user for what type of output they want
 def get_output_type():
     #Indicate to user file types
@@ -177,90 +522,290 @@ def get_output_type():
     #Return the integer representation of the user's input
     return int(usr_in)
 
-#Function to generate a new .csv file containing the essential information
-def write_new_csvFile(filename, v_list):
+#Function to get the path of an input file without its extension (and
+#   without .gz / .bgz), which the output file names are built on
+def output_stem(filename):
+    return os.path.splitext(re.sub(r'\.(gz|bgz)$', '', filename))[0]
+
+#Function to open the .csv summary file and write its header
+def open_summary_csvFile(filename):
     #Generate output file name using the input file name and today's date
     date = str(datetime.date.today()).replace('-','')
-    output_name = filename.split('.')[0]+'_ClinVarResultSummary_%s.csv'%(date)
+    output_name = output_stem(filename)+'_ClinVarResultSummary_%s.csv'%(date)
     #Open the output file
-    f_out = open(output_name, 'w')
+    f_out = open_output(output_name)
     #Write header
     header = ['Chromosome','Position','Gene Name','Detailed Variant Annotation','SNP (rs number)','Clinical Significance','Disease Conditions']
     f_out.write(','.join(header)+NEWLINE_DELIM)
-    #Iterate through all variants to write content
-    for v in v_list:
-        #Get all related information
-        infoList=[v.chromosome, v.position, v.gene,v.annotation,v.snp,v.output_clin_sig(),v.output_conditions()]
-        #Write information
-        f_out.write(','.join(infoList)+NEWLINE_DELIM)
-    #Close the file output stream
-    f_out.close()
-
-
-#Function to append the pathogenicity results to the last column
-# *Note, the file type is preserved
-def append_end_column(filename,v_list):
-    #Set the delimiter
-    if re.search(r'\.output$', filename): #tab-delimited .output file
-        delim = "\t"
-    elif re.search(r'\.csv$', filename): #csv file
-        delim = ","
-    #have another else block?
-    #Open reading file - should be okay with exception since it is the same file
-    f_in = open(filename, 'r')
-    #Read the input file and split via newline delimiter
-    input_rows = f_in.read().split(NEWLINE_DELIM)
+    return f_out
+
+#Function to write the .csv summary rows of a list of variants
+def write_summary_rows(f_out, v_list):
+    #Fields containing commas (e.g. from a quoted .csv input) are quoted
+    writer = csv.writer(f_out, lineterminator=NEWLINE_DELIM)
+    writer.writerows((v.chromosome, v.position, v.gene, v.annotation, v.snp, v.output_clin_sig(), v.output_conditions()) for v in v_list)
+
+#Function to open an output file for writing, with a large write buffer;
+#   gzipped (with a .gz extension added) if COMPRESS_OUTPUT
+def open_output(output_name):
+    if COMPRESS_OUTPUT:
+        return gzip.open(output_name+'.gz', 'wb', 6)
+    return open(output_name, 'w', OUTPUT_BUFFER_SIZE)
+
+#Function to open the appended output file and write its header (the
+#   input header with the result columns added)
+def open_appended_file(filename, delim):
     #Generate output file name using the input file name and today's date
+    #   (a gzipped input is written out uncompressed)
     date = str(datetime.date.today()).replace('-','')
-    output_name = filename.replace('.','_ClinVarAppended_%s.'%(date))
-    #Open output file
-    f_out = open(output_name, 'w')
-    #Write the header of output file
-    f_out.write(input_rows[0]+delim+"Clinical Significance"+delim+"Conditions"+NEWLINE_DELIM)
-    #Iterate through the rest of the file
-    for i in range(1, len(input_rows)):
-        #Find and double check variant information
-        if v_list[i-1].annotation not in input_rows[i]:
-            print "We have a problem"
-            #DO SOMETHING HERE!!!!!!!
-        #If good, output the formatted searched information
-        patho = v_list[i-1].output_clin_sig()
-        cond = v_list[i-1].output_conditions()
-        #Write out the pre-existing file content
-        f_out.write(input_rows[i])
-        #Write out the pathogenicity content
-        f_out.write('%s%s%s%s%s'%(delim,patho,delim,cond, NEWLINE_DELIM))
-    #Close the input and output files
-    f_in.close()
-    f_out.close()
+    extension = os.path.splitext(re.sub(r'\.(gz|bgz)$', '', filename))[1]
+    output_name = output_stem(filename)+'_ClinVarAppended_%s%s'%(date, extension)
+    #Read the header of the input file (for a VCF, the meta lines are copied
+    #   and the column line is the header)
+    if vcfreader.is_vcf(filename):
+        meta_lines = vcfreader.read_header_lines(filename)
+        header = meta_lines.pop() if len(meta_lines) != 0 else ''
+    else:
+        meta_lines = []
+        f_in = open_input(filename)
+        header = f_in.readline().rstrip(NEWLINE_DELIM)
+        f_in.close()
+    #Open output file and write its header
+    f_out = open_output(output_name)
+    f_out.write(''.join([line+NEWLINE_DELIM for line in meta_lines]))
+    f_out.write(header+delim+"Clinical Significance"+delim+"Conditions"+NEWLINE_DELIM)
+    return f_out
+
+#Function to open the output file(s) of the wanted output type, and the
+#   columnar export if wanted (COLUMNAR_FORMAT); returns the (summary,
+#   appended, columnar) files, None for the ones not wanted
+def open_output_files(filename, delim, output_type):
+    summary_out = None
+    appended_out = None
+    columnar_out = None
+    if output_type != 1:
+        print "[Program] Writing .csv ClinVar result summary file..."
+        summary_out = open_summary_csvFile(filename)
+    if output_type != 0:
+        print "[Program] Appending ClinVar result to new copy of original file..."
+        appended_out = open_appended_file(filename, delim)
+    if COLUMNAR_FORMAT is not None:
+        print "[Program] Exporting ClinVar results to a %s file..." % (COLUMNAR_FORMAT)
+        columnar_out = open_columnar_file(filename, COLUMNAR_FORMAT)
+    return summary_out, appended_out, columnar_out
+
+#Function to open the columnar export file (one row per variant and record)
+def open_columnar_file(filename, file_format):
+    #Generate output file name using the input file name and today's date
+    date = str(datetime.date.today()).replace('-','')
+    output_name = output_stem(filename)+'_ClinVarResults_%s%s'%(date, export.FORMATS[file_format])
+    return export.ColumnarWriter(output_name, file_format)
+
+#Function to write the results of a list of variants (and their input rows)
+#   to the open output files
+def write_output_rows(outputs, rows, v_list, delim):
+    summary_out, appended_out, columnar_out = outputs
+    if summary_out is not None:
+        write_summary_rows(summary_out, v_list)
+    if appended_out is not None:
+        write_appended_rows(appended_out, rows, v_list, delim)
+    if columnar_out is not None:
+        columnar_out.write_variants(v_list)
+
+#Function to close the open output files
+def close_output_files(outputs):
+    for f_out in outputs:
+        if f_out is not None:
+            f_out.close()
+
+#Function to write the input rows of a list of variants with the results
+#   appended; rows[i] is the row that v_list[i] was read from
+def write_appended_rows(f_out, rows, v_list, delim):
+    if len(rows) != len(v_list):
+        raise ValueError("%d input rows for %d variants"%(len(rows), len(v_list)))
+    #Format the rows in memory and write them at once
+    f_out.write(''.join(['%s%s%s%s%s%s'%(row, delim, v.output_clin_sig(), delim, v.output_conditions(), NEWLINE_DELIM)
+                         for row, v in zip(rows, v_list)]))
 
 
 
 
+#Parse the command-line arguments
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Searches up a list of variants on ClinVar to identify clinical significance and (if present) condition(s).")
+    parser.add_argument('input_files', nargs='+', metavar='input_file', help="path to the input .output or .csv variant file; several files or directories run in batch mode")
+    parser.add_argument('--output-type', type=int, choices=[0,1,2], help="type of output file(s), see the prompt (default: ask)")
+    parser.add_argument('--genes', metavar='FILE', help="filter for the genes listed in FILE, without asking (default: ask about Wanted_Genes.txt)")
+    parser.add_argument('--no-gene-filter', action='store_true', help="do not filter by genes, without asking")
+    parser.add_argument('--processes', type=int, help="number of processes reading and writing files in batch mode (default: number of CPUs)")
+    parser.add_argument('--history', action='store_true', help="search many positions per request via the E-utilities history server")
+    parser.add_argument('--eutils-url', default=connect.EUTILS_BASE, help="base url of the E-utilities (default: %(default)s)")
+    parser.add_argument('--retmode', choices=sorted(decoders.DECODERS), default=connect.DECODER.retmode, help="format of the E-utilities responses (default: %(default)s)")
+    parser.add_argument('--cache', default=cache.CACHE_FILE, help="persistent response cache file (default: %(default)s)")
+    parser.add_argument('--cache-ttl', type=float, default=cache.DEFAULT_TTL_DAYS, help="days before a cached response is requested again (default: %(default)s)")
+    parser.add_argument('--cache-size', type=int, default=cache.DEFAULT_MAX_ENTRIES, help="maximum number of cached responses of each type (default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true', help="do not read or write the response cache")
+    parser.add_argument('--refresh', action='store_true', help="re-annotate incrementally: only request the ClinVar records modified since each position was cached, whatever the cache TTL")
+    parser.add_argument('--resume', action='store_true', help="continue a previous run of the same input file from its checkpoint")
+    parser.add_argument('--workers', type=int, default=scheduler.DEFAULT_WORKERS, help="number of requests in flight at once (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=transport.READ_TIMEOUT, help="seconds to wait for a response before retrying it (default: %(default)s)")
+    parser.add_argument('--retries', type=int, default=transport.MAX_RETRIES, help="number of times a failed request is retried (default: %(default)s)")
+    parser.add_argument('--api-key', default=os.environ.get('NCBI_API_KEY'), help="NCBI API key, allowing 10 instead of 3 requests per second (default: $NCBI_API_KEY)")
+    parser.add_argument('--assembly', choices=sorted(connect.POSITION_FIELDS), help="reference assembly of the input positions (default: from the VCF header, else GRCh37)")
+    parser.add_argument('--service', default=service.SERVICE_URL, help="url of the lookup service (service.py) to use if it is running (default: %(default)s)")
+    parser.add_argument('--no-service', action='store_true', help="always search directly, even if the lookup service is running")
+    parser.add_argument('--offline', metavar='INDEX', help="search a local ClinVar index built by offline.py instead of ClinVar")
+    parser.add_argument('--window', type=int, default=offline.WINDOW, help="with --offline, also find the records within this many bp of each position (default: %(default)s)")
+    parser.add_argument('--region', action='append', help="only search the VCF records in this region, as chromosome[:start[-end]] (may be repeated; uses the tabix index if present)")
+    parser.add_argument('--compress', action='store_true', help="gzip the output file(s)")
+    parser.add_argument('--columnar', choices=sorted(export.FORMATS), help="also export the results as one row per variant and ClinVar record, in a Parquet or Arrow file (needs pyarrow)")
+    parser.add_argument('--match', choices=['position', 'allele'], default='position', help="report every ClinVar record at the position of a variant, or only those matching its allele change by rs number or HGVS (default: %(default)s)")
+    parser.add_argument('--metrics', metavar='FILE', help="write per-stage timings and request statistics to FILE, as JSON (or a Prometheus textfile if FILE ends with .prom)")
+    parser.add_argument('--profile', metavar='FILE', help="profile the search with cProfile, saving the stats to FILE (see the pstats module)")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE, help="number of variants read, searched and written at a time (default: %(default)s)")
+    return parser.parse_args()
+
 # Main Workflow Function
 def main():
-    #Check for number of command-line arguments
-    if len(sys.argv) != 2:
-        print "[ERROR] Incorrect number of arguments."
+    global COMPRESS_OUTPUT, COLUMNAR_FORMAT, MATCH_ALLELES, REFRESH_CACHE
+    #Get the command-line arguments
+    args = parse_arguments()
+    connect.EUTILS_BASE = args.eutils_url
+    COMPRESS_OUTPUT = args.compress
+    if args.columnar is not None and export.pyarrow is None:
+        print "[ERROR] --columnar needs pyarrow (pip install pyarrow)"
         return 0
-    #Ask the user about output options
-    output_type = get_output_type()
-    #Initiate a list that will contain variant objects
-    variant_list = []
-    #Open the file and initiate content
-    if ( read_file(variant_list, sys.argv[1], cols_of_interest) != 0):
-        print "[ERROR] Something went wrong while reading the file"
+    COLUMNAR_FORMAT = args.columnar
+    MATCH_ALLELES = args.match == 'allele'
+    if args.refresh and (args.no_cache or args.offline is not None):
+        print "[ERROR] --refresh updates the response cache, and cannot be used with --no-cache or --offline"
         return 0
-    #Step to make sure that the variant list isn't empty
-    print "[Program] %d variants initiated" % (len(variant_list))
-    if ( len(variant_list) == 0):
-        print "[ERROR] No variants initiated from file"
+    REFRESH_CACHE = args.refresh
+    connect.DECODER = decoders.DECODERS[args.retmode]
+    connect.WORKERS = args.workers
+    connect.SESSION = transport.Session(read_timeout=args.timeout, retries=args.retries)
+    connect.set_api_key(args.api_key)
+    #Only read the wanted regions of VCF files
+    if args.region:
+        try:
+            vcfreader.REGIONS = vcfreader.merge_regions([vcfreader.parse_region(region) for region in args.region])
+        except ValueError as e:
+            print "[ERROR] %s" % (e)
+            return 0
+    #Several files (or a directory) are searched together in batch mode
+    files = list_batch_files(args.input_files)
+    batch = len(files) != 1 or os.path.isdir(args.input_files[0])
+    if batch and args.resume:
+        print "[ERROR] --resume is not available in batch mode"
+        return 0
+    for names in colliding_stems(files):
+        print "[ERROR] The files %s would be written to the same output files; rename or search them separately" % (', '.join(names))
         return 0
-    #Search step
-    if ( search_ClinVar(variant_list) != 0 ):
+    #Ask the user about output options, unless given
+    output_type = args.output_type
+    if output_type is None:
+        output_type = get_output_type()
+    #Make sure that the file(s) can be read before starting
+    for filename in files:
+        delim = get_delimiter(filename)
+        if delim is None or not os.path.isfile(filename):
+            print "[ERROR] Something went wrong while reading the file %s" % (filename)
+            return 0
+    if len(files) == 0:
+        print "[ERROR] No .output or .csv files found"
+        return 0
+    #Search on the assembly of the input positions
+    assembly = args.assembly
+    if assembly is None:
+        assembly = input_assembly(files)
+        if assembly is None:
+            return 0
+    connect.set_assembly(assembly)
+    print "[Program] Input positions are on %s" % (assembly)
+    #Ask the user about gene filtering once, for all chunks (and files),
+    #   unless given
+    if args.no_gene_filter:
+        wanted_genes = []
+    elif args.genes is not None:
+        wanted_genes = variant.read_gene_file(args.genes)
+    else:
+        wanted_genes = variant.get_gene_filter()
+    #Open the local ClinVar index, if searching offline
+    local_index = None
+    if args.offline is not None:
+        if not os.path.isfile(args.offline):
+            print "[ERROR] Local ClinVar index '%s' not found; build it with offline.py"%(args.offline)
+            return 0
+        local_index = offline.open_index(args.offline)
+        offline.WINDOW = args.window
+        if local_index.assembly != assembly:
+            print "[ERROR] Local ClinVar index '%s' is of %s, not %s; build one with offline.py --assembly %s"%(args.offline, local_index.assembly, assembly, assembly)
+            local_index.close()
+            return 0
+    #Open the persistent response cache, unless disabled (or offline)
+    if not args.no_cache and local_index is None:
+        connect.CACHE = cache.ResponseCache(args.cache, args.cache_ttl, args.cache_size, assembly)
+    #Search through the lookup service if it is running, else directly
+    if not args.no_service and local_index is None:
+        connect.SERVICE = service.find_service(args.service, connect.EUTILS_BASE)
+        if connect.SERVICE is not None:
+            print "[Program] Searching through the lookup service at %s" % (args.service)
+            if args.history or args.refresh:
+                print "[Program] The history server search and refresh are made directly"
+    #Profile the search step, if wanted
+    profiler = None
+    if args.profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if batch:
+        #Search and output step, all files at once
+        search_status = batch_ClinVar(files, output_type, wanted_genes, args.history, args.chunk_size, local_index, args.processes)
+    else:
+        #Open the checkpoint journal, and continue from it if resuming
+        input_file = files[0]
+        checkpoint_name = output_stem(input_file)+'_ClinVarCheckpoint.pkl'
+        regions = vcfreader.REGIONS if vcfreader.is_vcf(input_file) else None
+        connect.JOURNAL = checkpoint.CheckpointJournal(checkpoint_name, input_file, args.resume, assembly, regions)
+        #Search and output step, one chunk of the file at a time
+        search_status = stream_ClinVar(input_file, delim, output_type, wanted_genes, args.history, args.resume, args.chunk_size, local_index)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print "[Program] Profile written to %s" % (args.profile)
+    #Report and close the cache (keeping the responses even if the search failed)
+    if connect.CACHE is not None:
+        connect.CACHE.report()
+        connect.CACHE.close()
+    if local_index is not None:
+        local_index.close()
+    connect.SESSION.report()
+    if args.metrics is not None:
+        metrics.write_report(args.metrics, connect.CACHE, connect.SESSION)
+    connect.SESSION.close()
+    if connect.SERVICE is not None:
+        connect.SERVICE.close()
+    if ( search_status == 1 ):
+        if batch:
+            print "[ERROR] Search stopped; rerun to search again (cached responses are kept)."
+            return 0
+        connect.JOURNAL.close()
+        print "[ERROR] Search stopped; rerun with --resume to continue from where it stopped."
+        return 0
+    n_variants, unresolved = search_status
+    print "[Program] %d variants searched" % (n_variants)
+    if ( n_variants == 0):
+        print "[ERROR] No variants initiated from file"
+    print "[Program] Done writing output files."
+    if batch:
+        if unresolved != 0:
+            print "[ERROR] %d position(s) could not be searched; rerun to retry them." % (unresolved)
         return 0
-    #Output step
-    write_output_file(sys.argv[1], variant_list, output_type) #add more error checks?
+    #The checkpoint is no longer needed once the output is written, unless
+    #   some variants failed to be searched and can still be retried
+    if unresolved != 0:
+        print "[ERROR] %d variant(s) could not be searched; rerun with --resume to retry them." % (unresolved)
+    connect.JOURNAL.close(remove=(unresolved == 0))
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,419 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Benchmark suite for the reading, formatting, searching and writing
+#   stages, run against the local E-utilities stand-in (fake_eutils.py)
+#   so that the results do not depend on NCBI
+#
+# Usage:
+#   python benchmark.py [--rows 1000 100000 1000000] [--scenarios read format search write memory annotate parse decode]
+#       [--repeat-rate 0.5] [--latency 0.02] [--rate-limit 0] [--records summary.xml] [--json report.json]
+#
+# Note to self:
+#   - Input files are generated synthetically (generate_input), with
+#       ANNOVAR column names; a fraction (--hit-rate) of the rows are at
+#       the position of a ClinVar record of the stand-in server, the rest
+#       at random positions. Generated files are kept in --workdir, and
+#       reused by later runs of the same size and --repeat-rate
+#   - The stand-in server replays a recorded eSummary XML file
+#       (--records) and / or synthetic records (--synthetic), with a
+#       delay before every response (--latency) and an optional limit on
+#       the requests per second (--rate-limit, answered with HTTP 429)
+#   - Without --records, a recorded-style eSummary file of
+#       --fixture-records records is generated in --workdir (and reused)
+#       by write_recorded_fixture: the fields of real ClinVar records (two
+#       assemblies, several xrefs and traits, submissions, either
+#       clinical_significance or germline_classification, a few
+#       non-ASCII trait names), so that the records are as large and
+#       varied as the ones of a real eSummary response
+#   - Scenarios, each timing a single stage (the stages before it are run
+#       first, untimed):
+#       - read: CV_PathoID.read_file
+#       - format: variant.format_variantList
+#       - search: ClinVar_Search_Loop + ClinVar_Batch_Summary (see
+#           CV_PathoID.lookup_ClinVar), on at most --search-rows rows, as
+#           the request rate bounds it; the client rate is --client-rate
+#       - write: CV_PathoID.write_output_file (both output files)
+#       - memory: size of the variant objects, once per mode: 'dict' for
+#           the plain class Var was before it had __slots__ (DictVar),
+#           'slots' for variant.Var; built from the columns of the rows
+#           read, the peak RSS growth is divided by the number of rows
+#       - annotate: only the per-row annotation formatting of
+#           format_variantList, over the '|'-separated annotations of the
+#           rows read (without the splitting, gene filter and flags around
+#           it); 'row' formats every annotation (variant.format_annotation),
+#           'memo' formats them as format_variantList does now
+#           (variant.format_annotations, from an empty memo); a fraction
+#           (--repeat-rate) of the generated transcripts repeat earlier
+#           ones, and the report has the number of repeats
+#       - parse: the eSummary file replayed by the server (the fixture,
+#           or --records), turned into doc_sums as one large response;
+#           measured once, not per input size. 'dom' parses the whole
+#           file into a tree first (as before iterparse), 'stream' with
+#           decoders.XMLDecoder, dropping each record once parsed
+#       - decode: the same records in each response format, decoded by
+#           the decoder of that format (decode/json, decode/xml) from an
+#           in-memory response; the JSON response is built from the
+#           records the way the stand-in server answers retmode=json
+#   - Scenarios with modes (SCENARIO_MODES) are measured once per mode, as
+#       scenario/mode
+#   - Each scenario runs in its own process, so its peak RSS is its own;
+#       the report has the rows per second, peak RSS and requests made,
+#       and the extra figures of the scenario (e.g. bytes per variant)
+#
+# Author: Anthony Chen
+##################################################################"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import resource
+import multiprocessing
+from StringIO import StringIO
+#User-created files
+import fake_eutils
+import CV_PathoID
+import decoders
+import variant
+import connect
+import scheduler
+import transport
+
+#Default input sizes and scenarios
+SIZES = [1000, 100000, 1000000]
+SCENARIOS = ['read', 'format', 'search', 'write', 'memory', 'annotate', 'parse', 'decode']
+#Modes each measured separately, of the scenarios that have them
+SCENARIO_MODES = {'memory':['dict', 'slots'], 'annotate':['row', 'memo'], 'parse':['dom', 'stream'],
+                  'decode':sorted(decoders.DECODERS)}
+#Scenarios run once on the eSummary file, instead of on each input
+FIXTURE_SCENARIOS = ['parse', 'decode']
+#Default number of records of the generated eSummary fixture
+FIXTURE_RECORDS = 5000
+#Default fraction of the transcripts of a generated row that repeat those of
+#   an earlier row
+REPEAT_RATE = 0.5
+#Default maximum number of rows searched by the search scenario
+SEARCH_ROWS = 2000
+
+#Fields of every result (the others are extra figures of the scenario)
+REPORT_FIELDS = ['scenario', 'file', 'rows', 'seconds', 'rows_per_second', 'peak_rss_mb', 'requests']
+
+#Header of the generated input files (ANNOVAR column names)
+INPUT_HEADER = ['Chr', 'Start', 'End', 'Ref', 'Alt', 'Func.refGene', 'Gene.refGene', 'GeneDetail.refGene',
+                'ExonicFunc.refGene', 'AAChange.refGene', 'avsnp150']
+
+#Function to generate an input file of n_rows variants (deterministic for
+#   a given seed); sites is a list of (chromosome, position) of ClinVar
+#   records, hit_rate the fraction of rows placed on one of them and
+#   repeat_rate the fraction of transcripts that repeat one of an earlier row
+def generate_input(filename, n_rows, sites, hit_rate=0.5, seed=0, repeat_rate=REPEAT_RATE):
+    rng = random.Random(seed)
+    transcripts = []
+    delim = '\t' if filename.endswith('.output') else ','
+    bases = 'ACGT'
+    f = open(filename, 'w')
+    try:
+        f.write(delim.join(INPUT_HEADER)+'\n')
+        for i in range(0, n_rows):
+            if sites and rng.random() < hit_rate:
+                chromo, pos = rng.choice(sites)
+            else:
+                chromo, pos = str(rng.randint(1, 22)), rng.randint(10000, 1000000)
+            gene = 'GENE%d' % (rng.randint(1, 500))
+            ref, alt = rng.sample(bases, 2)
+            #One to three transcripts, '|'-separated as format_variantList
+            #   splits them; some repeat the transcripts of earlier rows
+            annos = []
+            for t in range(0, rng.randint(1, 3)):
+                if transcripts and rng.random() < repeat_rate:
+                    annos.append(rng.choice(transcripts))
+                else:
+                    annos.append('%s:NM_%06d:exon%d:c.%s%d%s:p.X%dY' % (gene, rng.randint(1, 999999), rng.randint(1, 20), ref, rng.randint(1, 5000), alt, rng.randint(1, 1500)))
+                    transcripts.append(annos[-1])
+            cols = [chromo, str(pos), str(pos), ref, alt, 'exonic', gene, '.', 'nonsynonymous SNV', '|'.join(annos), 'rs%d' % (rng.randint(1, 10**8))]
+            f.write(delim.join(cols)+'\n')
+    finally:
+        f.close()
+
+#Function to write a recorded-style eSummary XML file of n_records ClinVar
+#   records (deterministic for a given seed), at positions like those of
+#   fake_eutils.synthetic_records
+def write_recorded_fixture(filename, n_records, seed=0):
+    rng = random.Random(seed)
+    significance = ['Pathogenic', 'Likely pathogenic', 'Uncertain significance', 'Likely benign', 'Benign',
+                    'Conflicting classifications of pathogenicity', 'Pathogenic/Likely pathogenic']
+    review = ['criteria provided, single submitter', 'criteria provided, multiple submitters, no conflicts',
+              'reviewed by expert panel', 'no assertion criteria provided']
+    traits = ['not provided', 'not specified', 'Hereditary cancer-predisposing syndrome', 'Cardiovascular phenotype',
+              'Inborn genetic diseases', 'Sj\xc3\xb6gren-Larsson syndrome', 'Maladie de Charcot-Marie-Tooth, type 1A (fran\xc3\xa7ais)']
+    f = open(filename, 'w')
+    try:
+        f.write('<?xml version="1.0" encoding="UTF-8" ?>\n<eSummaryResult>\n<DocumentSummarySet status="OK">\n')
+        for i in range(0, n_records):
+            uid = 300000 + i
+            chromo = str(rng.randint(1, 22))
+            pos = rng.randint(10000, 1000000)
+            gene = 'GENE%d' % (rng.randint(1, 500))
+            change = 'c.%d%s>%s' % (rng.randint(1, 5000), rng.choice('ACGT'), rng.choice('ACGT'))
+            title = 'NM_%06d.%d(%s):%s (p.Xaa%dYaa)' % (rng.randint(1, 999999), rng.randint(1, 9), gene, change, rng.randint(1, 1500))
+            xrefs = [('ClinGen', 'CA%d' % (rng.randint(1, 10**8))), ('dbSNP', str(rng.randint(1, 10**8)))]
+            if rng.random() < 0.3:
+                xrefs.append(('OMIM', '%d.%04d' % (rng.randint(100000, 699999), rng.randint(1, 30))))
+            assemblies = [('current', 'GRCh38', 'NC_0000%02d.12' % (int(chromo)), pos + fake_eutils.SYNTHETIC_GRCH38_SHIFT),
+                          ('previous', 'GRCh37', 'NC_0000%02d.11' % (int(chromo)), pos)]
+            trait_set = ''.join(['<trait><trait_xrefs><trait_xref><db_source>MedGen</db_source><db_id>C%07d</db_id></trait_xref></trait_xrefs>'
+                                 '<trait_name>%s</trait_name></trait>' % (rng.randint(1, 10**7), name)
+                                 for name in rng.sample(traits, rng.randint(1, 3))])
+            classification = ('<description>%s</description><last_evaluated>%d/%02d/01 00:00</last_evaluated><review_status>%s</review_status>'
+                              % (rng.choice(significance), rng.randint(2012, 2024), rng.randint(1, 12), rng.choice(review)))
+            #Newer records give the classification (and traits) as
+            #   germline_classification
+            if rng.random() < 0.5:
+                classification = ('<germline_classification>%s<trait_set>%s</trait_set></germline_classification>'
+                                  % (classification, trait_set))
+            else:
+                classification = ('<clinical_significance>%s</clinical_significance><trait_set>%s</trait_set>'
+                                  % (classification, trait_set))
+            f.write('<DocumentSummary uid="%d"><obj_type>single nucleotide variant</obj_type>'
+                    '<accession>VCV%09d</accession><accession_version>VCV%09d.%d</accession_version>'
+                    '<title>%s</title><variation_set><variation><measure_id>%d</measure_id>'
+                    '<variation_xrefs>%s</variation_xrefs><variation_name>%s</variation_name>'
+                    '<cdna_change>%s</cdna_change><aliases></aliases><variation_loc>%s</variation_loc>'
+                    '<variant_type>single nucleotide variant</variant_type></variation></variation_set>'
+                    '<supporting_submissions><scv>%s</scv><rcv>%s</rcv></supporting_submissions>'
+                    '%s<record_status></record_status><gene_sort>%s</gene_sort>'
+                    '<genes><gene><symbol>%s</symbol><geneid>%d</geneid><strand>+</strand><source>submitted</source></gene></genes>'
+                    '<molecular_consequence_list><string>missense variant</string></molecular_consequence_list>'
+                    '<protein_change>X%dY</protein_change><chr_sort>%02d</chr_sort><location_sort>%010d</location_sort>'
+                    '</DocumentSummary>\n' % (
+                    uid, uid, uid, rng.randint(1, 9), title, uid + 50000,
+                    ''.join(['<variation_xref><db_source>%s</db_source><db_id>%s</db_id></variation_xref>' % x for x in xrefs]),
+                    title, change,
+                    ''.join(['<assembly_set><status>%s</status><assembly_name>%s</assembly_name><chr>%s</chr>'
+                             '<band>%sp%d</band><start>%d</start><stop>%d</stop><display_start>%d</display_start>'
+                             '<display_stop>%d</display_stop><assembly_acc_ver>%s</assembly_acc_ver></assembly_set>'
+                             % (status, name, chromo, chromo, rng.randint(11, 36), p, p, p, p, acc)
+                             for status, name, acc, p in assemblies]),
+                    ''.join(['<string>SCV%09d</string>' % (rng.randint(1, 10**8)) for s in range(0, rng.randint(1, 6))]),
+                    ''.join(['<string>RCV%09d</string>' % (rng.randint(1, 10**8)) for s in range(0, rng.randint(1, 3))]),
+                    classification, gene, gene, rng.randint(1, 10**5), rng.randint(1, 1500), int(chromo), pos))
+        f.write('</DocumentSummarySet>\n</eSummaryResult>\n')
+    finally:
+        f.close()
+
+#Variant class as it was before Var had __slots__ (a __dict__ per object,
+#   strings not interned), for the memory scenario
+class DictVar:
+    def __init__(self, chromo, pos, gene, func_type, anno, snp, index=None):
+        self.index = index
+        self.chromosome = chromo
+        self.position = pos
+        self.gene = gene
+        self.function_type = func_type
+        self.annotation = anno
+        self.snp = snp
+        self.searchable = True
+        self.anno_list = None
+        self.IdList = None
+        self.recordLib = None
+
+#Function to get the peak RSS of the current process, in bytes
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+#Function to run a scenario (as scenario or scenario/mode) on an input
+#   file, in the current process; returns the (number of rows timed,
+#   seconds, dictionary of extra figures)
+def run_scenario(scenario, filename, options):
+    scenario, mode = (scenario.split('/') + [None])[:2]
+    if scenario == 'parse':
+        start = time.time()
+        if mode == 'dom':
+            root = decoders.ET.parse(filename).getroot()
+            doc_sums = [(doc.get('uid'), decoders.XMLDecoder().doc_sum(doc)) for doc in root.iter('DocumentSummary')]
+        else:
+            f = open(filename, 'rb')
+            doc_sums = list(decoders.XMLDecoder().summaries(f))
+            f.close()
+        return len(doc_sums), time.time() - start, {'file_mb':round(os.path.getsize(filename) / 1048576.0, 1)}
+    if scenario == 'decode':
+        #Response body of the records in the format, untimed
+        if mode == 'json':
+            docs = [doc for event, doc in decoders.ET.iterparse(filename) if doc.tag == 'DocumentSummary']
+            result = {'uids':[doc.get('uid') for doc in docs]}
+            for doc in docs:
+                result[doc.get('uid')] = fake_eutils.doc_to_json(doc)
+            del docs
+            body = json.dumps({'result':result})
+        else:
+            f = open(filename, 'rb')
+            body = f.read()
+            f.close()
+        start = time.time()
+        doc_sums = list(decoders.DECODERS[mode].summaries(StringIO(body)))
+        return len(doc_sums), time.time() - start, {'response_mb':round(len(body) / 1048576.0, 1)}
+    v_list = []
+    start = time.time()
+    CV_PathoID.read_file(v_list, filename)
+    if scenario == 'read':
+        return len(v_list), time.time() - start, {}
+    if scenario == 'memory':
+        #Columns of each row, then an object per row of the wanted class
+        #   (the variants read are kept, so that the new objects do not
+        #   reuse their memory and the growth of the peak RSS is theirs)
+        cols = [(v.chromosome, v.position, v.gene, v.function_type, v.annotation, v.snp, v.index) for v in v_list]
+        var_class = DictVar if mode == 'dict' else variant.Var
+        rss = peak_rss()
+        start = time.time()
+        objects = [var_class(*c) for c in cols]
+        seconds = time.time() - start
+        size = sys.getsizeof(objects[0]) + (sys.getsizeof(objects[0].__dict__) if mode == 'dict' else 0) if objects else 0
+        return len(objects), seconds, {'object_bytes':size, 'rss_bytes_per_variant':(peak_rss() - rss) / max(len(objects), 1)}
+    if scenario == 'annotate':
+        annos = [raw_anno for v in v_list for raw_anno in v.annotation.split('|')]
+        variant.ANNOTATION_MEMO.clear()
+        start = time.time()
+        if mode == 'row':
+            formatted = [variant.format_annotation(raw_anno) for raw_anno in annos]
+        else:
+            formatted = variant.format_annotations(annos)
+        distinct = len(set(annos))
+        return len(v_list), time.time() - start, {'annotations':len(formatted), 'distinct':distinct, 'repeats':len(formatted) - distinct}
+    if scenario == 'search':
+        del v_list[options['search_rows']:]
+    start = time.time()
+    variant.format_variantList(v_list, [])
+    if scenario == 'format':
+        return len(v_list), time.time() - start, {}
+    if scenario == 'search':
+        connect.EUTILS_BASE = options['url']
+        connect.WORKERS = options['workers']
+        connect.SESSION = transport.Session()
+        connect.RATE_LIMITER = scheduler.TokenBucket(options['client_rate'])
+        start = time.time()
+        CV_PathoID.lookup_ClinVar(v_list)
+        return len(v_list), time.time() - start, {}
+    #Write the output files in a temporary directory, next to a copy of the
+    #   input (re-read for the appended file)
+    out_dir = tempfile.mkdtemp(prefix='cv_bench_')
+    try:
+        out_name = os.path.join(out_dir, os.path.basename(filename))
+        shutil.copy(filename, out_name)
+        start = time.time()
+        CV_PathoID.write_output_file(out_name, v_list, 2)
+        return len(v_list), time.time() - start, {}
+    finally:
+        shutil.rmtree(out_dir)
+
+#Process target: run a scenario quietly, and put its result in the queue
+def scenario_process(queue, scenario, filename, options):
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        n_rows, seconds, extra = run_scenario(scenario, filename, options)
+        queue.put((n_rows, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, extra, None))
+    except Exception as e:
+        queue.put((0, 0.0, 0, {}, repr(e)))
+
+#Function to run a scenario in its own process; returns its result
+#   dictionary
+def measure(scenario, filename, options, store):
+    counts = dict(store.request_counts)
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=scenario_process, args=(queue, scenario, filename, options))
+    process.start()
+    n_rows, seconds, max_rss, extra, error = queue.get()
+    process.join()
+    result = {'scenario':scenario, 'file':os.path.basename(filename), 'rows':n_rows, 'seconds':seconds,
+              'rows_per_second':n_rows / seconds if seconds > 0 else 0.0, 'peak_rss_mb':max_rss / 1024.0,
+              'requests':dict((k, store.request_counts[k] - counts[k]) for k in counts)}
+    result.update(extra)
+    if error is not None:
+        result['error'] = error
+    return result
+
+#Function to print the result of a scenario (and its extra figures, if
+#   any); returns the result
+def report(result):
+    if 'error' in result:
+        print "[ERROR] %s on %s failed: %s" % (result['scenario'], result['file'], result['error'])
+        return result
+    extra = ' '.join(['%s=%s' % (k, result[k]) for k in sorted(result) if k not in REPORT_FIELDS])
+    print "%-14s %-32s %9d %9.2f %12.0f %8.1fMB %9d %s" % (result['scenario'], result['file'], result['rows'], result['seconds'],
+                                                        result['rows_per_second'], result['peak_rss_mb'],
+                                                        result['requests']['esearch'] + result['requests']['esummary'], extra)
+    return result
+
+#Parse the command-line arguments
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks the stages of CV_PathoID.py against a local E-utilities stand-in.")
+    parser.add_argument('--rows', type=int, nargs='+', default=SIZES, help="input sizes, in rows (default: %(default)s)")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS, help="stages to benchmark (default: all)")
+    parser.add_argument('--format', choices=['output', 'csv'], default='output', help="input file type (default: %(default)s)")
+    parser.add_argument('--workdir', default='benchmark_inputs', help="directory of the generated input files (default: %(default)s)")
+    parser.add_argument('--records', help="recorded eSummary XML file for the stand-in server to replay (default: a generated recorded-style file)")
+    parser.add_argument('--fixture-records', type=int, default=FIXTURE_RECORDS, help="number of records of the generated eSummary file (default: %(default)s)")
+    parser.add_argument('--synthetic', type=int, default=0, help="number of synthetic records of the stand-in server (default: %(default)s)")
+    parser.add_argument('--hit-rate', type=float, default=0.5, help="fraction of input rows at a record position (default: %(default)s)")
+    parser.add_argument('--repeat-rate', type=float, default=REPEAT_RATE, help="fraction of the transcripts of an input row that repeat those of an earlier row (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds the stand-in server waits before every response (default: %(default)s)")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="requests per second the stand-in server allows (default: no limit)")
+    parser.add_argument('--client-rate', type=float, default=50.0, help="requests per second of the client rate limiter (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=scheduler.DEFAULT_WORKERS, help="requests in flight at once (default: %(default)s)")
+    parser.add_argument('--search-rows', type=int, default=SEARCH_ROWS, help="maximum rows searched by the search scenario (default: %(default)s)")
+    parser.add_argument('--json', metavar='FILE', help="also write the results to FILE as JSON")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    if not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+    #Generate the recorded-style eSummary file, unless a recorded one is given
+    records = args.records
+    if records is None:
+        records = os.path.join(args.workdir, 'esummary_recorded_%d.xml' % (args.fixture_records))
+        if not os.path.isfile(records):
+            print "[Program] Generating %s..." % (records)
+            write_recorded_fixture(records, args.fixture_records)
+    #Start the stand-in server
+    store = fake_eutils.RecordStore()
+    fake_eutils.load_records(store, records)
+    fake_eutils.synthetic_records(store, args.synthetic)
+    store.faults['delay'] = args.latency
+    store.faults['rate_limit'] = args.rate_limit
+    server = fake_eutils.make_server(store)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    options = {'url':'http://%s:%d/' % server.server_address, 'workers':args.workers,
+               'client_rate':args.client_rate, 'search_rows':args.search_rows}
+    print "[Program] Stand-in server with %d records at %s" % (len(store.docs), options['url'])
+    #Positions of the records, for the generated inputs
+    sites = [(chromo, start) for chromo, locs in sorted(store.locations.items()) for start, stop, uid in locs]
+
+    results = []
+    print "%-14s %-32s %9s %9s %12s %10s %9s" % ('scenario', 'file', 'rows', 'seconds', 'rows/second', 'peak RSS', 'requests')
+    for scenario in [s for s in args.scenarios if s in FIXTURE_SCENARIOS]:
+        for mode in SCENARIO_MODES.get(scenario, [None]):
+            results.append(report(measure(scenario if mode is None else scenario+'/'+mode, records, options, store)))
+    for n_rows in args.rows:
+        filename = os.path.join(args.workdir, 'bench_%d_repeat%g.%s' % (n_rows, args.repeat_rate, args.format))
+        if not os.path.isfile(filename):
+            print "[Program] Generating %s..." % (filename)
+            generate_input(filename, n_rows, sites, args.hit_rate, repeat_rate=args.repeat_rate)
+        for scenario in [s for s in args.scenarios if s not in FIXTURE_SCENARIOS]:
+            for mode in SCENARIO_MODES.get(scenario, [None]):
+                results.append(report(measure(scenario if mode is None else scenario+'/'+mode, filename, options, store)))
+    server.shutdown()
+    if args.json is not None:
+        f = open(args.json, 'w')
+        json.dump({'options':vars(args), 'results':results}, f, indent=2, sort_keys=True)
+        f.close()
+        print "[Program] Results written to %s" % (args.json)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Persistent on-disk cache of ClinVar responses, so that reruns and
+#   overlapping files do not repeat the same requests
+#
+# Note to self:
+#   - Stored in a single SQLite file with two tables:
+#       - esearch: record ID list per (chromosome, position), keyed by
+#           connect.location_key (empty lists are cached too); GRCh38
+#           positions have their own table (esearch_grch38), as the same
+#           position finds other records on the other assembly
+#       - esummary: parsed doc_sum dictionary per record ID (pickled)
+#   - Entries older than the TTL count as misses and are re-requested,
+#       unless renewed by an incremental refresh (connect.ClinVar_Refresh),
+#       which only re-requests the records modified since they were stored
+#   - Once a table holds more than max_entries rows, the least recently
+#       used rows are evicted (checked on commit)
+#   - Several runs may share the file, so writes are kept short: the new
+#       entries and the access times of the hits are held in memory, and
+#       written in one transaction when the caller commits a batch of
+#       results (see connect.py). A file locked by another run is waited
+#       on for up to LOCK_TIMEOUT seconds; a lookup that still fails counts
+#       as a miss, and a failed commit is retried on the next one
+#   - Only meant to be used from a single thread
+#
+# Author: Anthony Chen
+##################################################################"""
+import time
+import sqlite3
+import cPickle
+
+#Default cache file (in the local directory), time-to-live and size limit
+CACHE_FILE = "ClinVar_cache.sqlite"
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 1000000
+#Seconds to wait for a file locked by another run
+LOCK_TIMEOUT = 30.0
+#eSearch table of each assembly
+ESEARCH_TABLES = {'GRCh37':'esearch', 'GRCh38':'esearch_grch38'}
+
+class ResponseCache:
+    #Open (or create) the cache file, for the positions of an assembly
+    def __init__(self, filename=CACHE_FILE, ttl_days=DEFAULT_TTL_DAYS, max_entries=DEFAULT_MAX_ENTRIES, assembly='GRCh37'):
+        self.filename = filename
+        self.ttl = ttl_days * 86400.0
+        self.max_entries = max_entries
+        self.esearch_table = ESEARCH_TABLES[assembly]
+        self.conn = sqlite3.connect(filename, timeout=LOCK_TIMEOUT)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS %s (chromosome TEXT, position INTEGER, ids TEXT, created REAL, accessed REAL, PRIMARY KEY (chromosome, position))"%(self.esearch_table))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS esummary (uid TEXT PRIMARY KEY, doc BLOB, created REAL, accessed REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS %s_accessed ON %s (accessed)"%(self.esearch_table, self.esearch_table))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS esummary_accessed ON esummary (accessed)")
+        self.conn.commit()
+        #Hit and miss counters of each table
+        self.hits = {'esearch':0, 'esummary':0}
+        self.misses = {'esearch':0, 'esummary':0}
+        #Writes not committed yet: new ID lists by key and doc_sums by uid
+        #   (with the time they were stored), renewed uids, and the last
+        #   access time of the entries hit
+        self.pending_ids = {}
+        self.pending_summaries = {}
+        self.pending_renewed = {}
+        self.accessed = {'esearch':{}, 'esummary':{}}
+
+    ########## eSearch record ID lists ##########
+    #Return the cached ID list of a (chromosome, position) key, or None if missing
+    def get_ids(self, key):
+        entry = self.get_ids_entry(key)
+        if entry is None or self.expired(entry[1]):
+            self.misses['esearch'] += 1
+            return None
+        self.hits['esearch'] += 1
+        self.accessed['esearch'][key] = time.time()
+        return entry[0]
+
+    #Return the cached (ID list, time stored) of a (chromosome, position) key
+    #   whatever its age, without counting a hit or miss, or None if missing
+    def get_ids_entry(self, key):
+        if key in self.pending_ids:
+            id_list, created = self.pending_ids[key]
+            return list(id_list), created
+        row = self.select("SELECT ids, created FROM %s WHERE chromosome=? AND position=?"%(self.esearch_table), key)
+        if row is None:
+            return None
+        return [str(Id) for Id in row[0].split(',') if Id], row[1]
+
+    #Store the ID list of a (chromosome, position) key
+    def put_ids(self, key, id_list):
+        self.pending_ids[key] = (list(id_list), time.time())
+
+    ########## eSummary records ##########
+    #Return the cached doc_sum of a record ID, or None if missing
+    def get_summary(self, uid):
+        if uid in self.pending_summaries:
+            doc_sum, created = self.pending_summaries[uid]
+        else:
+            row = self.select("SELECT doc, created FROM esummary WHERE uid=?", (uid,))
+            if row is None:
+                doc_sum, created = None, None
+            else:
+                doc_sum, created = row[0], self.pending_renewed.get(uid, row[1])
+        if doc_sum is None or self.expired(created):
+            self.misses['esummary'] += 1
+            return None
+        self.hits['esummary'] += 1
+        self.accessed['esummary'][uid] = time.time()
+        if uid not in self.pending_summaries:
+            doc_sum = cPickle.loads(str(doc_sum))
+        return doc_sum
+
+    #Store the doc_sum of a record ID
+    def put_summary(self, uid, doc_sum):
+        self.pending_summaries[uid] = (doc_sum, time.time())
+
+    #Mark the doc_sums of a list of record IDs as just stored (i.e. found to
+    #   be unchanged), so that they do not expire
+    def renew_summaries(self, uids):
+        now = time.time()
+        for uid in uids:
+            self.pending_renewed[uid] = now
+
+    ########## Housekeeping ##########
+    #Run a lookup query, returning its row (None if missing, or if the file
+    #   could not be read, e.g. still locked by another run)
+    def select(self, query, params):
+        try:
+            return self.conn.execute(query, params).fetchone()
+        except sqlite3.OperationalError:
+            return None
+
+    #Check whether an entry created at the given time is past the TTL
+    def expired(self, created):
+        return time.time() - created > self.ttl
+
+    #Write the pending entries and access times in one transaction, evicting
+    #   the least recently used entries beyond the size limit; returns
+    #   whether they were written (else they stay pending)
+    def commit(self):
+        try:
+            self.conn.executemany("INSERT OR REPLACE INTO %s VALUES (?,?,?,?,?)"%(self.esearch_table),
+                                  [(key[0], key[1], ','.join(id_list), created, created) for key, (id_list, created) in self.pending_ids.iteritems()])
+            self.conn.executemany("INSERT OR REPLACE INTO esummary VALUES (?,?,?,?)",
+                                  [(uid, sqlite3.Binary(cPickle.dumps(doc_sum, 2)), created, created) for uid, (doc_sum, created) in self.pending_summaries.iteritems()])
+            self.conn.executemany("UPDATE esummary SET created=?, accessed=? WHERE uid=?",
+                                  [(now, now, uid) for uid, now in self.pending_renewed.iteritems()])
+            self.conn.executemany("UPDATE %s SET accessed=? WHERE chromosome=? AND position=?"%(self.esearch_table),
+                                  [(now, key[0], key[1]) for key, now in self.accessed['esearch'].iteritems()])
+            self.conn.executemany("UPDATE esummary SET accessed=? WHERE uid=?",
+                                  [(now, uid) for uid, now in self.accessed['esummary'].iteritems()])
+            for table in [self.esearch_table, 'esummary']:
+                count = self.conn.execute("SELECT COUNT(*) FROM %s"%(table)).fetchone()[0]
+                if count > self.max_entries:
+                    self.conn.execute("DELETE FROM %s WHERE rowid IN (SELECT rowid FROM %s ORDER BY accessed LIMIT ?)"%(table, table), (count - self.max_entries,))
+            self.conn.commit()
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            print "[ERROR] Could not write to the cache file %s (%s); will retry"%(self.filename, e)
+            return False
+        self.pending_ids.clear()
+        self.pending_summaries.clear()
+        self.pending_renewed.clear()
+        self.accessed = {'esearch':{}, 'esummary':{}}
+        return True
+
+    #Print the hit and miss counters
+    def report(self):
+        for table in ['esearch', 'esummary']:
+            total = self.hits[table] + self.misses[table]
+            rate = 100.0 * self.hits[table] / total if total else 0.0
+            print "[Program] Cache %s: %d hit(s), %d miss(es) (%.1f%% hit rate)"%(table, self.hits[table], self.misses[table], rate)
+
+    #Commit the pending changes and close the cache file
+    def close(self):
+        if not self.commit():
+            print "[ERROR] The new cache entries were not saved"
+        self.conn.close()
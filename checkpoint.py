@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Checkpoint journal of the ClinVar search, so that a long run that
+#   fails half-way (e.g. network error) can be resumed via --resume
+#   instead of restarting from the first variant
+#
+# Note to self:
+#   - The journal is a stream of pickled entries, appended (and flushed)
+#       as soon as each variant is resolved, and synced to disk once per
+#       chunk of variants or every SYNC_INTERVAL seconds, whichever is
+#       first (a crash of the program itself loses nothing, a crash of the
+#       machine at most the last few seconds):
+#       - ('header', input filename, input size, input modification time,
+#           assembly of the positions, regions read of a VCF input)
+#       - ('esearch', variant index in the file, IdList)
+#       - ('esummary', variant index in the file, recordLib)
+#   - A variant counts as resolved once its IDs are journaled and, if it
+#       has any IDs, its records are journaled too
+#   - A partially written last entry (from a crash mid-write) is ignored,
+#       and cut off the journal when resuming, so that the new entries
+#       follow the last complete one
+#   - The journal is removed once the output files are written
+#
+# Author: Anthony Chen
+##################################################################"""
+import os
+import time
+import cPickle
+
+#Maximum number of seconds between two syncs of the journal to disk
+SYNC_INTERVAL = 5.0
+
+class CheckpointJournal:
+    #Open the journal of an input file; if resuming, the entries of a
+    #   previous journal of the same (unchanged) input file, assembly and
+    #   regions are kept (the variant indexes depend on the regions read)
+    def __init__(self, filename, input_file, resume=False, assembly='GRCh37', regions=None):
+        self.filename = filename
+        #IDs and records of a previous journal resumed from, by variant
+        #   index (the new entries are only written, not kept in memory)
+        self.IdLists = {}
+        self.recordLibs = {}
+        #Time of the last sync to disk
+        self.synced = time.time()
+        stat = os.stat(input_file)
+        header = ('header', input_file, stat.st_size, stat.st_mtime, assembly, regions)
+        if resume and os.path.exists(filename):
+            self.load(header)
+        #Start a new journal unless there is something to resume from
+        if len(self.IdLists) == 0:
+            self.f = open(filename, 'wb')
+            self.write(header)
+        else:
+            self.f = open(filename, 'r+b')
+            self.f.truncate(self.end)
+            self.f.seek(self.end)
+
+    #Read the entries of a previous journal with the given header; end is
+    #   set to the offset after its last complete entry
+    def load(self, header):
+        f = open(self.filename, 'rb')
+        self.end = 0
+        try:
+            #Only resume from the journal of the same input
+            if cPickle.load(f) != header:
+                print "[ERROR] Checkpoint '%s' is from a different input, assembly or region, starting over."%(self.filename)
+                return
+            self.end = f.tell()
+            while True:
+                entry_type, i, value = cPickle.load(f)
+                if entry_type == 'esearch':
+                    self.IdLists[i] = value
+                elif entry_type == 'esummary':
+                    self.recordLibs[i] = value
+                self.end = f.tell()
+        #End of the journal (or a partially written last entry)
+        except (EOFError, cPickle.UnpicklingError, ValueError):
+            pass
+        finally:
+            f.close()
+
+    #Append an entry, syncing it to disk if the last sync is old enough
+    def write(self, entry):
+        cPickle.dump(entry, self.f, 2)
+        self.f.flush()
+        if time.time() - self.synced >= SYNC_INTERVAL:
+            self.sync()
+
+    #Make sure that the entries written so far are on disk
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.synced = time.time()
+
+    #Journal the eSearch IDs of a variant
+    def record_ids(self, i, id_list):
+        self.write(('esearch', i, id_list))
+
+    #Journal the eSummary records of a variant
+    def record_summary(self, i, record_lib):
+        self.write(('esummary', i, record_lib))
+
+    #Input the resumed results into a list of variants (the IDs of variants
+    #   whose records were not journaled yet are kept too, so that only their
+    #   eSummary is repeated), dropping them from memory as each variant is
+    #   only restored once; returns the number of resolved variants
+    def restore(self, v_list):
+        resolved = 0
+        for v in v_list:
+            if v.index not in self.IdLists: continue
+            v.IdList = self.IdLists.pop(v.index)
+            v.recordLib = self.recordLibs.pop(v.index, None)
+            if len(v.IdList) == 0 or v.recordLib is not None:
+                resolved += 1
+        return resolved
+
+    #Close the journal, removing it if it is no longer needed
+    def close(self, remove=False):
+        if not remove:
+            self.sync()
+        self.f.close()
+        if remove:
+            os.remove(self.filename)
@@ -14,93 +14,469 @@
 #   - Does not provide the list of conflicting conditions for "conflicting
 #       interpretations of pathogenicity" (for eSummary)
 #       - either do manual check or future additional steps to add info
-#   - Exception handling for clin_sig and conds:
-#       - If no text: either will print "None" or attribute error
-#       - Not sure if attribute error is the only one that will be thrown
-#       - Even print an error message for conditions not found? I think it
-#           is a rather common occurance
-#       - Likely should do more error handling in the eSummary getReuslt
+#   - Responses are requested as JSON (retmode=json) by default, or as XML,
+#       and decoded by the DECODER (see decoders.py) into the same IdList /
+#       doc_sum results, so nothing past this module depends on the format
+#   - Missing clin_sig / conds are stored as None (conditions are often
+#       missing, so no error message is printed for either)
+#   - If a lookup service (service.py) is running, the per-position eSearch
+#       and the batched eSummary go through it (SERVICE), sharing its rate
+#       limit and memory cache with other runs; the history server search
+#       and the refresh are always made directly
+#   - Positions are searched on the ASSEMBLY of the input (see
+#       set_assembly): GRCh37 by [chrpos37], GRCh38 by [chrpos38]; ClinVar
+#       has the locations of every record on both, so GRCh38 input needs
+#       no liftover
 #
 # Author: Anthony Chen
 ##################################################################"""
-import urllib
 import time
-import xml.etree.ElementTree as ET
+import urllib
+import bisect
+#User-created files
+import scheduler
+import decoders
+import transport
+import metrics
+
+#NCBI guideline for the maximum number of requests per second, without and
+#   with an API key
+MAX_REQUESTS_PER_SECOND = 3
+API_KEY_REQUESTS_PER_SECOND = 10
+#Number of requests in flight at once
+WORKERS = scheduler.DEFAULT_WORKERS
+#Maximum number of record IDs sent in a single batched eSummary request
+ESUMMARY_BATCH_SIZE = 300
+#Maximum number of (chromosome, position) terms OR'd into a single
+#   history server eSearch query, and number of records per eSummary page
+HISTORY_TERMS_PER_QUERY = 200
+HISTORY_PAGE_SIZE = 500
+#Base URL of the E-utilities (may be pointed to a local stand-in server,
+#   e.g. fake_eutils.py, for testing)
+EUTILS_BASE = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+#Persistent response cache (a cache.ResponseCache), if enabled
+CACHE = None
+#Checkpoint journal of the search (a checkpoint.CheckpointJournal), if enabled
+JOURNAL = None
+#NCBI API key (see set_api_key) and the rate limiter shared by all requests
+API_KEY = None
+RATE_LIMITER = scheduler.TokenBucket(MAX_REQUESTS_PER_SECOND)
+#HTTP session (keep-alive connections, timeouts and retries) used to send
+#   every request
+SESSION = transport.Session()
+#Response format requested from the E-utilities and its decoder
+#   (decoders.DECODERS['json'] or decoders.DECODERS['xml'])
+DECODER = decoders.DECODERS['json']
+#Client of the running lookup service (a service.ServiceClient), if any
+SERVICE = None
+#Reference assembly of the input positions, and the eSearch field of each
+ASSEMBLY = 'GRCh37'
+POSITION_FIELDS = {'GRCh37':'chrpos37', 'GRCh38':'chrpos38'}
 
 #Overall search loop that iterates over all variant records to perform search,
-#   while maintaining the appropritate request rate (< 3 / second)
-#       Search types:
-#           0 - searches for presence of record and retrieve IDs
-#           1 - searches for summary and pathogenicity
-def ClinVar_Search_Loop(v_list, search_type):
-    #Timer variables to prevent excessive ClinVar requests
-    start_time = time.time()
-    request_counter = 0
-
-    #Iterate through each variant to initiate search terms
-    for i in range(0, len(v_list)):
-        #User prompt for search progress
-        if i % 10 == 0:
-            print "\t%d of %d variants"%(i+1,len(v_list))
-
-        #If the current variant is not searchable, skip to the next one
-        if v_list[i].searchable == False: continue
-
-        #Generate the query term for the appropriate search
-        if search_type == 0: #eSearch query term
-            url_query = eSearch_generate_query(v_list[i])
-        elif search_type == 1: #eSummary query term
-            url_query = eSummary_generate_query(v_list[i])
-            #If the variant has no IDs, skip current variant
-            if url_query == 1:
+#   with the requests run concurrently (see scheduler.py) while the shared
+#   rate limiter keeps to the NCBI request rate
+#   The eSearch is made once per unique (chromosome, position) for the
+#       record IDs, and its IDs are fanned back out to every variant at that
+#       position (the records themselves are found by ClinVar_Batch_Summary)
+def ClinVar_Search_Loop(v_list):
+    #Requests to make as (function, arguments), and the indexes of the
+    #   variants that each request is made for
+    jobs = []
+    job_index = []
+
+    #Skip the variants already searched (i.e. resumed from a checkpoint)
+    key_map, keys = location_index(v_list, lambda v: v.IdList is None)
+    print "\t%d unique positions from %d variants"%(len(keys), sum([len(key_map[key]) for key in keys]))
+    for key in keys:
+        #Skip the request if the IDs of the position are cached
+        if CACHE is not None:
+            cached_ids = CACHE.get_ids(key)
+            if cached_ids is not None:
+                eSearch_fanOut(v_list, key_map[key], cached_ids)
                 continue
+        if SERVICE is not None:
+            jobs.append((SERVICE.get_ids, (key,)))
+        else:
+            jobs.append((eSearch_getIDs, (eSearch_generate_query(key),)))
+        job_index.append(key_map[key])
+
+    #Number of variants whose eSearch failed
+    failed = 0
+    #Perform the searches and process the results as they come back
+    done = 0
+    for j, result in scheduler.run_jobs(jobs, WORKERS):
+        #User prompt for search progress
+        done += 1
+        if done % 10 == 0 or done == len(jobs):
+            print "\t%d of %d requests"%(done,len(jobs))
+        indexes = job_index[j]
+        if not isinstance(result, list):
+            #Call function to report the failure (once per position)
+            eSearch_processResults(v_list[indexes[0]], result)
+            failed += len(indexes)
+            continue
+        #Cache the IDs of the position, then input them into its variants
+        if CACHE is not None:
+            CACHE.put_ids(location_key(v_list[indexes[0]].chromosome, v_list[indexes[0]].position), result)
+        eSearch_fanOut(v_list, indexes, result)
 
-        #If 3 requests have been made, check to see elasped time
-        if (request_counter >= 3):
-            current_time = time.time() #get current time
-            time_diff = current_time - start_time #get the difference in time
-            if (time_diff < 1.00): #Check to see if 1 second has elasped
-                time.sleep(1.0 - time_diff) #If not, slepp the rest time
-            #Reset the start time and counters
-            request_counter = 0
-            start_time = time.time()
-
-        #Perform the appropriate search and process results
-        if search_type==0: #Access eSearch
-            #Search and retrieve the results in a List
-            result = eSearch_getIDs(url_query)
-            #Call function to initiate the list into the variant
-            eSearch_processResults(v_list[i], result)
-        elif search_type==1: #Access eSummary
-            #Search and retrieve results in a dictionary
-            result_dict = eSummary_getResult(url_query)
-            #Check for exception and potential program termination
-            if result_dict == 1:
-                return 1
-            #Input nested dictionary into the Var object instance
-            v_list[i].recordLib = result_dict
-
-        #Increase the request counter by 1
-        request_counter += 1
+    #Write the cached IDs of this batch of variants
+    if CACHE is not None:
+        CACHE.commit()
+    #Let the user know about the variants that will show up as not found
+    if failed != 0:
+        print "[ERROR] eSearch failed for %d variant(s); they are written as 'Search failed'."%(failed)
     #After loop, return success
     return 0
 
-""" #### Helper Functions to find presence of and retrieve IDs ####"""
-#Function to generate the eSearch-appropriate url query from a Var object
-def eSearch_generate_query(var):
-    #Combine all searchable items into a single list
-    """
-    search_term_list = var.anno_list #Direct copy for setting the base list
-    if any(char.isdigit() for char in var.snp): #if it has an rs number
-        search_term_list.append(var.snp) #append the rs number
-    """
-    search_term_list=[var.chromosome+"[chr]", var.position+"[chrpos37]"]
+#Function to build the dedup index of a variant list: maps each unique
+#   (chromosome, position) key to the indexes of the searchable variants
+#   with it (only those for which wanted(v) is true, if given); returns the
+#   map and the keys in the order they are first seen
+def location_index(v_list, wanted=None):
+    key_map = {}
+    keys = []
+    for i in range(0, len(v_list)):
+        v = v_list[i]
+        if v.searchable == False: continue
+        if wanted is not None and not wanted(v): continue
+        key = location_key(v.chromosome, v.position)
+        if key not in key_map:
+            key_map[key] = []
+            keys.append(key)
+        key_map[key].append(i)
+    return key_map, keys
+
+#Function to input the eSearch IDs of a position into every variant (by
+#   index) at that position, journaling each of them; each variant gets its
+#   own copy of the list
+def eSearch_fanOut(v_list, indexes, id_list):
+    for i in indexes:
+        eSearch_processResults(v_list[i], list(id_list))
+        if JOURNAL is not None:
+            JOURNAL.record_ids(v_list[i].index, v_list[i].IdList)
+
+#Function to set the NCBI API key (None for no key), which raises the
+#   allowed request rate
+def set_api_key(api_key):
+    global API_KEY, RATE_LIMITER
+    API_KEY = api_key
+    RATE_LIMITER = scheduler.TokenBucket(API_KEY_REQUESTS_PER_SECOND if api_key else MAX_REQUESTS_PER_SECOND)
+
+#Function to set the reference assembly of the input positions (a key of
+#   POSITION_FIELDS), for both the eSearch terms and the record locations
+#   read by the decoders
+def set_assembly(assembly):
+    global ASSEMBLY
+    if assembly not in POSITION_FIELDS:
+        raise ValueError("Unknown assembly '%s' (expected %s)"%(assembly, ' or '.join(sorted(POSITION_FIELDS))))
+    ASSEMBLY = assembly
+    decoders.ASSEMBLY = assembly
+
+#Function that sends every E-utilities request: adds the response format
+#   of the DECODER and the API key (if any), then sends it through the
+#   SESSION, which waits for the shared rate limiter before every attempt
+#   If post_data is given, the request is sent as a POST instead
+def open_eutils(url_query, post_data=None):
+    params = {'retmode':DECODER.retmode}
+    if API_KEY:
+        params['api_key'] = API_KEY
+    if post_data is None:
+        url_query += "&"+urllib.urlencode(params)
+    else:
+        post_data += "&"+urllib.urlencode(params)
+    return SESSION.request(url_query, post_data, RATE_LIMITER)
+
+#Batched eSummary stage: instead of one request per variant, the record IDs of
+#   every variant are collected, deduplicated and POSTed in chunks of at most
+#   batch_size IDs. Each returned record is then mapped back to all of the
+#   variants that referenced it
+def ClinVar_Batch_Summary(v_list, batch_size=ESUMMARY_BATCH_SIZE):
+    #Map of each record ID to the (indexes of) variants that referenced it,
+    #   and the (deduplicated) IDs in the order they are first seen
+    uid_map = {}
+    uid_order = []
+    #Number of records each variant is still missing, by variant index
+    missing = {}
+    #Number of requests the per-variant search would have made
+    unbatched_requests = 0
+    for i in range(0, len(v_list)):
+        v = v_list[i]
+        #Skip the variants that are not searched, have no records or already
+        #   have their records (i.e. resumed from a checkpoint)
+        if v.searchable == False or not v.IdList or v.recordLib is not None: continue
+        unbatched_requests += 1
+        #Start with an empty record library, same as an empty eSummary result
+        v.recordLib = {}
+        missing[i] = len(v.IdList)
+        for uid in v.IdList:
+            if uid not in uid_map:
+                uid_map[uid] = []
+                uid_order.append(uid)
+            uid_map[uid].append(i)
+
+    #Input the cached records, and only request the rest
+    if CACHE is not None:
+        uncached = []
+        for uid in uid_order:
+            doc_sum = CACHE.get_summary(uid)
+            if doc_sum is None:
+                uncached.append(uid)
+                continue
+            summary_found(v_list, uid, doc_sum, uid_map, missing)
+        uid_order = uncached
+
+    #Split the unique IDs into chunks
+    chunks = [uid_order[i:i+batch_size] for i in range(0, len(uid_order), batch_size)]
+    print "\t%d unique record IDs from %d variants in %d request(s)"%(len(uid_order), unbatched_requests, len(chunks))
+
+    #POST the chunks of IDs and retrieve results in dictionaries
+    if SERVICE is not None:
+        jobs = [(SERVICE.get_summaries, (chunk,)) for chunk in chunks]
+    else:
+        jobs = [(eSummary_getResult, (EUTILS_BASE+"esummary.fcgi", eSummary_generate_batch(chunk))) for chunk in chunks]
+    done = 0
+    for i, result_dict in scheduler.run_jobs(jobs, WORKERS):
+        #User prompt for search progress
+        done += 1
+        print "\t%d of %d eSummary batches"%(done,len(chunks))
+        #Check for exception and potential program termination
+        if result_dict == 1:
+            return 1
+        #Input each returned record into every variant that referenced it
+        for uid, doc_sum in result_dict.iteritems():
+            summary_found(v_list, uid, doc_sum, uid_map, missing)
+            if CACHE is not None:
+                CACHE.put_summary(uid, doc_sum)
+        #The variants still missing records are not going to get them
+        #   (i.e. not returned by eSummary), so they are done as well
+        for uid in chunks[i]:
+            if uid not in result_dict:
+                summary_found(v_list, uid, None, uid_map, missing)
+    #Write the cached records of this batch of variants
+    if CACHE is not None:
+        CACHE.commit()
+
+    #Report how many requests the batching saved
+    print "[Program] Batched eSummary made %d request(s) instead of %d (%d saved)."%(len(chunks), unbatched_requests, unbatched_requests-len(chunks))
+    return 0
+
+#Helper to input a record found by the batched eSummary into every variant
+#   that referenced it (a doc_sum of None if the record was not returned);
+#   variants are journaled once they are no longer missing any records
+def summary_found(v_list, uid, doc_sum, uid_map, missing):
+    for i in uid_map.get(uid, []):
+        if doc_sum is not None:
+            v_list[i].recordLib[uid] = doc_sum
+        missing[i] -= 1
+        if missing[i] == 0 and JOURNAL is not None:
+            JOURNAL.record_summary(v_list[i].index, v_list[i].recordLib)
+
+#History server search: the (chromosome, position) terms of many variants
+#   are OR'd into a single eSearch that is stored on the E-utilities history
+#   server (usehistory=y), then the records are paged through eSummary via
+#   query_key/WebEnv instead of passing every ID in the url. As the history
+#   server does not say which term matched which record, the records are
+#   mapped back to the variants using their location on the ASSEMBLY
+def ClinVar_History_Search(v_list, terms_per_query=HISTORY_TERMS_PER_QUERY, page_size=HISTORY_PAGE_SIZE):
+    #Map of each unique (chromosome, position) key to the (indexes of)
+    #   variants with it
+    key_map = {}
+    for i in range(0, len(v_list)):
+        v = v_list[i]
+        #Skip the variants that are not searched or already resolved (i.e.
+        #   resumed from a checkpoint)
+        if v.searchable == False: continue
+        if v.IdList is not None and (len(v.IdList) == 0 or v.recordLib is not None): continue
+        #Start with no records, same as an empty eSearch result
+        v.IdList = []
+        v.recordLib = None
+        key_map.setdefault(location_key(v.chromosome, v.position), []).append(i)
+    #Sorted positions of each chromosome, to look up records spanning a range
+    chr_positions = sorted_positions(key_map)
+
+    #Input the positions whose IDs and records are all cached, and only
+    #   search for the rest
+    keys = sorted(key_map)
+    if CACHE is not None:
+        keys = [key for key in keys if not history_from_cache(v_list, key, key_map[key])]
+
+    #Split the unique keys into chunks of OR'd terms
+    chunks = [keys[i:i+terms_per_query] for i in range(0, len(keys), terms_per_query)]
+    print "\t%d unique positions in %d eSearch quer(ies)"%(len(keys), len(chunks))
 
+    #Run the searches of the chunks, each returning a list of eSummary pages
+    jobs = [(history_search_chunk, (chunk, page_size)) for chunk in chunks]
+    request_count = 0
+    done = 0
+    for i, pages in scheduler.run_jobs(jobs, WORKERS):
+        #User prompt for search progress
+        done += 1
+        print "\t%d of %d history searches"%(done,len(chunks))
+        if pages == 1:
+            return 1
+        request_count += 1 + len(pages)
+        for result_dict in pages:
+            #Input each record into every variant at a position it spans
+            for uid, doc_sum in result_dict.iteritems():
+                for key in spanned_keys(chr_positions, doc_sum['loc']):
+                    for v in [v_list[k] for k in key_map[key]]:
+                        if v.recordLib is None:
+                            v.recordLib = {}
+                        if uid not in v.recordLib:
+                            v.IdList.append(uid)
+                            v.recordLib[uid] = doc_sum
+                if CACHE is not None:
+                    CACHE.put_summary(uid, doc_sum)
+        #Cache and journal the IDs found at each searched position
+        for key in chunks[i]:
+            if CACHE is not None:
+                CACHE.put_ids(key, v_list[key_map[key][0]].IdList)
+            history_journal(v_list, key_map[key])
+    if CACHE is not None:
+        CACHE.commit()
+    print "[Program] History server search made %d request(s)."%(request_count)
+    return 0
+
+#Function to run the history server search of a chunk of (chromosome,
+#   position) keys, optionally only for the records modified since mindate
+#   (YYYY/MM/DD); returns the list of eSummary result dictionaries (one per
+#   page of records), or 1 if any of the requests failed
+def history_search_chunk(keys, page_size, mindate=None):
+    #Store the search results on the history server
+    term = " OR ".join([eSearch_generate_term(chromo, pos) for chromo, pos in keys])
+    history = eSearch_getHistory(term, mindate)
+    if history == 1:
+        return 1
+    count, query_key, web_env = history
+    #Page through the stored records
+    pages = []
+    for retstart in range(0, count, page_size):
+        post_data = urllib.urlencode({'db':'clinvar', 'query_key':query_key, 'WebEnv':web_env, 'retstart':retstart, 'retmax':page_size})
+        result_dict = eSummary_getResult(EUTILS_BASE+"esummary.fcgi", post_data)
+        if result_dict == 1:
+            return 1
+        pages.append(result_dict)
+    return pages
+
+#Function to input the cached IDs and records of a position into its
+#   variants; returns False (without changing the variants) if any of them
+#   are not cached
+def history_from_cache(v_list, key, indexes):
+    id_list = CACHE.get_ids(key)
+    if id_list is None:
+        return False
+    docs = {}
+    for uid in id_list:
+        docs[uid] = CACHE.get_summary(uid)
+        if docs[uid] is None:
+            return False
+    for i in indexes:
+        v_list[i].IdList = list(id_list)
+        if len(id_list) != 0:
+            v_list[i].recordLib = dict(docs)
+    history_journal(v_list, indexes)
+    return True
+
+#Function to sort the positions of (chromosome, position) keys by
+#   chromosome, to look up the keys that a record location spans
+def sorted_positions(keys):
+    chr_positions = {}
+    for chromo, pos in keys:
+        chr_positions.setdefault(chromo, []).append(pos)
+    for chromo in chr_positions:
+        chr_positions[chromo].sort()
+    return chr_positions
+
+#Generator over the (chromosome, position) keys of sorted_positions that
+#   are spanned by a list of record locations
+def spanned_keys(chr_positions, locations):
+    for chromo, start, stop in locations:
+        positions = chr_positions.get(chromo, [])
+        for j in range(bisect.bisect_left(positions, start), bisect.bisect_right(positions, stop)):
+            yield (chromo, positions[j])
+
+#Incremental refresh of the cached positions: rather than searching every
+#   position again once its cache entry expires, a date-limited history
+#   server search (datetype=mdat) finds only the records at the positions
+#   that were modified or added since they were cached. Only those records
+#   are fetched (and added to the IDs of the positions they span); the
+#   other cached positions and records are marked as just stored, so the
+#   search that follows finds them all in the cache. Positions that are
+#   not cached are left to that search. Returns 0, or 1 if any of the
+#   requests failed
+def ClinVar_Refresh(v_list, terms_per_query=HISTORY_TERMS_PER_QUERY, page_size=HISTORY_PAGE_SIZE):
+    #Cached (IDs, time stored) of the unique positions still to be searched
+    key_map, keys = location_index(v_list, lambda v: v.IdList is None or (len(v.IdList) != 0 and v.recordLib is None))
+    entries = {}
+    for key in keys:
+        entry = CACHE.get_ids_entry(key)
+        if entry is not None:
+            entries[key] = entry
+    #Group the positions cached at about the same time, as each search
+    #   starts from the oldest of its positions
+    keys = sorted(entries, key=lambda key: (entries[key][1], key))
+    chunks = [keys[i:i+terms_per_query] for i in range(0, len(keys), terms_per_query)]
+    print "\t%d of %d unique positions cached, refreshed in %d eSearch quer(ies)"%(len(keys), len(key_map), len(chunks))
+
+    jobs = [(history_search_chunk, (chunk, page_size, refresh_mindate(entries[chunk[0]][1]))) for chunk in chunks]
+    request_count = 0
+    changed = 0
+    for i, pages in scheduler.run_jobs(jobs, WORKERS):
+        if pages == 1:
+            return 1
+        request_count += 1 + len(pages)
+        chr_positions = sorted_positions(chunks[i])
+        id_lists = dict((key, list(entries[key][0])) for key in chunks[i])
+        modified = set()
+        for result_dict in pages:
+            #Store each modified record, and add it to the positions it spans
+            for uid, doc_sum in result_dict.iteritems():
+                CACHE.put_summary(uid, doc_sum)
+                modified.add(uid)
+                for key in spanned_keys(chr_positions, doc_sum['loc']):
+                    if uid not in id_lists[key]:
+                        id_lists[key].append(uid)
+        changed += len(modified)
+        for key in chunks[i]:
+            CACHE.put_ids(key, id_lists[key])
+        CACHE.renew_summaries(set([uid for key in chunks[i] for uid in entries[key][0]]) - modified)
+    CACHE.commit()
+    print "[Program] Refresh found %d modified record(s) in %d request(s)."%(changed, request_count)
+    return 0
+
+#Function to get the earliest modification date (YYYY/MM/DD) of the records
+#   that a position cached at a time (seconds since the epoch) may miss; a
+#   day earlier, as eSearch dates have no time of day or time zone
+def refresh_mindate(cached):
+    return time.strftime('%Y/%m/%d', time.gmtime(cached - 86400))
+
+#Function to journal the results of the (indexes of) variants at a position
+def history_journal(v_list, indexes):
+    if JOURNAL is None: return
+    for i in indexes:
+        JOURNAL.record_ids(v_list[i].index, v_list[i].IdList)
+        if len(v_list[i].IdList) != 0:
+            JOURNAL.record_summary(v_list[i].index, v_list[i].recordLib)
+
+#Function to normalize a chromosome and position into a (str, int) key that
+#   can be compared to the location of a record (on the same assembly)
+def location_key(chromo, pos):
+    chromo = chromo.strip()
+    if chromo.lower().startswith('chr'):
+        chromo = chromo[3:]
+    return (chromo.upper(), int(pos))
+
+""" #### Helper Functions to find presence of and retrieve IDs ####"""
+#Function to generate the eSearch-appropriate url query of a (chromosome,
+#   position) key (see location_key), on the ASSEMBLY unless given
+def eSearch_generate_query(key, assembly=None):
     #The base url to access the ClinVar database via EUtils
-    url_base = "http://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=clinvar&term="
+    url_base = EUTILS_BASE+"esearch.fcgi?db=clinvar&term="
 
-    #URL-encode then join the search terms into an "OR"-separated string
-    encoded_terms = "("+urllib.quote_plus(") AND (".join([t for t in search_term_list]))+")" #NOTE: AND or OR
+    #URL-encode the search term of the (normalized) chromosome position
+    encoded_terms = urllib.quote_plus(eSearch_generate_term(key[0], key[1], assembly))
 
     #Add the max return number (temp one for now)
     retmax = "&retmax=500"
@@ -109,18 +485,46 @@ def eSearch_generate_query(var):
     return url_base+encoded_terms+retmax
 
 
+#Function to generate the eSearch term of a single (chromosome, position),
+#   on the ASSEMBLY unless given
+def eSearch_generate_term(chromo, pos, assembly=None):
+    return "(%s[chr] AND %d[%s])"%(chromo, pos, POSITION_FIELDS[assembly or ASSEMBLY])
+
+#Function that runs an eSearch stored on the history server, optionally
+#   only for the records modified since mindate (YYYY/MM/DD); returns the
+#   (record count, query_key, WebEnv) needed to page through the results
+def eSearch_getHistory(term, mindate=None):
+    #POST the search, as the OR'd term is likely too long for a url query
+    params = {'db':'clinvar', 'term':term, 'usehistory':'y', 'retmax':0}
+    if mindate is not None:
+        params.update({'datetype':'mdat', 'mindate':mindate, 'maxdate':'3000/12/31'})
+    post_data = urllib.urlencode(params)
+    try:
+        fields = decode_response(DECODER.history, EUTILS_BASE+"esearch.fcgi", post_data)
+    #Network errors or incomplete responses
+    except (IOError, SyntaxError, ValueError) as e:
+        print "[ERROR] History server search failed: %s"%(e)
+        return 1
+    #If any of the history information is missing, something went wrong
+    if fields.get('WebEnv') is None or fields.get('QueryKey') is None or fields.get('Count') is None:
+        print "[ERROR] History server search failed: %s"%(fields.get('ERROR'))
+        return 1
+    return (int(fields['Count']), fields['QueryKey'], fields['WebEnv'])
+
 #Function that access eSearch and return a list of ClinVar IDs
 def eSearch_getIDs(url_query):
-    #Access ClinVar eSearch via url and retrieve xml data
-    html = urllib.urlopen(url_query).read()
-    #Parse html XML data into xml tree object
-    root = ET.fromstring(html)
-    #Find and access the IdList element
-    for IdList in root.iter("IdList"):
-        #Return all of the ClinVar record IDs as a List
-        return [Id.text for Id in IdList.iter("Id")]
+    try:
+        #Access ClinVar eSearch via url and decode the record IDs
+        id_list = decode_response(DECODER.ids, url_query)
+    #Network errors or incomplete responses
+    except (IOError, SyntaxError, ValueError) as e:
+        print "[ERROR] eSearch failed: %s"%(e)
+        return 1
     #Do further error processing?
-    return 1
+    if id_list is None:
+        return 1
+    #Return all of the ClinVar record IDs as a List
+    return id_list
 
 #Function to interpret and initiate the results from eSearch
 def eSearch_processResults(var, result):
@@ -137,59 +541,33 @@ def eSearch_processResults(var, result):
         print "[ERROR] Something went wrong"
 
 """#### Helper Functions to find summary of records and pathogenicity ####"""
-#Function to generate the eSummary url query from a Var object
-def eSummary_generate_query(var):
-    #If the Var has no record, return appropriately
-    if len(var.IdList)==0:
-        return 1
-    #Combine string of IDs from the variant (If the Var has record)
-    id_string = ",".join([Id for Id in var.IdList])
-    #Base URL to access eSummary
-    url_base = "http://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=clinvar&id="
-    #Return the url and IDs
-    return url_base+id_string
+#Function to generate the POST data of a batched eSummary request from a
+#   list of record IDs (too many IDs to fit in a url query)
+def eSummary_generate_batch(id_list):
+    return urllib.urlencode({'db':'clinvar', 'id':",".join(id_list)})
 
 #Function that access eSummary and return pathogenicity status(es)
-def eSummary_getResult(url_query):
-    #Access ClinVar eSummary via url and retrieve xml data
-    html = urllib.urlopen(url_query).read()
-    #Parse html XML data into xml tree object
-    root = ET.fromstring(html)
-    #Create a dictionary to store the information
-    doc_set = {}
-    #Iterate through each record document found
-    for doc in root.iter('DocumentSummary'):
-        #Create a sub-dictionary for each piece of information
-        doc_sum = {}
-        #Store the clnical significance
-        try:
-            doc_sum['clin_sig']=doc.find('clinical_significance').find('description').text
-        except AttributeError as e: #If clin significance not found...
-            #Print error message
-            print "AttributeError ({0}): {1}. Initiated as 'None'".format(e.errno, e.strerror)
-            #Initiate NoneType as attribute
-            doc_sum['clin_sig'] = None
-        #For all other exceptions, return message (to terminate program)
-        except Exception as e:
-            print e
-            return 1
-
-        #Store the condition(s) as an array
-        try:
-            doc_sum['cond']= [t.find('trait_name').text for t in doc.find('trait_set').iter('trait')]
-        except AttributeError as e: #If condition(s) not found...
-            #Print error message
-            #print "AttributeError ({0}): {1}. Initiated as 'None'".format(e.errno, e.strerror)
-                #Decided against returning error message since sometimes there
-                #   can be empty conditions
-            #Initiate NoneType as attribute
-            doc_sum['cond'] = None
-        #For all other exceptions, return message (to terminate program)
-        except Exception as e:
-            print e
-            return 1
-
-        #Input the clinical significance and conditions into document set
-        doc_set[doc.get('uid')] = doc_sum
+#   If post_data is given, the request is sent as a POST instead
+def eSummary_getResult(url_query, post_data=None):
+    try:
+        #Access ClinVar eSummary via url, and store the clinical significance
+        #   and conditions of each record in a dictionary as they are decoded
+        doc_set = decode_response(lambda response: dict(DECODER.summaries(response)), url_query, post_data)
+    #Network errors or incomplete responses
+    except (IOError, SyntaxError, ValueError) as e:
+        print "[ERROR] eSummary failed: %s"%(e)
+        return 1
     #Return the nested dictionary
     return doc_set
+
+#Function that opens an E-utilities request and decodes its response with
+#   the given DECODER method
+#   Raises IOError for network errors, and SyntaxError / ValueError for
+#   responses that cannot be decoded
+def decode_response(decode, url_query, post_data=None):
+    response = open_eutils(url_query, post_data)
+    try:
+        with metrics.stage('decode'):
+            return decode(response)
+    finally:
+        response.close()
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Helper classes to decode the E-utilities (eSearch / eSummary) responses,
+#   in either of their formats (retmode=json or retmode=xml)
+#
+# Note to self:
+#   - Every decoder has the same methods, each taking the (file-like)
+#       response, so that connect.py does not depend on the format:
+#       - ids: list of record IDs of an eSearch (None if no ID list)
+#       - history: dictionary of the Count / QueryKey / WebEnv / ERROR of
+#           an eSearch stored on the history server (None if missing)
+#       - summaries: generator of the (uid, doc_sum) of an eSummary
+#   - The doc_sum dictionaries are the same for both formats:
+#       - 'clin_sig': clinical significance description (None if missing
+#           or empty, e.g. <description/> or "description": "")
+#       - 'cond': list of condition (trait) names (None if missing)
+#       - 'loc': list of the (chromosome, start, stop) locations on the
+#           ASSEMBLY searched (GRCh37 unless set otherwise)
+#       - 'names': HGVS names of the record (title and variation names)
+#       - 'rs': dbSNP rs numbers of the record (digits only)
+#       (names and rs are used to match records by allele, see matcher.py)
+#   - Newer ClinVar records give the clinical significance as
+#       germline_classification instead of clinical_significance
+#   - JSON is decoded with orjson if it is installed, else with json
+#   - XML is parsed incrementally as it is read (ET.iterparse), and each
+#       DocumentSummary is dropped once turned into a doc_sum, so memory
+#       stays bounded per record instead of per response
+#   - The doc_sum strings are UTF-8 encoded str for both formats (the
+#       parsers give unicode for non-ASCII text), as the output rows are
+#       byte strings
+#   - Decoding errors raise ValueError (JSON) or SyntaxError (XML)
+#
+# Author: Anthony Chen
+##################################################################"""
+#Faster parsers, if they are installed
+try:
+    import orjson as json
+except ImportError:
+    import json
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.cElementTree as ET
+
+#Assembly of the record locations kept in the doc_sum (set through
+#   connect.set_assembly)
+ASSEMBLY = 'GRCh37'
+#Names of the clinical significance element / key, in order of preference
+CLIN_SIG_NAMES = ['clinical_significance', 'germline_classification']
+
+#Return a decoded string as a UTF-8 encoded str (None stays None)
+def utf8(text):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+class JSONDecoder:
+    retmode = 'json'
+
+    #Return the record IDs of an eSearch response
+    def ids(self, response):
+        result = self.load(response).get('esearchresult', {})
+        id_list = result.get('idlist')
+        if id_list is None:
+            return None
+        return [str(Id) for Id in id_list]
+
+    #Return the history server information of an eSearch response
+    def history(self, response):
+        data = self.load(response)
+        result = data.get('esearchresult', {})
+        return {'Count':result.get('count'), 'QueryKey':result.get('querykey'),
+                'WebEnv':result.get('webenv'), 'ERROR':result.get('ERROR', data.get('error'))}
+
+    #Generator over the (uid, doc_sum) of the records of an eSummary response
+    def summaries(self, response):
+        result = self.load(response).get('result', {})
+        for uid in result.get('uids', []):
+            doc = result.get(uid)
+            if doc is None or 'error' in doc: continue
+            yield str(uid), self.doc_sum(doc)
+
+    #Turn the JSON dictionary of a record into a doc_sum
+    def doc_sum(self, doc):
+        doc_sum = {'clin_sig':None, 'cond':None, 'loc':[], 'names':[], 'rs':[]}
+        for name in CLIN_SIG_NAMES:
+            if isinstance(doc.get(name), dict):
+                doc_sum['clin_sig'] = utf8(doc[name].get('description')) or None
+                break
+        #Traits without a name make the conditions unknown, same as XML
+        traits = doc.get('trait_set')
+        if traits is None and isinstance(doc.get('germline_classification'), dict):
+            traits = doc['germline_classification'].get('trait_set')
+        if traits is not None and all('trait_name' in t for t in traits):
+            doc_sum['cond'] = [utf8(t['trait_name']) or None for t in traits]
+        doc_sum['names'] = [utf8(doc['title'])] if doc.get('title') else []
+        doc_sum['rs'] = []
+        for variation in doc.get('variation_set', []):
+            if variation.get('variation_name'):
+                doc_sum['names'].append(utf8(variation['variation_name']))
+            doc_sum['rs'] += [str(xref.get('db_id')) for xref in variation.get('variation_xrefs', []) if xref.get('db_source') == 'dbSNP']
+            for loc in variation.get('variation_loc', []):
+                if loc.get('assembly_name') != ASSEMBLY: continue
+                try:
+                    doc_sum['loc'].append((utf8(loc.get('chr')), int(loc.get('start')), int(loc.get('stop'))))
+                except (TypeError, ValueError): pass
+        return doc_sum
+
+    #Decode a whole response
+    def load(self, response):
+        return json.loads(response.read())
+
+class XMLDecoder:
+    retmode = 'xml'
+
+    #Return the record IDs of an eSearch response
+    def ids(self, response):
+        #ClinVar record IDs of the (first) IdList element
+        id_list = None
+        for event, elem in self.iterparse(response):
+            if event == 'end' and elem.tag == "IdList" and id_list is None:
+                id_list = [Id.text for Id in elem.iter("Id")]
+        return id_list
+
+    #Return the history server information of an eSearch response
+    def history(self, response):
+        #Text of the (first) elements, i.e. the top-level ones
+        fields = {}
+        for event, elem in self.iterparse(response):
+            if event == 'end' and elem.tag in ['WebEnv', 'QueryKey', 'Count', 'ERROR'] and elem.tag not in fields:
+                fields[elem.tag] = elem.text
+        return fields
+
+    #Generator over the (uid, doc_sum) of the records of an eSummary response
+    def summaries(self, response):
+        #Parent of the DocumentSummary elements, to drop them once parsed
+        doc_parent = None
+        for event, elem in self.iterparse(response):
+            if event == 'start':
+                if elem.tag == 'DocumentSummarySet':
+                    doc_parent = elem
+                continue
+            #Each record document found, once it is complete
+            if elem.tag != 'DocumentSummary': continue
+            yield elem.get('uid'), self.doc_sum(elem)
+            #Free the parsed record
+            elem.clear()
+            if doc_parent is not None:
+                doc_parent.remove(elem)
+
+    #Turn a DocumentSummary element into a doc_sum
+    def doc_sum(self, doc):
+        doc_sum = {'clin_sig':None, 'cond':None, 'loc':[], 'names':[], 'rs':[]}
+        for name in CLIN_SIG_NAMES:
+            if doc.find(name) is not None:
+                doc_sum['clin_sig'] = utf8(doc.findtext(name+'/description')) or None
+                break
+        #Traits without a name make the conditions unknown
+        trait_set = doc.find('trait_set')
+        if trait_set is None:
+            trait_set = doc.find('germline_classification/trait_set')
+        if trait_set is not None:
+            names = [t.find('trait_name') for t in trait_set.iter('trait')]
+            if None not in names:
+                doc_sum['cond'] = [utf8(name.text) for name in names]
+        #HGVS names and rs numbers of the record
+        names = [doc.findtext('title')] + [v.findtext('variation_name') for v in doc.iter('variation')]
+        doc_sum['names'] = [utf8(name) for name in names if name]
+        doc_sum['rs'] = [xref.findtext('db_id') for xref in doc.iter('variation_xref') if xref.findtext('db_source') == 'dbSNP']
+        #Store the location(s) of the record on the ASSEMBLY, used to map
+        #   records back to variants in the history server search
+        for assembly in doc.iter('assembly_set'):
+            if assembly.findtext('assembly_name') != ASSEMBLY: continue
+            try:
+                doc_sum['loc'].append((utf8(assembly.findtext('chr')), int(assembly.findtext('start')), int(assembly.findtext('stop'))))
+            except (TypeError, ValueError): pass
+        return doc_sum
+
+    #Parse a response as it is read, yielding the ('start' / 'end', element)
+    #   parse events
+    def iterparse(self, response):
+        return ET.iterparse(response, events=('start', 'end'))
+
+#Decoder of each format, by retmode
+DECODERS = {'json':JSONDecoder(), 'xml':XMLDecoder()}
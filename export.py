@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Helper class to export the search results as a columnar file (Parquet
+#   or Arrow), for loading into pandas / Spark without re-parsing strings
+#
+# Note to self:
+#   - One row per (variant, ClinVar record) pair, instead of the
+#       "[a]|[b]" strings of the .csv files; a variant without records
+#       still gets one row, with a null uid
+#   - Typed columns (see SCHEMA): the conditions are a list of strings,
+#       and nothing is replaced (e.g. ',' -> ';') as in the .csv output
+#   - Rows are buffered and written out as a row group (Parquet) / record
+#       batch (Arrow) every ROW_GROUP_SIZE rows, as the chunks are searched,
+#       so memory use does not grow with the size of the input file
+#   - Needs pyarrow; without it, pyarrow is None and the export is not
+#       available (CV_PathoID.py checks before starting)
+#
+# Author: Anthony Chen
+##################################################################"""
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+#Number of rows per row group / record batch
+ROW_GROUP_SIZE = 100000
+#File extension of each format
+FORMATS = {'parquet':'.parquet', 'arrow':'.arrow'}
+
+#Columns of the exported rows: (name, pyarrow type name)
+COLUMNS = [
+    ('index', 'int64'),         #Index of the variant in the input file
+    ('chromosome', 'string'),
+    ('position', 'int64'),
+    ('gene', 'string'),
+    ('function_type', 'string'),
+    ('annotation', 'string'),
+    ('snp', 'string'),
+    ('searched', 'bool'),       #False if filtered out (e.g. by gene)
+    ('search_failed', 'bool'),  #True if the search of its position failed
+    ('uid', 'int64'),           #ClinVar record ID, null if none found
+    ('clinical_significance', 'string'),
+    ('conditions', 'list<string>'),
+]
+
+#Function to make the pyarrow schema of the exported rows
+def make_schema():
+    types = {'int64':pyarrow.int64(), 'string':pyarrow.string(), 'bool':pyarrow.bool_(),
+             'list<string>':pyarrow.list_(pyarrow.string())}
+    return pyarrow.schema([pyarrow.field(name, types[type_name]) for name, type_name in COLUMNS])
+
+class ColumnarWriter:
+    def __init__(self, filename, file_format='parquet', row_group_size=ROW_GROUP_SIZE):
+        self.filename = filename
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.schema = make_schema()
+        #Buffered rows, by column
+        self.columns = dict((name, []) for name, type_name in COLUMNS)
+        self.n_buffered = 0
+        self.n_rows = 0
+        if file_format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema)
+        else:
+            self.sink = pyarrow.OSFile(filename, 'wb')
+            self.writer = pyarrow.RecordBatchFileWriter(self.sink, self.schema)
+
+    #Add the rows of a list of searched variants
+    def write_variants(self, v_list):
+        for v in v_list:
+            try:
+                position = int(v.position)
+            except (TypeError, ValueError):
+                position = None
+            #A row per record ID (or a single row without one)
+            records = v.recordLib or {}
+            for uid in (v.IdList or [None]):
+                doc_sum = records.get(uid) or {}
+                self.add_row(v.index, v.chromosome, position, v.gene, v.function_type, v.annotation, v.snp,
+                             bool(v.searchable), bool(v.searchable and v.IdList is None), int(uid) if uid is not None else None,
+                             doc_sum.get('clin_sig'), doc_sum.get('cond'))
+
+    #Add a row (values in the order of COLUMNS), writing out the buffered
+    #   rows once there are enough for a row group
+    def add_row(self, *values):
+        for (name, type_name), value in zip(COLUMNS, values):
+            self.columns[name].append(value)
+        self.n_buffered += 1
+        if self.n_buffered >= self.row_group_size:
+            self.flush()
+
+    #Write the buffered rows as a row group / record batch
+    def flush(self):
+        if self.n_buffered == 0:
+            return
+        arrays = [pyarrow.array(self.columns[field.name], type=field.type) for field in self.schema]
+        batch = pyarrow.RecordBatch.from_arrays(arrays, self.schema.names)
+        if self.file_format == 'parquet':
+            self.writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+        self.n_rows += self.n_buffered
+        self.n_buffered = 0
+        for values in self.columns.values():
+            del values[:]
+
+    #Write the remaining rows and close the file
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if self.file_format == 'arrow':
+            self.sink.close()
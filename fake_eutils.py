@@ -0,0 +1,359 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Local stand-in for the ClinVar E-utilities (esearch / esummary), to
+#   test connect.py without going through NCBI
+#
+# Usage:
+#   python fake_eutils.py [--port 8000] [--records summary.xml]
+#   python CV_PathoID.py input.output --eutils-url http://localhost:8000/
+#
+# Note to self:
+#   - Records are either replayed from a recorded eSummary XML file
+#       (i.e. the saved response of an esummary.fcgi request), or are
+#       generated synthetically via --synthetic
+#   - Only the search terms that CV_PathoID.py generates are understood:
+#       "(X[chr]) AND (Y[chrpos37])" and "(X[chr] AND Y[chrpos37])",
+#       OR'd together for the history server search ([chrpos38] alike)
+#   - A record is found by a term if its location on the assembly of the
+#       term (GRCh37 for [chrpos37], GRCh38 for [chrpos38]) spans the
+#       position; synthetic records are placed SYNTHETIC_GRCH38_SHIFT bp
+#       further on GRCh38 than on GRCh37
+#   - Searches with usehistory=y are stored in memory, per WebEnv
+#   - Every record has a modification date (DEFAULT_MODIFIED unless added
+#       or changed with one, see RecordStore.modify), for the date-limited
+#       searches (datetype=mdat, mindate / maxdate) of the refresh
+#   - Responses are XML, or JSON for retmode=json (records are converted
+#       to the fields of the JSON eSummary schema that connect.py reads)
+#   - Connections are kept alive (HTTP/1.1), and responses are gzipped
+#       when the request accepts it
+#   - Faults can be injected to test the retries of transport.py: a delay
+#       before every response (--delay), and a fraction of requests that
+#       get an HTTP 503 / 429 (--error-rate), have their connection dropped
+#       without a response (--drop-rate) or stall for --stall seconds
+#       before responding (--stall-rate)
+#   - With --redirect, every request is answered with an HTTP 301 to the
+#       same path under the given base URL (as NCBI redirects http to https)
+#   - With --rate-limit, requests beyond that many per second get an
+#       HTTP 429, like NCBI does for clients over their request rate
+#
+# Author: Anthony Chen
+##################################################################"""
+import sys
+import re
+import gzip
+import time
+import StringIO
+import random
+import json
+import argparse
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import xml.etree.ElementTree as ET
+
+#Regex to find the (chromosome, position) pairs in an eSearch term
+TERM_REGEX = re.compile(r'([0-9A-Za-z]+)\[chr\]\)?\s+AND\s+\(?(\d+)\[chrpos(37|38)\]')
+#Assembly of each position field
+TERM_ASSEMBLIES = {'37':'GRCh37', '38':'GRCh38'}
+#Offset of the GRCh38 location of the synthetic records from their GRCh37 one
+SYNTHETIC_GRCH38_SHIFT = 5000
+#Modification date (YYYY/MM/DD) of the records added without one
+DEFAULT_MODIFIED = '2020/01/01'
+
+#Record store shared by the request handlers
+class RecordStore:
+    def __init__(self):
+        #XML string and JSON dictionary of each record, by uid
+        self.docs = {}
+        self.json_docs = {}
+        #Modification date of each record
+        self.modified = {}
+        #List of (start, stop, uid) of the records on each chromosome, per
+        #   assembly (locations is the GRCh37 one)
+        self.assemblies = {'GRCh37':{}, 'GRCh38':{}}
+        self.locations = self.assemblies['GRCh37']
+        #Stored history server searches: WebEnv -> list of uid lists
+        self.history = {}
+        #Number of requests made to each tool, of connections opened and of
+        #   faults injected
+        self.request_counts = {'esearch':0, 'esummary':0, 'connections':0, 'faults':0, 'rate_limited':0}
+        #Faults to inject (see inject_fault), drawn from a seeded generator
+        self.faults = {'delay':0.0, 'error_rate':0.0, 'drop_rate':0.0, 'stall_rate':0.0, 'stall':0.0, 'rate_limit':0.0}
+        #Base URL every request is redirected to, if any
+        self.redirect = None
+        #Request times of the last second, for the rate limit
+        self.recent = []
+        self.rng = random.Random(0)
+        self.lock = threading.Lock()
+
+    #Add a record from its DocumentSummary XML element, modified on a date
+    def add(self, doc, modified=DEFAULT_MODIFIED):
+        uid = doc.get('uid')
+        self.docs[uid] = ET.tostring(doc)
+        self.json_docs[uid] = doc_to_json(doc)
+        self.modified[uid] = modified
+        for assembly in doc.iter('assembly_set'):
+            locations = self.assemblies.get(assembly.findtext('assembly_name'))
+            if locations is None: continue
+            locations.setdefault(assembly.findtext('chr'), []).append(
+                (int(assembly.findtext('start')), int(assembly.findtext('stop')), uid))
+
+    #Change the clinical significance of a record, modified on a date
+    def modify(self, uid, clin_sig, modified):
+        doc = ET.fromstring(self.docs[uid])
+        for name in ['clinical_significance', 'germline_classification']:
+            if doc.find(name) is not None:
+                doc.find(name+'/description').text = clin_sig
+        self.docs[uid] = ET.tostring(doc)
+        self.json_docs[uid] = doc_to_json(doc)
+        self.modified[uid] = modified
+
+    #Find the uids of all records spanning a chromosome position of an assembly
+    def search(self, chromo, pos, assembly='GRCh37'):
+        return [uid for start, stop, uid in self.assemblies[assembly].get(chromo, []) if start <= pos <= stop]
+
+#Convert a DocumentSummary XML element to the JSON eSummary record fields
+def doc_to_json(doc):
+    record = {'uid':doc.get('uid')}
+    for name in ['obj_type', 'accession', 'title']:
+        if doc.find(name) is not None:
+            record[name] = doc.findtext(name)
+    for name in ['clinical_significance', 'germline_classification']:
+        if doc.find(name) is not None:
+            record[name] = {'description':doc.findtext(name+'/description')}
+            #Newer records have their traits in the classification
+            if doc.find(name+'/trait_set') is not None:
+                record[name]['trait_set'] = trait_set_to_json(doc.find(name+'/trait_set'))
+    if doc.find('trait_set') is not None:
+        record['trait_set'] = trait_set_to_json(doc.find('trait_set'))
+    record['variation_set'] = []
+    for variation in doc.iter('variation'):
+        record['variation_set'].append({'variation_name':variation.findtext('variation_name', ''),
+            'variation_xrefs':[dict((child.tag, child.text or '') for child in xref)
+                               for xref in variation.iter('variation_xref')],
+            'variation_loc':[dict((child.tag, child.text or '') for child in assembly)
+                             for assembly in variation.iter('assembly_set')]})
+    return record
+
+#Convert a trait_set XML element to the list of JSON trait fields
+def trait_set_to_json(trait_set):
+    return [dict((child.tag, child.text or '') for child in trait) for trait in trait_set.iter('trait')]
+
+#Load the records of a recorded eSummary XML file into the store (parsed
+#   incrementally, each record dropped once added, as the file can be large)
+def load_records(store, filename):
+    for event, elem in ET.iterparse(filename):
+        if elem.tag == 'DocumentSummary':
+            store.add(elem)
+            elem.clear()
+
+#Generate n synthetic records (deterministic for a given seed)
+def synthetic_records(store, n, seed=0):
+    rng = random.Random(seed)
+    significance = ['Pathogenic', 'Likely pathogenic', 'Uncertain significance', 'Likely benign', 'Benign']
+    for i in range(0, n):
+        chromo = str(rng.randint(1, 22))
+        pos = rng.randint(10000, 1000000)
+        store.add(ET.fromstring(synthetic_doc(str(100000+i), chromo, pos, rng.choice(significance), ['Disease %d'%(rng.randint(1, 50))])))
+
+#Build the DocumentSummary XML string of a synthetic record
+def synthetic_doc(uid, chromo, pos, clin_sig, conditions):
+    traits = ''.join(['<trait><trait_name>%s</trait_name></trait>'%(c) for c in conditions])
+    return ('<DocumentSummary uid="%s"><obj_type>single nucleotide variant</obj_type>'
+            '<accession>VCV%09d</accession><title>NM_%06d.1:c.%dA&gt;G</title>'
+            '<variation_set><variation><variation_name>NM_%06d.1:c.%dA&gt;G</variation_name>'
+            '<variation_xrefs><variation_xref><db_source>dbSNP</db_source><db_id>%s</db_id></variation_xref></variation_xrefs>'
+            '<variation_loc><assembly_set><status>previous</status><assembly_name>GRCh37</assembly_name>'
+            '<chr>%s</chr><start>%d</start><stop>%d</stop></assembly_set>'
+            '<assembly_set><status>current</status><assembly_name>GRCh38</assembly_name>'
+            '<chr>%s</chr><start>%d</start><stop>%d</stop></assembly_set></variation_loc>'
+            '</variation></variation_set>'
+            '<trait_set>%s</trait_set>'
+            '<clinical_significance><description>%s</description></clinical_significance>'
+            '</DocumentSummary>')%(uid, int(uid), int(uid), pos, int(uid), pos, uid, chromo, pos, pos,
+              chromo, pos+SYNTHETIC_GRCH38_SHIFT, pos+SYNTHETIC_GRCH38_SHIFT, traits, clin_sig)
+
+#Handler for the esearch.fcgi and esummary.fcgi requests
+class EUtilsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    #Keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.store.lock:
+            self.server.store.request_counts['connections'] += 1
+
+    def do_GET(self):
+        self.handle_query(urlparse.urlparse(self.path).query)
+
+    def do_POST(self):
+        self.handle_query(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+
+    def handle_query(self, query):
+        if self.server.store.redirect:
+            self.send_response(301)
+            self.send_header('Location', self.server.store.redirect.rstrip('/') + self.path)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.inject_fault():
+            return
+        params = dict((k, v[0]) for k, v in urlparse.parse_qs(query).iteritems())
+        tool = urlparse.urlparse(self.path).path.rstrip('/').split('/')[-1]
+        if tool == 'esearch.fcgi':
+            body = self.esearch(params)
+        elif tool == 'esummary.fcgi':
+            body = self.esummary(params)
+        else:
+            self.send_error(404)
+            return
+        if params.get('retmode') == 'json':
+            body = json.dumps(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json' if params.get('retmode') == 'json' else 'text/xml')
+        if 'gzip' in self.headers.getheader('accept-encoding', ''):
+            buf = StringIO.StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(body)
+            f.close()
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #Delay the response, and maybe fail the request; returns True if the
+    #   request was failed (nothing else should be sent)
+    def inject_fault(self):
+        store = self.server.store
+        faults = store.faults
+        with store.lock:
+            draw = store.rng.random()
+            if draw < faults['error_rate'] + faults['drop_rate'] + faults['stall_rate']:
+                store.request_counts['faults'] += 1
+            #Count the requests of the last second against the rate limit
+            now = time.time()
+            store.recent = [t for t in store.recent if t > now - 1.0]
+            limited = faults['rate_limit'] > 0 and len(store.recent) >= faults['rate_limit']
+            if limited:
+                store.request_counts['rate_limited'] += 1
+            else:
+                store.recent.append(now)
+        time.sleep(faults['delay'])
+        if limited or draw < faults['error_rate']:
+            status = 503 if not limited and draw < faults['error_rate']/2 else 429
+            self.send_response(status)
+            self.send_header('Retry-After', '1' if limited else '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+        draw -= faults['error_rate']
+        if draw < faults['drop_rate']:
+            self.close_connection = 1
+            return True
+        draw -= faults['drop_rate']
+        if draw < faults['stall_rate']:
+            time.sleep(faults['stall'])
+        return False
+
+    def esearch(self, params):
+        store = self.server.store
+        #Find all records matching any of the OR'd terms
+        uids = []
+        for chromo, pos, build in TERM_REGEX.findall(params.get('term', '')):
+            for uid in store.search(chromo, int(pos), TERM_ASSEMBLIES[build]):
+                if uid not in uids:
+                    uids.append(uid)
+        #Only the records modified in the date range, if given
+        if params.get('datetype') == 'mdat' and params.get('mindate'):
+            maxdate = params.get('maxdate', '9999/12/31')
+            uids = [uid for uid in uids if params['mindate'] <= store.modified[uid] <= maxdate]
+        retmax = int(params.get('retmax', 20))
+        history = ''
+        result = {'count':str(len(uids)), 'retmax':str(min(retmax, len(uids))), 'retstart':'0',
+                  'idlist':uids[:retmax]}
+        with store.lock:
+            store.request_counts['esearch'] += 1
+            #Store the search on the history server, if wanted
+            if params.get('usehistory') == 'y':
+                web_env = params.get('WebEnv') or 'FAKE_WEBENV_%d'%(len(store.history)+1)
+                store.history.setdefault(web_env, []).append(uids)
+                history = '<QueryKey>%d</QueryKey><WebEnv>%s</WebEnv>'%(len(store.history[web_env]), web_env)
+                result['querykey'] = str(len(store.history[web_env]))
+                result['webenv'] = web_env
+        if params.get('retmode') == 'json':
+            return {'header':{'type':'esearch'}, 'esearchresult':result}
+        id_list = ''.join(['<Id>%s</Id>'%(uid) for uid in uids[:retmax]])
+        return ('<?xml version="1.0" encoding="UTF-8" ?>\n<eSearchResult><Count>%d</Count><RetMax>%d</RetMax>'
+                '<RetStart>0</RetStart>%s<IdList>%s</IdList></eSearchResult>')%(len(uids), min(retmax, len(uids)), history, id_list)
+
+    def esummary(self, params):
+        store = self.server.store
+        with store.lock:
+            store.request_counts['esummary'] += 1
+            #Records either come from the history server or from the ID list
+            if 'WebEnv' in params:
+                try:
+                    uids = store.history[params['WebEnv']][int(params['query_key'])-1]
+                except (KeyError, IndexError, ValueError):
+                    if params.get('retmode') == 'json':
+                        return {'error':'Invalid query_key or WebEnv'}
+                    return '<eSummaryResult><ERROR>Invalid query_key or WebEnv</ERROR></eSummaryResult>'
+                retstart = int(params.get('retstart', 0))
+                uids = uids[retstart:retstart+int(params.get('retmax', 20))]
+            else:
+                uids = [uid for uid in params.get('id', '').split(',') if uid]
+        if params.get('retmode') == 'json':
+            result = {'uids':[uid for uid in uids if uid in store.json_docs]}
+            for uid in result['uids']:
+                result[uid] = store.json_docs[uid]
+            return {'header':{'type':'esummary'}, 'result':result}
+        docs = ''.join([store.docs[uid] for uid in uids if uid in store.docs])
+        return ('<?xml version="1.0" encoding="UTF-8" ?>\n<eSummaryResult>'
+                '<DocumentSummarySet status="OK">%s</DocumentSummarySet></eSummaryResult>')%(docs)
+
+    #Keep the console quiet
+    def log_message(self, format, *args):
+        pass
+
+class EUtilsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+#Create (but do not start) a stand-in server on the given port; a port of 0
+#   picks a free port, see server.server_address
+def make_server(store, port=0, host='127.0.0.1'):
+    server = EUtilsServer((host, port), EUtilsHandler)
+    server.store = store
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the ClinVar E-utilities.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--records', help="recorded eSummary XML file to replay")
+    parser.add_argument('--synthetic', type=int, default=0, help="number of synthetic records to generate")
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait before every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with HTTP 503 / 429")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="fraction of requests whose connection is dropped without a response")
+    parser.add_argument('--stall-rate', type=float, default=0.0, help="fraction of requests that stall for --stall seconds")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="requests per second allowed before answering HTTP 429 (default: no limit)")
+    parser.add_argument('--redirect', help="base URL to redirect every request to, with an HTTP 301")
+    parser.add_argument('--stall', type=float, default=120.0, help="seconds a stalled request waits (default: %(default)s)")
+    args = parser.parse_args()
+    store = RecordStore()
+    for name in store.faults:
+        store.faults[name] = getattr(args, name)
+    store.redirect = args.redirect
+    if args.records:
+        load_records(store, args.records)
+    synthetic_records(store, args.synthetic)
+    server = make_server(store, args.port)
+    print "[Program] Serving %d records at http://%s:%d/"%(len(store.docs), server.server_address[0], server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print "[Program] Requests made: %s"%(store.request_counts)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Helper functions to keep only the ClinVar records that match the allele
+#   change of each variant (--match allele), instead of every record at
+#   its position
+#
+# Note to self:
+#   - The eSearch is by position ([chr] / [chrpos37]), so a multi-allelic
+#       site finds the records of every allele there; the records are
+#       matched to the variant afterwards, by either:
+#       - rs number: the variant SNP column against the dbSNP xrefs of
+#           the record (doc_sum 'rs')
+#       - HGVS: the formatted annotations of the variant (anno_list)
+#           against the variation names of the record (doc_sum 'names'),
+#           both reduced to a (transcript without version, c. change) key,
+#           e.g. "NM_003140:c.593A>C"; the transcript version is dropped
+#           as format_annotation puts the exon number in its place
+#   - A record matching by either is kept. Records without any rs number
+#       or name (e.g. cached before these were stored) are kept too, as
+#       they cannot be ruled out, and so are all records of a variant
+#       without an rs number or HGVS annotation
+#   - Matching is done on a whole list of variants at once, through hash
+#       indexes (rs number / HGVS key -> uids) built once from all of
+#       their records, so each variant is a few dictionary lookups
+#
+# Author: Anthony Chen
+##################################################################"""
+import re
+
+#(Transcript accession, c. change) of an HGVS name, e.g. from
+#   "NM_003140.3(SRY):c.593A>C (p.Tyr198Ser)" or "NM_003140.1:c.593A>C"
+HGVS_REGEX = re.compile(r'([NX][MR]_\d+)(?:\.\d+)?(?:\([^)]*\))?:(c\.[^\s(]+)')
+
+#Function to get the HGVS keys of a list of names / annotations
+def hgvs_keys(names):
+    keys = set()
+    for name in names:
+        for accession, change in HGVS_REGEX.findall(name):
+            keys.add(accession + ':' + change)
+    return keys
+
+#Function to get the rs number (digits only) of a SNP column, e.g. "rs123",
+#   or None if there is none
+def rs_key(snp):
+    match = re.search(r'rs(\d+)', snp or '')
+    return match.group(1) if match is not None else None
+
+#Function to build the hash indexes of a set of records (uid -> doc_sum):
+#   rs number -> uids, HGVS key -> uids, and the uids without either
+def build_indexes(records):
+    rs_index = {}
+    hgvs_index = {}
+    unknown = set()
+    for uid, doc_sum in records.iteritems():
+        rs_list = doc_sum.get('rs') or []
+        keys = hgvs_keys(doc_sum.get('names') or [])
+        if not rs_list and not keys:
+            unknown.add(uid)
+        for rs in rs_list:
+            rs_index.setdefault(rs, set()).add(uid)
+        for key in keys:
+            hgvs_index.setdefault(key, set()).add(uid)
+    return rs_index, hgvs_index, unknown
+
+#Function to keep, for every variant of a list, only the records matching its
+#   allele change (IdList and recordLib are filtered in place); returns the
+#   number of records dropped
+def match_variants(v_list):
+    #All of the records found for the variants, indexed once
+    records = {}
+    for v in v_list:
+        if v.recordLib is not None:
+            records.update(v.recordLib)
+    rs_index, hgvs_index, unknown = build_indexes(records)
+    dropped = 0
+    for v in v_list:
+        if not v.IdList or v.recordLib is None: continue
+        rs = rs_key(v.snp)
+        keys = hgvs_keys(v.anno_list or [])
+        if rs is None and not keys: continue
+        matched = set(unknown)
+        if rs is not None:
+            matched.update(rs_index.get(rs, ()))
+        for key in keys:
+            matched.update(hgvs_index.get(key, ()))
+        id_list = [uid for uid in v.IdList if uid in matched]
+        if len(id_list) == len(v.IdList): continue
+        dropped += len(v.IdList) - len(id_list)
+        v.IdList = id_list
+        #A variant left without records is reported as no items found
+        v.recordLib = dict((uid, v.recordLib[uid]) for uid in id_list if uid in v.recordLib) or None
+    return dropped
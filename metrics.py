@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Helper functions to instrument a run: per-stage timers and request
+#   statistics, reported at the end as JSON or as a Prometheus textfile
+#
+# Note to self:
+#   - Stages (read, format, esearch, esummary, ...) are timed with the
+#       stage() context manager, for both wall and CPU (user + system)
+#       time; a stage may run inside another one (e.g. decode inside
+#       esearch), and stages run by the worker threads add up their time
+#   - Requests are recorded by transport.Session: latency (as a
+#       histogram, see LATENCY_BUCKETS), bytes received and status, per
+#       tool (esearch / esummary), plus the time slept in the rate limiter
+#   - The cache hit rates and retries are read from connect.CACHE and
+#       connect.SESSION when the report is made
+#   - Only the main process is measured; in batch mode the reading,
+#       formatting and writing of the pool processes are not included
+#   - Everything is module-level (like connect.py's globals) and guarded
+#       by a lock, as the requests come from several threads
+#
+# Author: Anthony Chen
+##################################################################"""
+import os
+import time
+import json
+import threading
+import contextlib
+
+#Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+#Wall / CPU time and number of calls of each stage, in first-seen order
+STAGES = {}
+STAGE_ORDER = []
+#Request statistics of each tool
+REQUESTS = {}
+#Time slept in the rate limiter, and number of waits
+THROTTLE = {'seconds':0.0, 'waits':0}
+#Start time of the run
+START = time.time()
+LOCK = threading.Lock()
+
+#Function to get the CPU (user + system) time of the process
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+#Context manager that times a stage
+@contextlib.contextmanager
+def stage(name):
+    wall = time.time()
+    cpu = cpu_time()
+    try:
+        yield
+    finally:
+        add_stage(name, time.time() - wall, cpu_time() - cpu)
+
+#Generator that times the iteration of an iterable as a stage (e.g. reading
+#   the input file chunk by chunk)
+def timed_iter(name, iterable):
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+#Function to add the time of a stage
+def add_stage(name, wall, cpu):
+    with LOCK:
+        if name not in STAGES:
+            STAGES[name] = {'wall_seconds':0.0, 'cpu_seconds':0.0, 'calls':0}
+            STAGE_ORDER.append(name)
+        STAGES[name]['wall_seconds'] += wall
+        STAGES[name]['cpu_seconds'] += cpu
+        STAGES[name]['calls'] += 1
+
+#Function to record a request: its tool, latency (seconds), bytes received
+#   and HTTP status (None if it failed without one)
+def record_request(tool, latency, n_bytes, status):
+    with LOCK:
+        if tool not in REQUESTS:
+            REQUESTS[tool] = {'count':0, 'errors':0, 'bytes':0, 'latency_sum':0.0,
+                              'latency_buckets':[0]*len(LATENCY_BUCKETS)}
+        stats = REQUESTS[tool]
+        stats['count'] += 1
+        stats['bytes'] += n_bytes
+        stats['latency_sum'] += latency
+        if status != 200:
+            stats['errors'] += 1
+        for i in range(0, len(LATENCY_BUCKETS)):
+            if latency <= LATENCY_BUCKETS[i]:
+                stats['latency_buckets'][i] += 1
+                break
+
+#Function to record the time slept in the rate limiter
+def record_throttle(seconds):
+    with LOCK:
+        THROTTLE['seconds'] += seconds
+        THROTTLE['waits'] += 1 if seconds > 0 else 0
+
+#Function to gather everything measured into a dictionary; the cache and
+#   session are the ones of connect.py (None if not used)
+def make_report(cache=None, session=None):
+    report = {'run_seconds':time.time() - START,
+              'stages':[dict(name=name, **STAGES[name]) for name in STAGE_ORDER],
+              'requests':{}, 'throttle':dict(THROTTLE)}
+    for tool, stats in REQUESTS.iteritems():
+        report['requests'][tool] = dict(stats)
+        report['requests'][tool]['latency_buckets'] = dict(zip([str(b) for b in LATENCY_BUCKETS], stats['latency_buckets']))
+        report['requests'][tool]['latency_mean'] = stats['latency_sum'] / stats['count'] if stats['count'] else 0.0
+    if session is not None:
+        report['connections'] = session.stats['connections']
+        report['retries'] = session.stats['retries']
+    if cache is not None:
+        report['cache'] = {}
+        for table in ['esearch', 'esummary']:
+            total = cache.hits[table] + cache.misses[table]
+            report['cache'][table] = {'hits':cache.hits[table], 'misses':cache.misses[table],
+                                      'hit_rate':float(cache.hits[table]) / total if total else 0.0}
+    return report
+
+#Function to write the report to a file: a Prometheus textfile if its name
+#   ends with .prom, else JSON
+def write_report(filename, cache=None, session=None):
+    report = make_report(cache, session)
+    f = open(filename, 'w')
+    try:
+        if filename.endswith('.prom'):
+            f.write(prometheus_text(report))
+        else:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+    finally:
+        f.close()
+    print "[Program] Metrics written to %s" % (filename)
+
+#Function to format a report in the Prometheus text exposition format
+def prometheus_text(report):
+    lines = []
+    def metric(name, kind, help_text, samples):
+        lines.append('# HELP clinvar_%s %s' % (name, help_text))
+        lines.append('# TYPE clinvar_%s %s' % (name, kind))
+        for labels, value in samples:
+            label_text = ','.join(['%s="%s"' % (k, v) for k, v in labels])
+            lines.append('clinvar_%s%s %r' % (name, '{%s}' % (label_text) if label_text else '', value))
+    metric('run_seconds', 'gauge', 'Wall time of the run.', [([], report['run_seconds'])])
+    metric('stage_wall_seconds', 'counter', 'Wall time spent in each stage.',
+           [([('stage', s['name'])], s['wall_seconds']) for s in report['stages']])
+    metric('stage_cpu_seconds', 'counter', 'CPU time spent in each stage.',
+           [([('stage', s['name'])], s['cpu_seconds']) for s in report['stages']])
+    metric('throttle_seconds', 'counter', 'Time slept in the rate limiter.', [([], report['throttle']['seconds'])])
+    metric('request_bytes', 'counter', 'Response bytes received.',
+           [([('tool', tool)], stats['bytes']) for tool, stats in sorted(report['requests'].items())])
+    metric('request_errors', 'counter', 'Requests without an HTTP 200 response.',
+           [([('tool', tool)], stats['errors']) for tool, stats in sorted(report['requests'].items())])
+    #Latency histogram, with cumulative buckets
+    lines.append('# HELP clinvar_request_latency_seconds Latency of the requests.')
+    lines.append('# TYPE clinvar_request_latency_seconds histogram')
+    for tool, stats in sorted(report['requests'].items()):
+        count = 0
+        for bound in LATENCY_BUCKETS:
+            count += stats['latency_buckets'][str(bound)]
+            lines.append('clinvar_request_latency_seconds_bucket{tool="%s",le="%s"} %d' % (tool, bound, count))
+        lines.append('clinvar_request_latency_seconds_bucket{tool="%s",le="+Inf"} %d' % (tool, stats['count']))
+        lines.append('clinvar_request_latency_seconds_sum{tool="%s"} %r' % (tool, stats['latency_sum']))
+        lines.append('clinvar_request_latency_seconds_count{tool="%s"} %d' % (tool, stats['count']))
+    if 'retries' in report:
+        metric('retries', 'counter', 'Requests retried.', [([], report['retries'])])
+    for table, stats in sorted(report.get('cache', {}).items()):
+        metric('cache_%s_hits' % (table), 'counter', 'Cache hits.', [([], stats['hits'])])
+        metric('cache_%s_misses' % (table), 'counter', 'Cache misses.', [([], stats['misses'])])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,452 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Offline local ClinVar index, built from a downloaded ClinVar dump, to
+#   search variants without going through the E-utilities (e.g. on
+#   machines without internet access)
+#
+# Usage:
+#   python offline.py variant_summary.txt.gz [-o ClinVar_index.cvx] [--assembly GRCh38]
+#   python offline.py clinvar.vcf.gz [-o ClinVar_index.cvx] [--sqlite]
+#   python CV_PathoID.py input.output --offline ClinVar_index.cvx [--window N]
+#
+# Note to self:
+#   - The dump is either the tab-delimited variant_summary.txt(.gz) or the
+#       ClinVar VCF (clinvar.vcf(.gz)), told apart by the file name
+#       - An index holds the locations of a single assembly (--assembly,
+#           GRCh37 by default), which the input positions must be on:
+#           only the rows of that assembly of variant_summary are kept,
+#           and the VCF must be the one of that assembly (checked against
+#           its ##reference header line, when there is one)
+#       - The record uid is the VariationID (the same uid as eSummary)
+#   - Two formats, with the same lookups (see open_index):
+#       - Mapped (default): a single binary file that is memory-mapped, so
+#           opening it costs nothing and only the pages touched are read:
+#           - header (with the assembly), then the chromosome names
+#               (tab-separated); indexes of the first version (CVIDX001)
+#               have no assembly in their header, and are GRCh37
+#           - location entries (key, stop, uid) sorted by key, where the
+#               key is (chromosome code << 32) + start, of the records
+#               spanning at most LONG_SPAN bp
+#           - long location entries: same, for the longer records (none in
+#               indexes before CVIDX003, which have all records in the
+#               location entries)
+#           - uid entries (uid, offset, length) sorted by uid, pointing
+#               into the record blob
+#           - record blob: doc_sum dictionary of each uid (pickled)
+#       - SQLite (--sqlite) with four tables:
+#           - location: (chromosome, start, stop) of each record spanning
+#               at most LONG_SPAN bp
+#           - long_location: same, for the longer records (e.g. large CNVs)
+#           - record: doc_sum dictionary per uid (pickled)
+#           - meta: max_span (of long_location), long_span (LONG_SPAN when
+#               built), source and assembly; indexes built before
+#               long_location have no long_span, and all of their records
+#               in location
+#   - The doc_sum dictionaries have the same shape as
+#       connect.eSummary_getResult returns
+#   - Like eSearch, a position finds every record whose location spans it
+#       (the widest record span is kept to bound the range lookup); with
+#       a window, every record within window bp of it is found too
+#   - The few records longer than LONG_SPAN are kept apart, so that the
+#       range lookup of the others only goes LONG_SPAN bp back instead of
+#       the span of the widest record (a single CNV spanning a whole
+#       chromosome would make every lookup scan that chromosome)
+#   - Lookups in position order gallop forward from the previous lookup
+#       instead of binary searching the whole file
+#
+# Author: Anthony Chen
+##################################################################"""
+import sys
+import re
+import gzip
+import mmap
+import struct
+import bisect
+import sqlite3
+import cPickle
+import argparse
+#User-created files
+import connect
+import vcfreader
+
+#Default index file (in the local directory)
+INDEX_FILE = "ClinVar_index.cvx"
+#Records within this many bp of a position are found too (0 for the
+#   records spanning the position only, same as eSearch)
+WINDOW = 0
+#Layout of the mapped index file: header (magic, max span, entry count,
+#   entry offset, uid count, uid offset, assembly, then the max span,
+#   count and offset of the long entries), location entries, long location
+#   entries and uid entries; the header of the second version has no long
+#   entries, and that of the first no assembly either
+MAPPED_MAGIC = "CVIDX003"
+MAPPED_HEADER = struct.Struct('<8sIQQQQ8sIQQ')
+MAPPED_MAGIC_V2 = "CVIDX002"
+MAPPED_HEADER_V2 = struct.Struct('<8sIQQQQ8s')
+MAPPED_MAGIC_V1 = "CVIDX001"
+MAPPED_HEADER_V1 = struct.Struct('<8sIQQQQ')
+MAPPED_ENTRY = struct.Struct('<QII')
+MAPPED_UID = struct.Struct('<IQI')
+#Number of rows inserted at a time while building the index
+INSERT_BATCH_SIZE = 10000
+#Records spanning more than this many bp are indexed apart from the others
+LONG_SPAN = 10000
+
+class LocalIndex:
+    #Open an index built by build_index
+    def __init__(self, filename=INDEX_FILE):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        row = self.conn.execute("SELECT value FROM meta WHERE name='max_span'").fetchone()
+        self.max_span = int(row[0]) if row is not None else 0
+        row = self.conn.execute("SELECT value FROM meta WHERE name='assembly'").fetchone()
+        self.assembly = row[0] if row is not None else 'GRCh37'
+        #Widest span of each location table (only location in older indexes)
+        row = self.conn.execute("SELECT value FROM meta WHERE name='long_span'").fetchone()
+        if row is not None:
+            self.spans = [('location', int(row[0])), ('long_location', self.max_span)]
+        else:
+            self.spans = [('location', self.max_span)]
+
+    #Return the uids of the records spanning a (chromosome, position) key,
+    #   or lying within window bp of it
+    def get_ids(self, key, window=0):
+        uids = set()
+        for table, max_span in self.spans:
+            rows = self.conn.execute("SELECT uid FROM %s WHERE chromosome=? AND start BETWEEN ? AND ? AND stop>=?"%(table),
+                (key[0], key[1] - window - max_span, key[1] + window, key[1] - window)).fetchall()
+            uids.update([row[0] for row in rows])
+        return [str(uid) for uid in sorted(uids)]
+
+    #Return the doc_sum of a uid, or None if missing
+    def get_summary(self, uid):
+        row = self.conn.execute("SELECT doc FROM record WHERE uid=?", (uid,)).fetchone()
+        if row is None:
+            return None
+        return cPickle.loads(str(row[0]))
+
+    #Close the index file
+    def close(self):
+        self.conn.close()
+
+class MappedIndex:
+    #Open an index built by build_mapped_index; only the header and the
+    #   chromosome names are read, the rest is paged in by the lookups
+    def __init__(self, filename=INDEX_FILE):
+        self.filename = filename
+        self.f = open(filename, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self.mm[:len(MAPPED_MAGIC)]
+        #Widest span, count and offset of the long location entries
+        self.long_span, self.n_long, self.long_offset = 0, 0, 0
+        if magic == MAPPED_MAGIC:
+            header = MAPPED_HEADER
+            fields = header.unpack_from(self.mm, 0)
+            self.assembly = fields[6].rstrip('\0')
+            self.long_span, self.n_long, self.long_offset = fields[7:10]
+        elif magic == MAPPED_MAGIC_V2:
+            header = MAPPED_HEADER_V2
+            fields = header.unpack_from(self.mm, 0)
+            self.assembly = fields[6].rstrip('\0')
+        elif magic == MAPPED_MAGIC_V1:
+            header = MAPPED_HEADER_V1
+            fields = header.unpack_from(self.mm, 0)
+            self.assembly = 'GRCh37'
+        else:
+            raise ValueError("'%s' is not a mapped ClinVar index"%(filename))
+        self.max_span, self.n_entries, self.entries_offset, self.n_uids, self.uids_offset = fields[1:6]
+        #Code of each chromosome name (its index in the name list)
+        names_length = struct.unpack_from('<I', self.mm, header.size)[0]
+        names_offset = header.size + 4
+        names = self.mm[names_offset:names_offset+names_length].split('\t')
+        self.codes = dict((name, code) for code, name in enumerate(names))
+        #Sorted location and uid keys, as sequences that bisect can search
+        self.entry_keys = MappedKeys(self.mm, self.entries_offset, MAPPED_ENTRY, self.n_entries)
+        self.long_keys = MappedKeys(self.mm, self.long_offset, MAPPED_ENTRY, self.n_long)
+        self.uid_keys = MappedKeys(self.mm, self.uids_offset, MAPPED_UID, self.n_uids)
+        #Entry found by the last lookup; lookups in position order continue
+        #   from it (i.e. a merge-join with a sorted input)
+        self.cursor = 0
+
+    #Return the uids of the records spanning a (chromosome, position) key,
+    #   or lying within window bp of it
+    def get_ids(self, key, window=0):
+        code = self.codes.get(key[0])
+        if code is None:
+            return []
+        high = (code << 32) + key[1] + window
+        uids = set()
+        #The location entries, from the previous lookup on
+        i = self.lower_bound((code << 32) + max(0, key[1] - window - self.max_span))
+        self.scan(self.entries_offset, self.n_entries, i, high, key[1] - window, uids)
+        #The (few) long location entries
+        if self.n_long != 0:
+            i = bisect.bisect_left(self.long_keys, (code << 32) + max(0, key[1] - window - self.long_span))
+            self.scan(self.long_offset, self.n_long, i, high, key[1] - window, uids)
+        return [str(uid) for uid in sorted(uids)]
+
+    #Add the uids of the entries from the i-th one up to a key of high that
+    #   stop at min_stop or after it
+    def scan(self, offset, count, i, high, min_stop, uids):
+        while i < count:
+            entry_key, stop, uid = MAPPED_ENTRY.unpack_from(self.mm, offset + i*MAPPED_ENTRY.size)
+            if entry_key > high: break
+            if stop >= min_stop:
+                uids.add(uid)
+            i += 1
+
+    #Return the doc_sum of a uid, or None if missing
+    def get_summary(self, uid):
+        uid = int(uid)
+        i = bisect.bisect_left(self.uid_keys, uid)
+        if i == self.n_uids or self.uid_keys[i] != uid:
+            return None
+        uid, offset, length = MAPPED_UID.unpack_from(self.mm, self.uids_offset + i*MAPPED_UID.size)
+        return cPickle.loads(self.mm[offset:offset+length])
+
+    #Find the first entry with a key of at least low: galloping forward from
+    #   the cursor if low is past it, else a binary search before it
+    def lower_bound(self, low):
+        start = self.cursor
+        if start < self.n_entries and self.entry_keys[start] < low:
+            step = 1
+            while start + step < self.n_entries and self.entry_keys[start + step] < low:
+                start += step
+                step *= 2
+            end = min(start + step, self.n_entries)
+        else:
+            start, end = 0, min(start + 1, self.n_entries)
+        self.cursor = bisect.bisect_left(self.entry_keys, low, start, end)
+        return self.cursor
+
+    #Close the index file
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+#Read-only sequence of the first (key) field of fixed-size entries in a
+#   memory-mapped file, so that bisect can search it in place
+class MappedKeys:
+    def __init__(self, mm, offset, entry, count):
+        self.mm = mm
+        self.offset = offset
+        self.entry = entry
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return self.entry.unpack_from(self.mm, self.offset + i*self.entry.size)[0]
+
+#Open a local index of either format (told apart by the start of the file)
+def open_index(filename):
+    f = open(filename, 'rb')
+    magic = f.read(len(MAPPED_MAGIC))
+    f.close()
+    if magic in [MAPPED_MAGIC, MAPPED_MAGIC_V2, MAPPED_MAGIC_V1]:
+        return MappedIndex(filename)
+    return LocalIndex(filename)
+
+#Search a list of variants in the local index; same results as the eSearch
+#   and eSummary stages of connect.py (with a window of 0), with each unique
+#   position looked up once. Always returns 0 (success)
+def ClinVar_Local_Search(v_list, index, window=None):
+    if window is None:
+        window = WINDOW
+    #Skip the variants already resolved (i.e. resumed from a checkpoint)
+    key_map, keys = connect.location_index(v_list, lambda v: v.IdList is None or (len(v.IdList) != 0 and v.recordLib is None))
+    print "\t%d unique positions from %d variants"%(len(keys), sum([len(key_map[key]) for key in keys]))
+    #Records already looked up, by uid
+    docs = {}
+    found = 0
+    for key in keys:
+        id_list = index.get_ids(key, window)
+        for uid in id_list:
+            if uid not in docs:
+                docs[uid] = index.get_summary(uid)
+        for i in key_map[key]:
+            v_list[i].IdList = list(id_list)
+            v_list[i].recordLib = None
+            if len(id_list) != 0:
+                v_list[i].recordLib = dict((uid, docs[uid]) for uid in id_list)
+                found += 1
+    print "[Program] Local index search found records for %d of %d variants."%(found, sum([len(key_map[key]) for key in keys]))
+    return 0
+
+"""################## Building the index ##################"""
+#Function to open a (possibly gzipped) dump file
+def open_dump(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'r')
+
+#Generator over the records of variant_summary.txt on an assembly; yields
+#   (uid, chromosome, start, stop, clinical significance, conditions, HGVS
+#   names, rs numbers)
+def iter_variant_summary(filename, assembly='GRCh37'):
+    f = open_dump(filename)
+    try:
+        #Map the columns by their header name
+        header = f.readline().rstrip('\r\n').lstrip('#').split('\t')
+        col = dict((name, i) for i, name in enumerate(header))
+        for row in f:
+            cols = row.rstrip('\r\n').split('\t')
+            if len(cols) < len(header) or cols[col['Assembly']] != assembly: continue
+            if not cols[col['VariationID']].isdigit(): continue
+            try:
+                start = int(cols[col['Start']])
+                stop = int(cols[col['Stop']])
+            except ValueError: continue
+            conds = [c for c in re.split(r'[|;]', cols[col['PhenotypeList']]) if c and c != '-']
+            #HGVS name and rs number (-1 if none), for matching by allele
+            names = [cols[col['Name']]] if 'Name' in col and cols[col['Name']] not in ['', '-'] else []
+            rs = [cols[col['RS# (dbSNP)']]] if 'RS# (dbSNP)' in col and cols[col['RS# (dbSNP)']].isdigit() else []
+            yield (cols[col['VariationID']], cols[col['Chromosome']], start, stop, cols[col['ClinicalSignificance']], conds, names, rs)
+    finally:
+        f.close()
+
+#Generator over the records of the ClinVar VCF of an assembly; yields
+#   (uid, chromosome, start, stop, clinical significance, conditions, HGVS
+#   names, rs numbers). Raises ValueError if the VCF header gives another
+#   assembly
+def iter_vcf(filename, assembly='GRCh37'):
+    f = open_dump(filename)
+    meta_lines = []
+    try:
+        for row in f:
+            if row.startswith('##'):
+                meta_lines.append(row.rstrip('\r\n'))
+                continue
+            if row.startswith('#'):
+                vcf_assembly = vcfreader.header_assembly(meta_lines)
+                if vcf_assembly is not None and vcf_assembly != assembly:
+                    raise ValueError("'%s' is a %s VCF, not %s"%(filename, vcf_assembly, assembly))
+                continue
+            cols = row.rstrip('\r\n').split('\t')
+            if len(cols) < 8 or not cols[2].isdigit(): continue
+            info = dict(field.split('=', 1) for field in cols[7].split(';') if '=' in field)
+            start = int(cols[1])
+            #The INFO values use underscores in place of spaces
+            clin_sig = info.get('CLNSIG', '').replace('_', ' ')
+            conds = [c.replace('_', ' ') for c in re.split(r'[|,]', info.get('CLNDN', '')) if c and c != '.']
+            #rs number(s), for matching by allele (the VCF has no c. names)
+            rs = [r for r in info.get('RS', '').split('|') if r.isdigit()]
+            yield (cols[2], cols[0], start, start+len(cols[3])-1, clin_sig, conds, [], rs)
+    finally:
+        f.close()
+
+#Generator over the records of a ClinVar dump of either type, on an assembly
+def iter_dump(filename, assembly='GRCh37'):
+    if re.search(r'\.vcf(\.gz)?$', filename):
+        return iter_vcf(filename, assembly)
+    return iter_variant_summary(filename, assembly)
+
+#Build (or rebuild) the SQLite index file of an assembly from a ClinVar
+#   dump; returns the number of records indexed
+def build_index(dump_file, filename=INDEX_FILE, assembly='GRCh37'):
+    records = iter_dump(dump_file, assembly)
+    conn = sqlite3.connect(filename)
+    for table in ['meta', 'location', 'long_location', 'record']:
+        conn.execute("DROP TABLE IF EXISTS %s"%(table))
+    conn.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE location (chromosome TEXT, start INTEGER, stop INTEGER, uid INTEGER)")
+    conn.execute("CREATE TABLE long_location (chromosome TEXT, start INTEGER, stop INTEGER, uid INTEGER)")
+    conn.execute("CREATE TABLE record (uid TEXT PRIMARY KEY, doc BLOB)")
+    #doc_sum of each uid, with all of its locations
+    docs = {}
+    locations = []
+    long_locations = []
+    max_span = 0
+    for uid, chromo, start, stop, clin_sig, conds, names, rs in records:
+        chromo, start = connect.location_key(chromo, start)
+        if uid not in docs:
+            docs[uid] = {'clin_sig':clin_sig or None, 'cond':conds, 'loc':[], 'names':names, 'rs':rs}
+        docs[uid]['loc'].append((chromo, start, stop))
+        if stop - start > LONG_SPAN:
+            long_locations.append((chromo, start, stop, int(uid)))
+            max_span = max(max_span, stop - start)
+            continue
+        locations.append((chromo, start, stop, int(uid)))
+        if len(locations) >= INSERT_BATCH_SIZE:
+            conn.executemany("INSERT INTO location VALUES (?,?,?,?)", locations)
+            locations = []
+    conn.executemany("INSERT INTO location VALUES (?,?,?,?)", locations)
+    conn.executemany("INSERT INTO long_location VALUES (?,?,?,?)", long_locations)
+    conn.executemany("INSERT INTO record VALUES (?,?)", ((uid, sqlite3.Binary(cPickle.dumps(doc, 2))) for uid, doc in docs.iteritems()))
+    conn.execute("INSERT INTO meta VALUES ('max_span', ?)", (str(max_span),))
+    conn.execute("INSERT INTO meta VALUES ('long_span', ?)", (str(LONG_SPAN),))
+    conn.execute("INSERT INTO meta VALUES ('source', ?)", (dump_file,))
+    conn.execute("INSERT INTO meta VALUES ('assembly', ?)", (assembly,))
+    #Index the locations once they are all in
+    conn.execute("CREATE INDEX location_start ON location (chromosome, start)")
+    conn.execute("CREATE INDEX long_location_start ON long_location (chromosome, start)")
+    conn.commit()
+    conn.close()
+    return len(docs)
+
+#Build (or rebuild) the mapped index file of an assembly from a ClinVar
+#   dump; returns the number of records indexed
+def build_mapped_index(dump_file, filename=INDEX_FILE, assembly='GRCh37'):
+    #doc_sum of each uid, with all of its locations
+    docs = {}
+    locations = []
+    for uid, chromo, start, stop, clin_sig, conds, names, rs in iter_dump(dump_file, assembly):
+        chromo, start = connect.location_key(chromo, start)
+        uid = int(uid)
+        if uid not in docs:
+            docs[uid] = {'clin_sig':clin_sig or None, 'cond':conds, 'loc':[], 'names':names, 'rs':rs}
+        docs[uid]['loc'].append((chromo, start, stop))
+        locations.append((chromo, start, stop, uid))
+    #Code the chromosomes and sort the locations by key, the long ones apart
+    names = sorted(set([chromo for chromo, start, stop, uid in locations]))
+    codes = dict((name, code) for code, name in enumerate(names))
+    entries = sorted([((codes[chromo] << 32) + start, stop, uid) for chromo, start, stop, uid in locations if stop - start <= LONG_SPAN])
+    long_entries = sorted([((codes[chromo] << 32) + start, stop, uid) for chromo, start, stop, uid in locations if stop - start > LONG_SPAN])
+    long_span = max([stop - start for chromo, start, stop, uid in locations if stop - start > LONG_SPAN] or [0])
+    del locations
+    names = '\t'.join(names)
+    entries_offset = MAPPED_HEADER.size + 4 + len(names)
+    long_offset = entries_offset + len(entries)*MAPPED_ENTRY.size
+    uids = sorted(docs)
+    uids_offset = long_offset + len(long_entries)*MAPPED_ENTRY.size
+    f = open(filename, 'wb')
+    try:
+        f.write(MAPPED_HEADER.pack(MAPPED_MAGIC, LONG_SPAN, len(entries), entries_offset, len(uids), uids_offset, assembly,
+                                   long_span, len(long_entries), long_offset))
+        f.write(struct.pack('<I', len(names)) + names)
+        for entry in entries + long_entries:
+            f.write(MAPPED_ENTRY.pack(*entry))
+        #Pickle the records, then write their uid entries and the blob
+        blobs = [cPickle.dumps(docs[uid], 2) for uid in uids]
+        offset = uids_offset + len(uids)*MAPPED_UID.size
+        for i in range(0, len(uids)):
+            f.write(MAPPED_UID.pack(uids[i], offset, len(blobs[i])))
+            offset += len(blobs[i])
+        for blob in blobs:
+            f.write(blob)
+    finally:
+        f.close()
+    return len(docs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the local ClinVar index used by CV_PathoID.py --offline.")
+    parser.add_argument('dump_file', help="ClinVar variant_summary.txt(.gz) or clinvar.vcf(.gz) of the assembly")
+    parser.add_argument('-o', '--output', default=INDEX_FILE, help="index file to write (default: %(default)s)")
+    parser.add_argument('--sqlite', action='store_true', help="write a SQLite index instead of a memory-mapped one")
+    parser.add_argument('--assembly', choices=sorted(connect.POSITION_FIELDS), default='GRCh37', help="assembly of the record locations to index (default: %(default)s)")
+    args = parser.parse_args()
+    print "[Program] Indexing the %s records of %s..."%(args.assembly, args.dump_file)
+    try:
+        if args.sqlite:
+            count = build_index(args.dump_file, args.output, args.assembly)
+        else:
+            count = build_mapped_index(args.dump_file, args.output, args.assembly)
+    except ValueError as e:
+        print "[ERROR] %s"%(e)
+        return
+    print "[Program] Indexed %d records into %s"%(count, args.output)
+
+if __name__ == '__main__':
+    main()
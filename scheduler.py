@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Helper class to schedule concurrent ClinVar requests
+#
+# Note to self:
+#   - TokenBucket is the shared rate limiter: every request takes a token
+#       (see transport.Session.request), and tokens are refilled at the NCBI
+#       rate (3 / second, or 10 / second with an API key)
+#   - run_jobs runs requests in a pool of worker threads, so that several
+#       requests are in flight at once and the latency of each request
+#       overlaps with the rate limit instead of adding to it
+#   - Results are handed back to the calling (main) thread, so everything
+#       else (e.g. cache, checkpoint journal) stays single-threaded
+#
+# Author: Anthony Chen
+##################################################################"""
+import sys
+import time
+import threading
+import Queue
+
+#Default number of requests in flight at once
+DEFAULT_WORKERS = 4
+
+class TokenBucket:
+    #Rate limiter allowing `rate` requests per second, with bursts of at
+    #   most `capacity` requests
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    #Take a token, sleeping until it is available; returns the time slept
+    def acquire(self):
+        with self.lock:
+            #Refill the tokens for the time elapsed
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            #Reserve a token; if none are left the count goes negative, and
+            #   the caller waits for its turn (outside of the lock)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+#Run a list of jobs, each a (function, argument tuple), in a pool of worker
+#   threads; yields (job index, result) in the order the jobs finish. An
+#   exception raised by a job is re-raised in the calling thread, and the
+#   jobs not started yet are dropped if the caller stops early
+def run_jobs(jobs, workers=DEFAULT_WORKERS):
+    #Run in the calling thread if there is nothing to run concurrently
+    if workers <= 1 or len(jobs) <= 1:
+        for i in range(0, len(jobs)):
+            yield i, jobs[i][0](*jobs[i][1])
+        return
+
+    job_queue = Queue.Queue()
+    result_queue = Queue.Queue()
+    stop = threading.Event()
+    for i in range(0, len(jobs)):
+        job_queue.put(i)
+
+    #Worker thread: run jobs until there are none left (or told to stop)
+    def worker():
+        while not stop.is_set():
+            try:
+                i = job_queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                result_queue.put((i, jobs[i][0](*jobs[i][1]), None))
+            except Exception:
+                result_queue.put((i, None, sys.exc_info()))
+
+    for n in range(0, min(workers, len(jobs))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    try:
+        for n in range(0, len(jobs)):
+            #Wait with a timeout, so that KeyboardInterrupt still gets through
+            while True:
+                try:
+                    i, result, error = result_queue.get(True, 1.0)
+                    break
+                except Queue.Empty:
+                    pass
+            if error is not None:
+                raise error[0], error[1], error[2]
+            yield i, result
+    finally:
+        stop.set()
@@ -0,0 +1,384 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Long-running local lookup service, shared by several CV_PathoID.py runs
+#   so that they keep to a single NCBI request rate instead of each using
+#   its own
+#
+# Usage:
+#   python service.py [--port 8095] [--api-key KEY] [--cache-size 200000]
+#   python CV_PathoID.py input.output    (uses the service if it is running)
+#
+# Note to self:
+#   - The service is a small HTTP server (JSON in / out) in front of the
+#       connect.py lookups:
+#       - GET /status: eutils url and counters of the service
+#       - POST /ids {"key": [chromosome, position], "assembly": "GRCh37"}:
+#           record IDs of a position ({"ids": [...]})
+#       - POST /summaries {"uids": [...]}: doc_sum of each record
+#           ({"docs": {uid: doc_sum}}; records not returned by eSummary are
+#           left out)
+#   - Every upstream request goes through the one connect.SESSION and
+#       connect.RATE_LIMITER of the service, whatever client it is for
+#   - Positions and records are kept in memory in LRU caches (LRUCache),
+#       so that overlapping panels of different clients are only looked up
+#       once while the service runs
+#   - Identical lookups in flight at the same time (the same position, or
+#       the same record ID) are coalesced: the first client makes the
+#       request, and the others wait for its result (see Coalescer)
+#   - Errors are not cached: a failed lookup is failed for every client
+#       waiting on it, and requested again by the next one
+#   - The doc_sum locations are on GRCh37 (only the history server search
+#       uses them, and it does not go through the service)
+#   - ServiceClient is the side used by CV_PathoID.py (see connect.SERVICE):
+#       it is only used if the service answers /status with the same
+#       eutils url, else the lookups are made directly
+#   - The client does not retry its lookups (the service already retried
+#       them upstream), and encodes the text of the JSON results back to
+#       UTF-8 str, as the decoders give it
+#
+# Author: Anthony Chen
+##################################################################"""
+import json
+import time
+import argparse
+import threading
+import collections
+import BaseHTTPServer
+import SocketServer
+#User-created files
+import connect
+import decoders
+import transport
+
+#Default port and url of the service
+SERVICE_PORT = 8095
+SERVICE_URL = "http://127.0.0.1:%d/"%(SERVICE_PORT)
+#Default number of positions / records kept in memory
+DEFAULT_CACHE_SIZE = 200000
+#Seconds the client waits for the service to answer /status before making
+#   the lookups directly
+STATUS_TIMEOUT = 1.0
+
+#Thread-safe least recently used cache
+class LRUCache:
+    def __init__(self, capacity=DEFAULT_CACHE_SIZE):
+        self.capacity = capacity
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    #Return the value of a key (and mark it as recently used), or None
+    def get(self, key):
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items[key] = value
+            return value
+
+    #Store the value of a key, evicting the least recently used beyond the
+    #   capacity
+    def put(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.capacity:
+                self.items.popitem(last=False)
+
+#Lookup in flight: the results of its keys once done (None if it failed)
+class InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.results = None
+
+#Registry of the lookups in flight, so that a key being looked up is not
+#   looked up again at the same time
+class Coalescer:
+    def __init__(self):
+        self.inflight = {}
+        self.lock = threading.Lock()
+        #Number of keys that were waited for instead of looked up
+        self.coalesced = 0
+
+    #Claim a list of keys: returns a new InFlight for the keys that are not
+    #   in flight yet (None if all are) and the list of those keys, plus the
+    #   (key, InFlight) of the keys that already are
+    def claim(self, keys):
+        call = InFlight()
+        owned = []
+        waits = []
+        with self.lock:
+            for key in keys:
+                if key in self.inflight:
+                    waits.append((key, self.inflight[key]))
+                    self.coalesced += 1
+                else:
+                    self.inflight[key] = call
+                    owned.append(key)
+        return (call if owned else None), owned, waits
+
+    #Finish the lookup of the owned keys of a call, with its results (a
+    #   dictionary by key, None if it failed), waking up the waiting clients
+    def done(self, call, owned, results):
+        call.results = results
+        with self.lock:
+            for key in owned:
+                del self.inflight[key]
+        call.event.set()
+
+#Lookups of the service, shared by all of its request handlers
+class LookupService:
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE, batch_size=connect.ESUMMARY_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.ids = LRUCache(cache_size)
+        self.summaries = LRUCache(cache_size)
+        self.coalescer = Coalescer()
+        self.started = time.time()
+        #Number of client lookups and of upstream requests, by tool
+        self.counts = {'ids':0, 'summaries':0, 'esearch':0, 'esummary':0}
+        self.lock = threading.Lock()
+
+    #Count a client lookup or upstream request
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    #Return the record IDs of a (chromosome, position) key on an assembly,
+    #   or None if the eSearch failed
+    def get_ids(self, key, assembly):
+        self.count('ids')
+        cache_key = (assembly, key[0], key[1])
+        id_list = self.ids.get(cache_key)
+        if id_list is not None:
+            return id_list
+        call, owned, waits = self.coalescer.claim([cache_key])
+        if call is None:
+            waits[0][1].event.wait()
+            return (waits[0][1].results or {}).get(cache_key)
+        results = None
+        try:
+            url_query = connect.eSearch_generate_query(key, assembly)
+            self.count('esearch')
+            id_list = connect.eSearch_getIDs(url_query)
+            if isinstance(id_list, list):
+                self.ids.put(cache_key, id_list)
+                results = {cache_key:id_list}
+        finally:
+            self.coalescer.done(call, owned, results)
+        return results[cache_key] if results is not None else None
+
+    #Return the doc_sum of each of a list of record IDs (records not returned
+    #   by eSummary are left out), or None if any eSummary failed
+    def get_summaries(self, uids):
+        self.count('summaries')
+        docs = {}
+        missing = []
+        for uid in uids:
+            doc_sum = self.summaries.get(uid)
+            if doc_sum is None:
+                missing.append(uid)
+            else:
+                docs[uid] = doc_sum
+        call, owned, waits = self.coalescer.claim(['uid:'+uid for uid in missing])
+        failed = False
+        if call is not None:
+            results = {}
+            try:
+                #Request the claimed records in batches
+                owned_uids = [key[4:] for key in owned]
+                for i in range(0, len(owned_uids), self.batch_size):
+                    chunk = owned_uids[i:i+self.batch_size]
+                    self.count('esummary')
+                    result_dict = connect.eSummary_getResult(connect.EUTILS_BASE+"esummary.fcgi", connect.eSummary_generate_batch(chunk))
+                    if result_dict == 1:
+                        results = None
+                        break
+                    for uid in chunk:
+                        results['uid:'+uid] = result_dict.get(uid)
+                        if uid in result_dict:
+                            self.summaries.put(uid, result_dict[uid])
+            finally:
+                self.coalescer.done(call, owned, results)
+            if results is None:
+                failed = True
+            else:
+                docs.update((key[4:], doc_sum) for key, doc_sum in results.iteritems() if doc_sum is not None)
+        #Records looked up by other clients at the same time
+        for key, other in waits:
+            other.event.wait()
+            if other.results is None:
+                failed = True
+            elif other.results.get(key) is not None:
+                docs[key[4:]] = other.results[key]
+        return None if failed else docs
+
+    #Status of the service
+    def status(self):
+        with self.lock:
+            counts = dict(self.counts)
+        return {'eutils_url':connect.EUTILS_BASE, 'uptime_seconds':time.time() - self.started, 'counts':counts,
+                'coalesced':self.coalescer.coalesced, 'cached_positions':len(self.ids.items),
+                'cached_records':len(self.summaries.items), 'cache_hits':self.ids.hits + self.summaries.hits,
+                'cache_misses':self.ids.misses + self.summaries.misses}
+
+#Handler of the service requests
+class ServiceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    #Keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self.send_json(200, self.server.service.status())
+        else:
+            self.send_json(404, {'error':'unknown path'})
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+        except ValueError:
+            self.send_json(400, {'error':'invalid JSON'})
+            return
+        service = self.server.service
+        path = self.path.rstrip('/')
+        if path == '/ids':
+            assembly = request.get('assembly', 'GRCh37')
+            if assembly not in connect.POSITION_FIELDS:
+                self.send_json(400, {'error':'unknown assembly'})
+                return
+            key = connect.location_key(str(request['key'][0]), request['key'][1])
+            id_list = service.get_ids(key, assembly)
+            if id_list is None:
+                self.send_json(502, {'error':'eSearch failed'})
+            else:
+                self.send_json(200, {'ids':id_list})
+        elif path == '/summaries':
+            docs = service.get_summaries([str(uid) for uid in request.get('uids', [])])
+            if docs is None:
+                self.send_json(502, {'error':'eSummary failed'})
+            else:
+                self.send_json(200, {'docs':docs})
+        else:
+            self.send_json(404, {'error':'unknown path'})
+
+    #Send a JSON response
+    def send_json(self, status, body):
+        body = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #Keep the console quiet
+    def log_message(self, format, *args):
+        pass
+
+class ServiceServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    #Connections waiting to be accepted (each client opens one per worker)
+    request_queue_size = 128
+
+#Create (but do not start) the service on the given port; a port of 0 picks
+#   a free port, see server.server_address
+def make_server(service, port=SERVICE_PORT, host='127.0.0.1'):
+    server = ServiceServer((host, port), ServiceHandler)
+    server.service = service
+    return server
+
+#Client of the service, used by connect.py instead of the direct lookups
+class ServiceClient:
+    def __init__(self, url=SERVICE_URL, read_timeout=transport.READ_TIMEOUT):
+        self.url = url if url.endswith('/') else url+'/'
+        self.session = transport.Session(read_timeout=read_timeout, retries=0)
+
+    #Return the status of the service, or None if it is not running (asked
+    #   once, without waiting long, as the service is usually not running)
+    def status(self):
+        session = transport.Session(connect_timeout=STATUS_TIMEOUT, read_timeout=STATUS_TIMEOUT, retries=0)
+        try:
+            return json.loads(session.request(self.url+'status').read())
+        except (IOError, ValueError):
+            return None
+        finally:
+            session.close()
+
+    #Send a lookup to the service; returns its decoded response
+    def post(self, path, request):
+        return json.loads(self.session.request(self.url+path, json.dumps(request)).read())
+
+    #Return the record IDs of a (chromosome, position) key, or 1 if the
+    #   lookup failed (same as connect.eSearch_getIDs)
+    def get_ids(self, key):
+        try:
+            return [str(uid) for uid in self.post('ids', {'key':list(key), 'assembly':connect.ASSEMBLY})['ids']]
+        except (IOError, ValueError, KeyError) as e:
+            print "[ERROR] eSearch through the lookup service failed: %s"%(e)
+            return 1
+
+    #Return the doc_sum of each of a list of record IDs, or 1 if the lookup
+    #   failed (same as connect.eSummary_getResult)
+    def get_summaries(self, uids):
+        try:
+            docs = self.post('summaries', {'uids':uids})['docs']
+        except (IOError, ValueError, KeyError) as e:
+            print "[ERROR] eSummary through the lookup service failed: %s"%(e)
+            return 1
+        return dict((str(uid), encode_strings(doc_sum)) for uid, doc_sum in docs.iteritems())
+
+    #Close the connections to the service
+    def close(self):
+        self.session.close()
+
+#Function to encode the (unicode) strings of a decoded JSON value to UTF-8
+#   str, in its lists and dictionaries too
+def encode_strings(value):
+    if isinstance(value, dict):
+        return dict((encode_strings(k), encode_strings(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return [encode_strings(v) for v in value]
+    return decoders.utf8(value)
+
+#Function to find the running service at a url that looks up the same
+#   E-utilities as this run; returns its ServiceClient, or None if there is
+#   none (then the lookups are made directly)
+def find_service(url, eutils_url):
+    client = ServiceClient(url)
+    status = client.status()
+    if status is None:
+        client.close()
+        return None
+    if status.get('eutils_url') != eutils_url:
+        print "[Program] Lookup service at %s uses %s, not %s; searching directly"%(url, status.get('eutils_url'), eutils_url)
+        client.close()
+        return None
+    return client
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the lookup service shared by CV_PathoID.py runs.")
+    parser.add_argument('--port', type=int, default=SERVICE_PORT, help="port to listen on, on localhost (default: %(default)s)")
+    parser.add_argument('--eutils-url', default=connect.EUTILS_BASE, help="base url of the E-utilities (default: %(default)s)")
+    parser.add_argument('--retmode', choices=sorted(decoders.DECODERS), default=connect.DECODER.retmode, help="format of the E-utilities responses (default: %(default)s)")
+    parser.add_argument('--api-key', help="NCBI API key, allowing 10 instead of 3 requests per second")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, help="positions and records kept in memory (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=transport.READ_TIMEOUT, help="seconds to wait for a response before retrying it (default: %(default)s)")
+    parser.add_argument('--retries', type=int, default=transport.MAX_RETRIES, help="number of times a failed request is retried (default: %(default)s)")
+    args = parser.parse_args()
+    connect.EUTILS_BASE = args.eutils_url
+    connect.DECODER = decoders.DECODERS[args.retmode]
+    connect.SESSION = transport.Session(read_timeout=args.timeout, retries=args.retries)
+    connect.set_api_key(args.api_key)
+    server = make_server(LookupService(args.cache_size), args.port)
+    print "[Program] Lookup service for %s at http://%s:%d/"%(connect.EUTILS_BASE, server.server_address[0], server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    connect.SESSION.report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#Tests of the batch mode output files, run against the local E-utilities
+#   stand-in (python -m unittest discover tests)
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import fake_eutils
+
+#Header of the tab-delimited (.output) and comma-separated (.csv) inputs,
+#   with the chromosome and position in the 3rd and 4th columns
+COLUMNS = ['c%d'%(i) for i in range(0, 12)]
+
+class BatchOutputTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.store = fake_eutils.RecordStore()
+        fake_eutils.synthetic_records(cls.store, 50)
+        cls.server = fake_eutils.make_server(cls.store)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        cls.url = 'http://%s:%d/'%(cls.server.server_address)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        #A directory name with a dot, which the output names must keep
+        self.dir = tempfile.mkdtemp(suffix='.batch.d')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    #Write an input file of n variants at record positions, from the first
+    def write_input(self, name, n, first=0):
+        delim = ',' if name.endswith('.csv') else '\t'
+        positions = sorted((chromo, start) for chromo, spans in self.store.locations.items() for start, stop, uid in spans)
+        with open(os.path.join(self.dir, name), 'w') as f_out:
+            f_out.write(delim.join(COLUMNS)+'\n')
+            for i, (chromo, pos) in enumerate(positions[first:first+n]):
+                f_out.write(delim.join(['x', chromo, str(pos), 'a', 'b', 'c', 'd', 'exonic', 'e', 'GENE1', 'exonic', 'rs%d'%(i)])+'\n')
+
+    def run_batch(self):
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'CV_PathoID.py'), self.dir, '--output-type', '0',
+                                    '--no-gene-filter', '--no-cache', '--no-service', '--eutils-url', self.url, '--api-key', 'x'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        return process.returncode, output
+
+    def summaries(self):
+        return sorted(glob.glob(os.path.join(self.dir, '*_ClinVarResultSummary_*.csv')))
+
+    def test_distinct_stems(self):
+        self.write_input('a.output', 20)
+        self.write_input('b.csv', 30, 20)
+        status, output = self.run_batch()
+        self.assertEqual(status, 0, output)
+        summaries = self.summaries()
+        self.assertEqual([os.path.basename(name).split('_')[0] for name in summaries], ['a', 'b'])
+        for name, n in zip(summaries, [20, 30]):
+            with open(name) as f_in:
+                self.assertEqual(len(f_in.readlines()), n+1)
+
+    def test_shared_stem(self):
+        #in.csv and in.output would both write in_ClinVarResultSummary_*.csv
+        self.write_input('in.output', 20)
+        self.write_input('in.csv', 20, 20)
+        status, output = self.run_batch()
+        self.assertIn('[ERROR]', output)
+        self.assertIn('in.csv', output)
+        self.assertEqual(self.summaries(), [])
+
+if __name__ == '__main__':
+    unittest.main()
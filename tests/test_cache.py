@@ -0,0 +1,108 @@
+#Tests of the persistent response cache (python -m unittest discover tests)
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import cache
+
+DOC_SUM = {'clin_sig':'Pathogenic', 'cond':['Disease 1'], 'loc':[('1', 12345, 12345)], 'names':['NM_000001.1:c.1A>G'], 'rs':['1']}
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    #Entries stored by one run are hits for the next, other keys are misses
+    def test_round_trip(self):
+        responses = cache.ResponseCache(self.filename)
+        self.assertIs(responses.get_ids(('1', 12345)), None)
+        responses.put_ids(('1', 12345), ['100', '200'])
+        responses.put_ids(('2', 54321), [])
+        responses.put_summary('100', DOC_SUM)
+        responses.close()
+        responses = cache.ResponseCache(self.filename)
+        try:
+            self.assertEqual(responses.get_ids(('1', 12345)), ['100', '200'])
+            #Positions without records are cached too
+            self.assertEqual(responses.get_ids(('2', 54321)), [])
+            self.assertEqual(responses.get_summary('100'), DOC_SUM)
+            self.assertIs(responses.get_ids(('1', 12346)), None)
+            self.assertIs(responses.get_summary('200'), None)
+            self.assertEqual(responses.hits, {'esearch':2, 'esummary':1})
+            self.assertEqual(responses.misses, {'esearch':1, 'esummary':1})
+        finally:
+            responses.close()
+
+    #Entries past the TTL are misses; a renewed record is not
+    def test_expired(self):
+        responses = cache.ResponseCache(self.filename, ttl_days=1)
+        responses.put_ids(('1', 12345), ['100'])
+        responses.put_summary('100', DOC_SUM)
+        responses.put_summary('200', DOC_SUM)
+        responses.close()
+        conn = sqlite3.connect(self.filename)
+        old = time.time() - 2*86400
+        conn.execute("UPDATE esearch SET created=?", (old,))
+        conn.execute("UPDATE esummary SET created=?", (old,))
+        conn.commit()
+        conn.close()
+        responses = cache.ResponseCache(self.filename, ttl_days=1)
+        try:
+            self.assertIs(responses.get_ids(('1', 12345)), None)
+            self.assertEqual(responses.get_ids_entry(('1', 12345))[0], ['100'])
+            responses.renew_summaries(['100'])
+            self.assertEqual(responses.get_summary('100'), DOC_SUM)
+            self.assertIs(responses.get_summary('200'), None)
+        finally:
+            responses.close()
+
+    #A file locked by another run gives misses, and the new entries are kept
+    #   until a commit succeeds
+    def test_locked(self):
+        responses = cache.ResponseCache(self.filename)
+        responses.put_ids(('1', 12345), ['100'])
+        responses.commit()
+        responses.conn.close()
+        responses.conn = sqlite3.connect(self.filename, timeout=0)
+        other = sqlite3.connect(self.filename)
+        other.execute("BEGIN EXCLUSIVE")
+        try:
+            self.assertIs(responses.get_ids(('1', 12345)), None)
+            responses.put_ids(('2', 54321), ['200'])
+            self.assertFalse(responses.commit())
+        finally:
+            other.rollback()
+            other.close()
+        self.assertTrue(responses.commit())
+        responses.close()
+        responses = cache.ResponseCache(self.filename)
+        try:
+            self.assertEqual(responses.get_ids(('2', 54321)), ['200'])
+        finally:
+            responses.close()
+
+    #Only max_entries rows are kept, the least recently used are evicted
+    def test_eviction(self):
+        responses = cache.ResponseCache(self.filename, max_entries=2)
+        for pos in [1, 2, 3]:
+            responses.put_ids(('1', pos), [str(pos)])
+            responses.commit()
+            time.sleep(0.01)
+        responses.close()
+        responses = cache.ResponseCache(self.filename, max_entries=2)
+        try:
+            self.assertEqual([responses.get_ids(('1', pos)) for pos in [1, 2, 3]], [None, ['2'], ['3']])
+        finally:
+            responses.close()
+
+if __name__ == '__main__':
+    unittest.main()
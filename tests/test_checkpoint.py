@@ -0,0 +1,85 @@
+#Tests of the checkpoint journal and --resume (python -m unittest discover tests)
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import checkpoint
+from variant import Var
+
+DOC_SUM = {'clin_sig':'Pathogenic', 'cond':['Disease 1'], 'loc':[('1', 12345, 12345)], 'names':[], 'rs':[]}
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.input = os.path.join(self.dir, 'in.output')
+        with open(self.input, 'w') as f_out:
+            f_out.write('header\n')
+        self.filename = os.path.join(self.dir, 'in_ClinVarCheckpoint.pkl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def variants(self, n):
+        return [Var('1', str(12345+i), 'GENE1', 'exonic', 'GENE1', 'rs1', i) for i in range(0, n)]
+
+    #Journal the results of variants 0 to 3: 0 and 1 resolved with a record,
+    #   2 without records, 3 with its IDs only
+    def write_journal(self):
+        journal = checkpoint.CheckpointJournal(self.filename, self.input)
+        for i in [0, 1]:
+            journal.record_ids(i, [str(100+i)])
+            journal.record_summary(i, {str(100+i):DOC_SUM})
+        journal.record_ids(2, [])
+        journal.record_ids(3, ['103'])
+        journal.close()
+
+    def test_resume(self):
+        self.write_journal()
+        journal = checkpoint.CheckpointJournal(self.filename, self.input, resume=True)
+        v_list = self.variants(5)
+        self.assertEqual(journal.restore(v_list), 3)
+        journal.close(remove=True)
+        self.assertEqual([v.IdList for v in v_list], [['100'], ['101'], [], ['103'], None])
+        self.assertEqual([v.recordLib for v in v_list], [{'100':DOC_SUM}, {'101':DOC_SUM}, None, None, None])
+        self.assertFalse(os.path.exists(self.filename))
+
+    #A journal cut mid-entry (a crash while writing) resumes from the entries
+    #   before the cut, and the entries appended after resuming are kept for
+    #   a further resume
+    def test_truncated_journal(self):
+        for cut in range(1, 20):
+            self.write_journal()
+            with open(self.filename, 'r+b') as f:
+                f.truncate(os.path.getsize(self.filename) - cut)
+            journal = checkpoint.CheckpointJournal(self.filename, self.input, resume=True)
+            v_list = self.variants(5)
+            self.assertEqual(journal.restore(v_list), 3, cut)
+            self.assertEqual(v_list[3].IdList, None, cut)
+            journal.record_ids(3, ['103'])
+            journal.record_summary(3, {'103':DOC_SUM})
+            journal.close()
+            journal = checkpoint.CheckpointJournal(self.filename, self.input, resume=True)
+            v_list = self.variants(5)
+            self.assertEqual(journal.restore(v_list), 4, cut)
+            journal.close()
+            self.assertEqual(v_list[3].recordLib, {'103':DOC_SUM}, cut)
+
+    #The journal of a changed input or another assembly is not resumed from
+    def test_other_input(self):
+        self.write_journal()
+        journal = checkpoint.CheckpointJournal(self.filename, self.input, resume=True, assembly='GRCh38')
+        self.assertEqual(journal.restore(self.variants(5)), 0)
+        journal.close()
+        self.write_journal()
+        with open(self.input, 'a') as f_out:
+            f_out.write('x\t1\t12345\n')
+        journal = checkpoint.CheckpointJournal(self.filename, self.input, resume=True)
+        self.assertEqual(journal.restore(self.variants(5)), 0)
+        journal.close()
+
+if __name__ == '__main__':
+    unittest.main()
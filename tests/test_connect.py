@@ -0,0 +1,113 @@
+#Tests of the ClinVar search, run against the local E-utilities stand-in
+#   (python -m unittest discover tests)
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import fake_eutils
+import connect
+import transport
+import cache
+import CV_PathoID
+from variant import Var
+
+class SearchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.store = fake_eutils.RecordStore()
+        fake_eutils.synthetic_records(cls.store, 50)
+        cls.server = fake_eutils.make_server(cls.store)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        cls.url = 'http://%s:%d/'%(cls.server.server_address)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = (connect.EUTILS_BASE, connect.SESSION, connect.CACHE, connect.SERVICE, connect.JOURNAL, connect.API_KEY)
+        connect.EUTILS_BASE = self.url
+        connect.SESSION = transport.Session(retries=0)
+        connect.SERVICE = None
+        connect.JOURNAL = None
+        connect.set_api_key('x')
+
+    def tearDown(self):
+        if connect.CACHE is not None:
+            connect.CACHE.close()
+        connect.SESSION.close()
+        connect.EUTILS_BASE, connect.SESSION, connect.CACHE, connect.SERVICE, connect.JOURNAL, api_key = self.saved
+        connect.set_api_key(api_key)
+        shutil.rmtree(self.dir)
+
+    #Variants of one position spelled "chr1" and "1" are searched once, by
+    #   the normalized chromosome, whichever spelling comes first
+    def test_chr_prefix(self):
+        connect.CACHE = cache.ResponseCache(os.path.join(self.dir, 'cache.sqlite'))
+        chromo, spans = sorted(self.store.locations.items())[0]
+        pos = spans[0][0]
+        v_list = [Var('chr'+chromo, str(pos), 'GENE1', 'exonic', 'GENE1', 'rs1', 0),
+                  Var(chromo, str(pos), 'GENE1', 'exonic', 'GENE1', 'rs1', 1),
+                  Var('CHR'+chromo, str(pos), 'GENE1', 'exonic', 'GENE1', 'rs1', 2)]
+        searches = self.store.request_counts['esearch']
+        connect.ClinVar_Search_Loop(v_list)
+        self.assertEqual(self.store.request_counts['esearch'] - searches, 1)
+        expected = self.store.search(chromo, pos)
+        self.assertNotEqual(expected, [])
+        for v in v_list:
+            self.assertEqual(sorted(v.IdList), sorted(expected), v.chromosome)
+        self.assertEqual(sorted(connect.CACHE.get_ids((chromo, pos))), sorted(expected))
+
+    #A refresh only fetches the records modified since the positions were
+    #   cached; the rest come from the cache, whatever their age
+    def test_refresh(self):
+        filename = os.path.join(self.dir, 'cache.sqlite')
+        connect.CACHE = cache.ResponseCache(filename)
+        sites = sorted((chromo, start) for chromo, spans in self.store.locations.items() for start, stop, uid in spans)[:10]
+        variants = lambda: [Var(chromo, str(pos), 'GENE1', 'exonic', 'GENE1', 'rs1', i) for i, (chromo, pos) in enumerate(sites)]
+        self.assertEqual(CV_PathoID.lookup_ClinVar(variants()), 0)
+        connect.CACHE.close()
+        #Cached on 2021/01/01, since when one record has changed and one has
+        #   been added at a cached position
+        conn = sqlite3.connect(filename)
+        cached = time.mktime((2021, 1, 1, 12, 0, 0, 0, 0, -1))
+        conn.execute("UPDATE esearch SET created=?", (cached,))
+        conn.execute("UPDATE esummary SET created=?", (cached,))
+        conn.commit()
+        conn.close()
+        changed = self.store.search(*sites[0])[0]
+        self.store.modify(changed, 'Benign', '2022/06/01')
+        chromo, pos = sites[1]
+        self.store.add(fake_eutils.ET.fromstring(fake_eutils.synthetic_doc('900001', chromo, pos, 'Pathogenic', ['Disease 2'])), '2022/06/01')
+        connect.CACHE = cache.ResponseCache(filename)
+        v_list = variants()
+        before = dict(self.store.request_counts)
+        CV_PathoID.REFRESH_CACHE = True
+        try:
+            self.assertEqual(CV_PathoID.lookup_ClinVar(v_list), 0)
+        finally:
+            CV_PathoID.REFRESH_CACHE = False
+        #One date-limited search and one page of the two records
+        self.assertEqual(self.store.request_counts['esearch'] - before['esearch'], 1)
+        self.assertEqual(self.store.request_counts['esummary'] - before['esummary'], 1)
+        self.assertEqual(v_list[0].recordLib[changed]['clin_sig'], 'Benign')
+        self.assertIn('900001', v_list[1].IdList)
+        self.assertEqual(v_list[1].recordLib['900001']['clin_sig'], 'Pathogenic')
+        for v in v_list:
+            self.assertEqual(sorted(v.IdList), sorted(self.store.search(v.chromosome, int(v.position))))
+            self.assertEqual(sorted(v.recordLib), sorted(v.IdList))
+        self.assertEqual(connect.CACHE.misses, {'esearch':0, 'esummary':0})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#Tests of the eSummary decoders (python -m unittest discover tests)
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import fake_eutils
+import decoders
+import benchmark
+import CV_PathoID
+from variant import Var
+
+#Record with non-ASCII condition and significance text, as UTF-8 bytes
+TRAIT = 'Maladie de Gaucher, type 1 – forme adulte'
+CLIN_SIG = 'Pathogène'
+DOC = fake_eutils.synthetic_doc('100001', '1', 12345, CLIN_SIG, [TRAIT])
+
+class DecoderTest(unittest.TestCase):
+    #eSummary response of the record in each format, as the stand-in gives it
+    def responses(self):
+        doc = fake_eutils.ET.fromstring(DOC)
+        json_body = json.dumps({'result':{'uids':['100001'], '100001':fake_eutils.doc_to_json(doc)}})
+        xml_body = ('<?xml version="1.0" encoding="UTF-8"?><eSummaryResult><DocumentSummarySet>%s'
+                    '</DocumentSummarySet></eSummaryResult>')%(DOC)
+        return {'json':json_body, 'xml':xml_body}
+
+    def test_utf8_doc_sums(self):
+        for retmode, body in self.responses().items():
+            summaries = list(decoders.DECODERS[retmode].summaries(StringIO(body)))
+            self.assertEqual(len(summaries), 1, retmode)
+            uid, doc_sum = summaries[0]
+            self.assertEqual(doc_sum['clin_sig'], CLIN_SIG, retmode)
+            self.assertEqual(doc_sum['cond'], [TRAIT], retmode)
+            for text in [doc_sum['clin_sig']] + doc_sum['cond'] + doc_sum['names'] + [loc[0] for loc in doc_sum['loc']]:
+                self.assertIs(type(text), str, retmode)
+
+    #The doc_sums are written next to the (UTF-8) input rows
+    def test_output_rows(self):
+        row = 'x\t1\t12345\tGÈNE1'
+        for retmode, body in self.responses().items():
+            uid, doc_sum = list(decoders.DECODERS[retmode].summaries(StringIO(body)))[0]
+            v = Var('1', '12345', 'GÈNE1', 'exonic', 'GÈNE1', 'rs1')
+            v.IdList = [uid]
+            v.recordLib = {uid:doc_sum}
+            f_out = StringIO()
+            CV_PathoID.write_summary_rows(f_out, [v])
+            CV_PathoID.write_appended_rows(f_out, [row], [v], '\t')
+            lines = f_out.getvalue().splitlines()
+            self.assertIn('[%s]'%(TRAIT.replace(',', ';')), lines[0], retmode)
+            self.assertEqual(lines[1], '%s\t[%s]\t[%s]'%(row, CLIN_SIG, TRAIT.replace(',', ';')), retmode)
+
+class EquivalenceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    #Both formats of the same records give the same doc_sums, including a
+    #   record with an empty clinical significance
+    def test_same_doc_sums(self):
+        filename = os.path.join(self.dir, 'esummary.xml')
+        benchmark.write_recorded_fixture(filename, 300)
+        docs = [doc for event, doc in fake_eutils.ET.iterparse(filename) if doc.tag == 'DocumentSummary']
+        docs.append(fake_eutils.ET.fromstring(fake_eutils.synthetic_doc('100002', '2', 54321, '', ['Disease 1'])))
+        result = {'uids':[doc.get('uid') for doc in docs]}
+        for doc in docs:
+            result[doc.get('uid')] = fake_eutils.doc_to_json(doc)
+        json_body = json.dumps({'result':result})
+        xml_body = ('<?xml version="1.0" encoding="UTF-8"?><eSummaryResult><DocumentSummarySet>%s'
+                    '</DocumentSummarySet></eSummaryResult>')%(''.join([fake_eutils.ET.tostring(doc) for doc in docs]))
+        json_sums = list(decoders.DECODERS['json'].summaries(StringIO(json_body)))
+        xml_sums = list(decoders.DECODERS['xml'].summaries(StringIO(xml_body)))
+        self.assertEqual(len(xml_sums), 301)
+        self.assertEqual(json_sums, xml_sums)
+        self.assertIs(dict(xml_sums)['100002']['clin_sig'], None)
+        #An empty significance is reported, not written as empty
+        v = Var('2', '54321', 'GENE1', 'exonic', 'GENE1', 'rs1')
+        v.IdList = ['100002']
+        v.recordLib = {'100002':dict(xml_sums)['100002']}
+        self.assertIn('Unexpected events', v.output_clin_sig())
+
+if __name__ == '__main__':
+    unittest.main()
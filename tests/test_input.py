@@ -0,0 +1,47 @@
+#Tests of the recognition and reading of the input files (python -m unittest discover tests)
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import CV_PathoID
+
+#Header and rows of a small ANNOVAR input
+HEADER = ['Chr', 'Start', 'End', 'Ref', 'Alt', 'Func.refGene', 'Gene.refGene', 'GeneDetail.refGene',
+          'ExonicFunc.refGene', 'AAChange.refGene', 'avsnp150']
+ROWS = [['1', '12345', '12345', 'A', 'G', 'exonic', 'GENE1', '.', 'nonsynonymous SNV', 'GENE1:NM_000001:exon2:c.A12G:p.K4E', 'rs1'],
+        ['2', '54321', '54321', 'C', 'T', 'exonic', 'GENE2', '.', 'stopgain', 'GENE2:NM_000002:exon5:c.C30T:p.R10X', 'rs2']]
+
+class InputTypeTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    #The file types are recognized with the compressed extensions the
+    #   writer recognizes
+    def test_delimiters(self):
+        for name, delim in [('in.output', '\t'), ('in.output.gz', '\t'), ('in.output.bgz', '\t'),
+                            ('in.csv', ','), ('in.csv.gz', ','), ('in.csv.bgz', ','),
+                            ('in.vcf.gz', '\t'), ('in.vcf.bgz', '\t'), ('in.txt', None), ('in.csv.zip', None)]:
+            self.assertEqual(CV_PathoID.get_delimiter(name), delim, name)
+
+    def test_read_compressed(self):
+        for name in ['in.output.bgz', 'in.csv.bgz', 'in.output.gz']:
+            delim = CV_PathoID.get_delimiter(name)
+            filename = os.path.join(self.dir, name)
+            f_out = gzip.open(filename, 'wb')
+            f_out.write('\n'.join([delim.join(cols) for cols in [HEADER] + ROWS])+'\n')
+            f_out.close()
+            v_list = []
+            self.assertEqual(CV_PathoID.read_file(v_list, filename), 0, name)
+            self.assertEqual([(v.chromosome, v.position, v.gene) for v in v_list],
+                             [('1', '12345', 'GENE1'), ('2', '54321', 'GENE2')], name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#Tests of the allele matching of ClinVar records (python -m unittest discover tests)
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import matcher
+import variant
+from variant import Var
+
+#Records of a multi-allelic site: A>C and A>G, and one without any rs
+#   number or name (which cannot be ruled out)
+RECORDS = {'1':{'clin_sig':'Pathogenic', 'cond':['Disease 1'], 'loc':[('Y', 2655049, 2655049)],
+                'names':['NM_003140.3(SRY):c.593A>C (p.Tyr198Ser)'], 'rs':['104894957']},
+           '2':{'clin_sig':'Benign', 'cond':['Disease 2'], 'loc':[('Y', 2655049, 2655049)],
+                'names':['NM_003140.3(SRY):c.593A>G (p.Tyr198Cys)'], 'rs':['104894958']},
+           '3':{'clin_sig':'Uncertain significance', 'cond':None, 'loc':[('Y', 2655049, 2655049)],
+                'names':[], 'rs':[]}}
+
+class MatchTest(unittest.TestCase):
+    #Variant of the site with all of its records found, formatted as the
+    #   search formats it
+    def variant(self, anno, snp, records=RECORDS):
+        v = Var('Y', '2655049', 'SRY', 'nonsynonymous SNV', anno, snp, 0)
+        variant.format_variantList([v], [])
+        v.IdList = sorted(records)
+        v.recordLib = dict(records)
+        return v
+
+    def test_keys(self):
+        self.assertEqual(matcher.hgvs_keys(['NM_003140.3(SRY):c.593A>C (p.Tyr198Ser)', 'NM_003140.1:c.593A>C']),
+                         set(['NM_003140:c.593A>C']))
+        self.assertEqual(matcher.rs_key('rs104894957'), '104894957')
+        self.assertIs(matcher.rs_key('.'), None)
+
+    def test_match_variants(self):
+        v_list = [self.variant('SRY:NM_003140:exon1:c.A593C:p.Y198S', 'rs104894957'),
+                  self.variant('SRY:NM_003140:exon1:c.A593G:p.Y198C', '.'),
+                  self.variant('', '.'),
+                  self.variant('SRY:NM_003140:exon1:c.A593T:p.Y198F', 'rs1'),
+                  self.variant('SRY:NM_003140:exon1:c.A593T:p.Y198F', 'rs1', {'1':RECORDS['1']})]
+        self.assertEqual(matcher.match_variants(v_list), 2 + 2 + 1)
+        #By rs number, by HGVS, not at all (no allele to match), and down to
+        #   the record that cannot be ruled out
+        self.assertEqual([v.IdList for v in v_list[:4]], [['1', '3'], ['2', '3'], ['1', '2', '3'], ['3']])
+        self.assertEqual(sorted(v_list[0].recordLib), ['1', '3'])
+        #A variant left without records is written as no items found
+        self.assertEqual(v_list[4].IdList, [])
+        self.assertIs(v_list[4].recordLib, None)
+        self.assertEqual(v_list[4].output_clin_sig(), 'No items found')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#Tests of the stage timers and request statistics (python -m unittest discover tests)
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import metrics
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        #Drop what the tests recorded
+        for name in ['test_stage', 'test_read']:
+            metrics.STAGES.pop(name, None)
+            if name in metrics.STAGE_ORDER:
+                metrics.STAGE_ORDER.remove(name)
+        metrics.REQUESTS.pop('testtool', None)
+
+    def test_stages(self):
+        for i in range(0, 2):
+            with metrics.stage('test_stage'):
+                time.sleep(0.05)
+        self.assertEqual(list(metrics.timed_iter('test_read', iter([1, 2, 3]))), [1, 2, 3])
+        self.assertEqual(metrics.STAGES['test_stage']['calls'], 2)
+        self.assertGreaterEqual(metrics.STAGES['test_stage']['wall_seconds'], 0.1)
+        #One call per item, and one for the end of the iteration
+        self.assertEqual(metrics.STAGES['test_read']['calls'], 4)
+        self.assertEqual(metrics.STAGE_ORDER[-2:], ['test_stage', 'test_read'])
+
+    def test_requests(self):
+        metrics.record_request('testtool', 0.07, 100, 200)
+        metrics.record_request('testtool', 0.3, 0, 503)
+        metrics.record_request('testtool', 60.0, 0, None)
+        stats = metrics.make_report()['requests']['testtool']
+        self.assertEqual((stats['count'], stats['errors'], stats['bytes']), (3, 2, 100))
+        self.assertEqual(stats['latency_buckets']['0.1'], 1)
+        self.assertEqual(stats['latency_buckets']['0.5'], 1)
+        #Latencies over the last bucket are only in the sum
+        self.assertEqual(sum(stats['latency_buckets'].values()), 2)
+        self.assertAlmostEqual(stats['latency_mean'], 60.37 / 3)
+
+    def test_write_report(self):
+        metrics.record_request('testtool', 0.07, 100, 200)
+        filename = os.path.join(self.dir, 'metrics.json')
+        metrics.write_report(filename)
+        with open(filename) as f_in:
+            self.assertEqual(json.load(f_in)['requests']['testtool']['count'], 1)
+        filename = os.path.join(self.dir, 'metrics.prom')
+        metrics.write_report(filename)
+        with open(filename) as f_in:
+            text = f_in.read()
+        self.assertIn('clinvar_request_bytes{tool="testtool"} 100', text)
+        self.assertIn('# TYPE clinvar_run_seconds gauge', text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#Tests of the local ClinVar index (python -m unittest discover tests)
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import offline
+
+#Columns of the variant_summary.txt dump used by offline.iter_variant_summary
+HEADER = ['AlleleID', 'Name', 'ClinicalSignificance', 'RS# (dbSNP)', 'PhenotypeList', 'Assembly',
+          'Chromosome', 'Start', 'Stop', 'VariationID']
+
+class LongRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        #Short records on chromosome 1 and 2, one CNV spanning most of
+        #   chromosome 1 and a 50 kb deletion
+        rng = random.Random(0)
+        self.records = []
+        for i in range(0, 2000):
+            start = rng.randint(1, 5000000)
+            self.records.append((str(1000+i), rng.choice(['1', '2']), start, start + rng.randint(0, 50)))
+        self.records.append(('900001', '1', 10000, 240000000))
+        self.records.append(('900002', '1', 2000000, 2050000))
+        self.dump = os.path.join(self.dir, 'variant_summary.txt')
+        with open(self.dump, 'w') as f_out:
+            f_out.write('#'+'\t'.join(HEADER)+'\n')
+            for uid, chromo, start, stop in self.records:
+                f_out.write('\t'.join(['1', 'NM_000001.1:c.1A>G', 'Pathogenic', '-1', 'Disease', 'GRCh37',
+                                       chromo, str(start), str(stop), uid])+'\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    #uids of the records found by going through all of them
+    def expected_ids(self, key, window):
+        return sorted([uid for uid, chromo, start, stop in self.records
+                       if chromo == key[0] and start <= key[1] + window and stop >= key[1] - window], key=int)
+
+    def check_index(self, index):
+        rng = random.Random(1)
+        keys = [('1', 2000010), ('1', 230000000), ('2', 2000010), ('X', 5)]
+        keys += [(rng.choice(['1', '2']), rng.randint(1, 5000000)) for i in range(0, 200)]
+        for window in [0, 100]:
+            for key in sorted(keys):
+                self.assertEqual(index.get_ids(key, window), self.expected_ids(key, window), (key, window))
+        self.assertIn('900001', index.get_ids(('1', 230000000)))
+
+    def test_sqlite_index(self):
+        filename = os.path.join(self.dir, 'index.sqlite')
+        offline.build_index(self.dump, filename)
+        index = offline.open_index(filename)
+        try:
+            #The range lookup of the short records does not grow with the CNV
+            self.assertEqual(index.spans[0], ('location', offline.LONG_SPAN))
+            self.check_index(index)
+        finally:
+            index.close()
+
+    def test_mapped_index(self):
+        filename = os.path.join(self.dir, 'index.cvx')
+        offline.build_mapped_index(self.dump, filename)
+        index = offline.open_index(filename)
+        try:
+            self.assertEqual(index.max_span, offline.LONG_SPAN)
+            self.assertEqual(index.n_long, 2)
+            self.check_index(index)
+        finally:
+            index.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#Tests of the request scheduler and rate limiter (python -m unittest discover tests)
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import scheduler
+
+class TokenBucketTest(unittest.TestCase):
+    #After the burst, tokens are only given out at the rate
+    def test_rate(self):
+        limiter = scheduler.TokenBucket(50)
+        start = time.time()
+        waited = sum([limiter.acquire() for i in range(0, 11)])
+        elapsed = time.time() - start
+        self.assertGreaterEqual(elapsed, 10 / 50.0 - 0.01)
+        self.assertLess(elapsed, 10 / 50.0 + 0.15)
+        self.assertAlmostEqual(waited, elapsed, delta=0.05)
+
+class RunJobsTest(unittest.TestCase):
+    #Every job is run once, concurrently, and its result comes back with its index
+    def test_results(self):
+        jobs = [(lambda i: (time.sleep(0.2), i*i)[1], (i,)) for i in range(0, 8)]
+        start = time.time()
+        results = dict(scheduler.run_jobs(jobs, 8))
+        self.assertLess(time.time() - start, 0.8)
+        self.assertEqual(results, dict((i, i*i) for i in range(0, 8)))
+        #A single worker runs them one by one, in order
+        self.assertEqual(list(scheduler.run_jobs(jobs[:3], 1)), [(0, 0), (1, 1), (2, 4)])
+
+    #An exception of a job is raised in the calling thread
+    def test_exception(self):
+        def job(i):
+            if i == 3:
+                raise ValueError('job %d failed'%(i))
+            return i
+        with self.assertRaises(ValueError):
+            list(scheduler.run_jobs([(job, (i,)) for i in range(0, 6)], 4))
+
+if __name__ == '__main__':
+    unittest.main()
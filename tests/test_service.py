@@ -0,0 +1,137 @@
+#Tests of the lookup service and its request coalescing, run against the
+#   local E-utilities stand-in (python -m unittest discover tests)
+import os
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import fake_eutils
+import connect
+import transport
+import service
+
+#Start a server in a daemon thread
+def start(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+#Call function with each of a list of argument tuples, all at once in their
+#   own threads; returns the results in order
+def run_together(function, args_list):
+    results = [None]*len(args_list)
+    ready = threading.Event()
+    def run(i):
+        ready.wait()
+        results[i] = function(*args_list[i])
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(0, len(args_list))]
+    for thread in threads:
+        thread.start()
+    ready.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+class LookupServiceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.store = fake_eutils.RecordStore()
+        fake_eutils.synthetic_records(cls.store, 50)
+        cls.server = start(fake_eutils.make_server(cls.store))
+        cls.url = 'http://%s:%d/'%(cls.server.server_address)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.saved = (connect.EUTILS_BASE, connect.SESSION, connect.API_KEY)
+        connect.EUTILS_BASE = self.url
+        connect.SESSION = transport.Session(retries=0)
+        connect.set_api_key('x')
+        #Slow responses, so that the lookups of the threads overlap
+        self.store.faults['delay'] = 0.3
+        self.sites = sorted((chromo, start) for chromo, spans in self.store.locations.items() for start, stop, uid in spans)
+
+    def tearDown(self):
+        self.store.faults['delay'] = 0.0
+        self.store.faults['error_rate'] = 0.0
+        connect.SESSION.close()
+        connect.EUTILS_BASE, connect.SESSION, api_key = self.saved
+        connect.set_api_key(api_key)
+
+    #Concurrent lookups of one position make a single upstream eSearch, and
+    #   later ones are answered from memory
+    def test_coalesced_ids(self):
+        lookups = service.LookupService()
+        key = self.sites[0]
+        before = self.store.request_counts['esearch']
+        results = run_together(lookups.get_ids, [(key, 'GRCh37')]*8)
+        self.assertEqual(self.store.request_counts['esearch'] - before, 1)
+        self.assertEqual(lookups.coalescer.coalesced, 7)
+        self.assertEqual(results, [self.store.search(*key)]*8)
+        self.assertEqual(lookups.get_ids(key, 'GRCh37'), self.store.search(*key))
+        self.assertEqual(self.store.request_counts['esearch'] - before, 1)
+        self.assertEqual(lookups.coalescer.inflight, {})
+
+    #Concurrent lookups of the same records make a single upstream eSummary
+    def test_coalesced_summaries(self):
+        lookups = service.LookupService()
+        uids = [self.store.search(*site)[0] for site in self.sites[:5]]
+        before = self.store.request_counts['esummary']
+        results = run_together(lookups.get_summaries, [(uids + ['999999999'],)]*6)
+        self.assertEqual(self.store.request_counts['esummary'] - before, 1)
+        for docs in results:
+            self.assertEqual(sorted(docs), sorted(uids))
+            self.assertEqual(docs, results[0])
+        #Only the records not in memory yet are requested
+        uid = self.store.search(*self.sites[5])[0]
+        self.assertEqual(sorted(lookups.get_summaries(uids[:2] + [uid])), sorted(uids[:2] + [uid]))
+        self.assertEqual(self.store.request_counts['esummary'] - before, 2)
+
+    #A failed lookup fails for every waiting client, and is not kept
+    def test_failure_not_cached(self):
+        lookups = service.LookupService()
+        key = self.sites[1]
+        self.store.faults['error_rate'] = 1.0
+        self.assertEqual(run_together(lookups.get_ids, [(key, 'GRCh37')]*4), [None]*4)
+        self.store.faults['error_rate'] = 0.0
+        self.assertEqual(lookups.get_ids(key, 'GRCh37'), self.store.search(*key))
+
+    #Clients reach the service over HTTP, if it uses the same E-utilities
+    def test_client(self):
+        server = start(service.make_server(service.LookupService(), 0))
+        url = 'http://%s:%d/'%(server.server_address)
+        try:
+            self.assertIs(service.find_service(url, 'http://other/'), None)
+            client = service.find_service(url, self.url)
+            self.assertIsNot(client, None)
+            try:
+                key = connect.location_key('chr'+self.sites[2][0], self.sites[2][1])
+                id_list = client.get_ids(key)
+                self.assertEqual(id_list, self.store.search(*self.sites[2]))
+                docs = client.get_summaries(id_list)
+                self.assertEqual(sorted(docs), sorted(id_list))
+                self.assertIs(type(docs[id_list[0]]['clin_sig']), str)
+            finally:
+                client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+class LRUCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        lru = service.LRUCache(2)
+        lru.put('a', 1)
+        lru.put('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.put('c', 3)
+        self.assertEqual([lru.get(key) for key in ['a', 'b', 'c']], [1, None, 3])
+        self.assertEqual((lru.hits, lru.misses), (3, 1))
+
+if __name__ == '__main__':
+    unittest.main()
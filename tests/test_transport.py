@@ -0,0 +1,136 @@
+#Tests of the keep-alive HTTP session, run against the local E-utilities
+#   stand-in (python -m unittest discover tests)
+import os
+import sys
+import json
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import fake_eutils
+import transport
+import metrics
+
+#Start a stand-in server over a record store, in a daemon thread; returns
+#   the server and its base URL
+def start_server(store):
+    server = fake_eutils.make_server(store)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://%s:%d/'%(server.server_address)
+
+class RedirectTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.store = fake_eutils.RecordStore()
+        fake_eutils.synthetic_records(cls.store, 20)
+        cls.server, cls.url = start_server(cls.store)
+        #Server that redirects every request to the first one
+        cls.moved_store = fake_eutils.RecordStore()
+        cls.moved_store.redirect = cls.url
+        cls.moved_server, cls.moved_url = start_server(cls.moved_store)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in [cls.server, cls.moved_server]:
+            server.shutdown()
+            server.server_close()
+
+    def esearch_url(self, base):
+        chromo, spans = sorted(self.store.locations.items())[0]
+        return base + 'esearch.fcgi?db=clinvar&retmode=json&term=(%s[chr])+AND+(%d[chrpos37])'%(chromo, spans[0][0])
+
+    def test_follow_redirect(self):
+        session = transport.Session(retries=0)
+        try:
+            direct = json.load(session.request(self.esearch_url(self.url)))
+            redirected = json.load(session.request(self.esearch_url(self.moved_url)))
+            #POSTed requests keep their data through the redirect
+            posted = json.load(session.request(self.moved_url + 'esummary.fcgi', 'db=clinvar&retmode=json&id=100000'))
+        finally:
+            session.close()
+        self.assertEqual(redirected, direct)
+        self.assertNotEqual(direct['esearchresult']['idlist'], [])
+        self.assertEqual(posted['result']['uids'], ['100000'])
+
+    #A redirect that redirects again fails, naming where it was sent
+    def test_redirect_loop(self):
+        self.moved_store.redirect = self.moved_url
+        session = transport.Session(retries=0)
+        try:
+            with self.assertRaises(IOError) as context:
+                session.request(self.esearch_url(self.moved_url))
+        finally:
+            self.moved_store.redirect = self.url
+            session.close()
+        self.assertIn('301', str(context.exception))
+        self.assertIn(self.moved_url, str(context.exception))
+
+#Rate limiter that counts the tokens taken, without waiting
+class CountingLimiter:
+    def __init__(self):
+        self.count = 0
+
+    def acquire(self):
+        self.count += 1
+        return 0.0
+
+class RetryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.store = fake_eutils.RecordStore()
+        fake_eutils.synthetic_records(cls.store, 20)
+        cls.server, cls.url = start_server(cls.store)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def tearDown(self):
+        self.store.faults['error_rate'] = 0.0
+
+    def counts(self):
+        return dict(self.store.request_counts), dict(metrics.REQUESTS.get('esummary', {'count':0, 'errors':0}))
+
+    #Requests answered with HTTP 503 / 429 are retried until they succeed,
+    #   each attempt waiting for the rate limiter, and every attempt is
+    #   recorded
+    def test_retry(self):
+        self.store.faults['error_rate'] = 0.5
+        before, stats_before = self.counts()
+        session = transport.Session(retries=20, backoff_base=0.001)
+        limiter = CountingLimiter()
+        try:
+            for uid in range(100000, 100020):
+                body = json.load(session.request(self.url + 'esummary.fcgi?db=clinvar&retmode=json&id=%d'%(uid), limiter=limiter))
+                self.assertEqual(body['result']['uids'], [str(uid)])
+        finally:
+            session.close()
+        after, stats_after = self.counts()
+        faults = after['faults'] - before['faults']
+        self.assertGreater(faults, 0)
+        self.assertEqual(session.stats['retries'], faults)
+        self.assertEqual(session.stats['requests'], 20 + faults)
+        self.assertEqual(limiter.count, 20 + faults)
+        self.assertEqual(stats_after['count'] - stats_before['count'], 20 + faults)
+        self.assertEqual(stats_after['errors'] - stats_before['errors'], faults)
+
+    #Once the retries run out, IOError is raised
+    def test_retries_exhausted(self):
+        self.store.faults['error_rate'] = 1.0
+        before = self.counts()[0]
+        session = transport.Session(retries=2, backoff_base=0.001)
+        try:
+            with self.assertRaises(IOError) as context:
+                session.request(self.url + 'esummary.fcgi?db=clinvar&id=100000')
+        finally:
+            session.close()
+        self.assertIn('after 2 retries', str(context.exception))
+        self.assertEqual(self.store.request_counts['esummary'], before['esummary'])
+        self.assertEqual(self.store.request_counts['faults'] - before['faults'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
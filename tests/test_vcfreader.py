@@ -0,0 +1,55 @@
+#Tests of the VCF region reads and of resuming them (python -m unittest discover tests)
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import vcfreader
+import checkpoint
+
+HEADER = '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+
+class RegionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.vcf = os.path.join(self.dir, 'in.vcf')
+        with open(self.vcf, 'w') as f_out:
+            f_out.write('##fileformat=VCFv4.2\n'+HEADER)
+            for chromo in ['1', '2']:
+                for pos in range(100, 1100, 100):
+                    f_out.write('%s\t%d\trs%s%d\tA\tG\t.\tPASS\t.\n'%(chromo, pos, chromo, pos))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def regions(self, *regions):
+        return [vcfreader.parse_region(region) for region in regions]
+
+    def test_merge_regions(self):
+        merged = vcfreader.merge_regions(self.regions('1:500-600', '1:100-200', 'chr1:150-300', '1:301-400', '2', 'chr2:5-10', 'X:10'))
+        self.assertEqual(merged, [('1', 100, 400), ('1', 500, 600), ('2', None, None), ('X', 10, None)])
+
+    #Each record of overlapping regions is read once
+    def test_overlapping_regions(self):
+        rows = [row for row, var in vcfreader.iter_variants(self.vcf, self.regions('1:100-500', '1:300-700', 'chr1:650-800'))]
+        self.assertEqual([int(row.split('\t')[1]) for row in rows], range(100, 900, 100))
+
+    #A journal of other regions is not resumed from
+    def test_resume_regions(self):
+        filename = os.path.join(self.dir, 'in_ClinVarCheckpoint.pkl')
+        regions = vcfreader.merge_regions(self.regions('1:100-500'))
+        journal = checkpoint.CheckpointJournal(filename, self.vcf, False, 'GRCh37', regions)
+        journal.record_ids(0, ['1'])
+        journal.close(remove=False)
+        journal = checkpoint.CheckpointJournal(filename, self.vcf, True, 'GRCh37', regions)
+        self.assertEqual(journal.IdLists, {0:['1']})
+        journal.close(remove=False)
+        journal = checkpoint.CheckpointJournal(filename, self.vcf, True, 'GRCh37', self.regions('2'))
+        self.assertEqual(journal.IdLists, {})
+        journal.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Helper class to send the E-utilities requests over persistent HTTP
+#   connections, with timeouts and retries
+#
+# Note to self:
+#   - Session keeps a pool of open (keep-alive) connections per host, so
+#       that each request reuses a connection instead of opening a new one;
+#       the worker threads each take a connection from the pool and put it
+#       back once the response is read
+#   - Responses are asked to be gzipped (Accept-Encoding: gzip), and are
+#       decompressed here, so callers always get the plain body
+#   - Connecting and reading each have their own timeout, so a hung socket
+#       fails the request instead of stalling the run
+#   - Transient failures (HTTP 429 / 5xx, timeouts, dropped or reset
+#       connections) are retried with exponential backoff (the Retry-After
+#       header is used instead when given); each attempt waits for the rate
+#       limiter again, so retries still keep to the NCBI request rate
+#   - A failure on a reused connection (e.g. closed by the server while
+#       idle) is retried at once on a new connection
+#   - A redirect (HTTP 301 / 302 / 303 / 307 / 308, e.g. NCBI moving plain
+#       http to https) is followed once, with the same request, like
+#       urllib did; a second redirect raises IOError naming its Location
+#   - Once the retries run out, IOError is raised, same as urllib
+#   - Every attempt (latency, bytes received, status) and rate limiter wait
+#       is recorded in metrics.py, by tool (esearch / esummary)
+#
+# Author: Anthony Chen
+##################################################################"""
+import time
+import zlib
+import random
+import socket
+import httplib
+import urlparse
+import threading
+import StringIO
+#User-created files
+import metrics
+
+#Default connect / read timeouts (seconds) and number of retries
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 60.0
+MAX_RETRIES = 5
+#Backoff before the first retry (seconds), doubled for every further retry
+#   up to BACKOFF_MAX
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+#HTTP statuses worth retrying
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+#HTTP statuses of a redirect, and how many redirects of a request are followed
+REDIRECT_STATUSES = [301, 302, 303, 307, 308]
+MAX_REDIRECTS = 1
+
+#Failure that may succeed when retried
+class TransientError(IOError):
+    def __init__(self, message, retry_after=None):
+        IOError.__init__(self, message)
+        self.retry_after = retry_after
+
+#Redirect to another URL (the Location header)
+class Redirect(IOError):
+    def __init__(self, message, location):
+        IOError.__init__(self, message)
+        self.location = location
+
+#Function to split a URL into its (scheme, host, port) and its path with
+#   the query string
+def split_url(url):
+    parts = urlparse.urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return (parts.scheme, parts.hostname, parts.port), path
+
+class Session:
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        #Idle connections of each (scheme, host, port)
+        self.pool = {}
+        self.lock = threading.Lock()
+        #Number of requests, connections opened and retries made
+        self.stats = {'requests':0, 'connections':0, 'retries':0}
+
+    #Send a request (a POST if data is given) and return its body as a
+    #   file-like object; limiter (e.g. a scheduler.TokenBucket) is waited
+    #   for before every attempt
+    def request(self, url, data=None, limiter=None):
+        host, path = split_url(url)
+        tool = path.split('?')[0].rstrip('/').split('/')[-1].replace('.fcgi', '')
+        attempt = 0
+        redirects = 0
+        while True:
+            if limiter is not None:
+                metrics.record_throttle(limiter.acquire())
+            conn, reused = self.get_connection(host)
+            started = time.time()
+            try:
+                body = self.send(conn, path, data, tool, started)
+            except Redirect as e:
+                #Follow the redirect (not a retry), from the redirected URL
+                conn.close()
+                url = urlparse.urljoin(url, e.location)
+                if redirects >= MAX_REDIRECTS:
+                    raise IOError("%s (redirected again, to %s)"%(e, url))
+                host, path = split_url(url)
+                redirects += 1
+                continue
+            except (TransientError, socket.error, httplib.HTTPException, zlib.error) as e:
+                #Failures without a response (responses are recorded by send)
+                if not isinstance(e, TransientError):
+                    metrics.record_request(tool, time.time() - started, 0, None)
+                conn.close()
+                if reused and not isinstance(e, (TransientError, socket.timeout)):
+                    continue
+                if attempt >= self.retries:
+                    raise IOError("%s (after %d retries)"%(e, attempt))
+                self.backoff(attempt, getattr(e, 'retry_after', None))
+                attempt += 1
+                continue
+            except Exception:
+                conn.close()
+                raise
+            self.put_connection(host, conn)
+            return StringIO.StringIO(body)
+
+    #Send a request on a connection and read its (decompressed) body; the
+    #   response is recorded in metrics.py under tool, timed from started
+    def send(self, conn, path, data, tool, started):
+        #Connect new connections, with the read timeout once connected
+        if conn.sock is None:
+            conn.connect()
+            conn.sock.settimeout(self.read_timeout)
+        headers = {'Accept-Encoding':'gzip', 'Connection':'keep-alive'}
+        if data is None:
+            conn.request('GET', path, headers=headers)
+        else:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            conn.request('POST', path, data, headers)
+        response = conn.getresponse()
+        body = response.read()
+        metrics.record_request(tool, time.time() - started, len(body), response.status)
+        with self.lock:
+            self.stats['requests'] += 1
+        if response.status in RETRY_STATUSES:
+            raise TransientError("HTTP %d %s"%(response.status, response.reason), response.getheader('retry-after'))
+        if response.status in REDIRECT_STATUSES and response.getheader('location'):
+            raise Redirect("HTTP %d %s"%(response.status, response.reason), response.getheader('location'))
+        if response.status != 200:
+            raise IOError("HTTP %d %s"%(response.status, response.reason))
+        if response.getheader('content-encoding', '').lower() == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if response.will_close:
+            conn.close()
+        return body
+
+    #Sleep before a retry: Retry-After if the server gave one, else the
+    #   exponential backoff (with jitter, so workers do not retry in step)
+    def backoff(self, attempt, retry_after=None):
+        with self.lock:
+            self.stats['retries'] += 1
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        time.sleep(min(delay, self.backoff_max))
+
+    #Take an idle connection to a host from the pool, or make a new one
+    #   (connected by send); returns (connection, whether it was reused)
+    def get_connection(self, host):
+        with self.lock:
+            idle = self.pool.get(host)
+            if idle:
+                return idle.pop(), True
+            self.stats['connections'] += 1
+        scheme, hostname, port = host
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(hostname, port, timeout=self.connect_timeout)
+        else:
+            conn = httplib.HTTPConnection(hostname, port, timeout=self.connect_timeout)
+        return conn, False
+
+    #Put a connection back in the pool (if it is still open)
+    def put_connection(self, host, conn):
+        if conn.sock is None:
+            return
+        with self.lock:
+            self.pool.setdefault(host, []).append(conn)
+
+    #Print the number of requests, connections and retries
+    def report(self):
+        if self.stats['requests'] == 0:
+            return
+        print "[Program] %d request(s) over %d connection(s), %d retr%s"%(self.stats['requests'], self.stats['connections'],
+                                                                        self.stats['retries'], 'y' if self.stats['retries'] == 1 else 'ies')
+
+    #Close all idle connections
+    def close(self):
+        with self.lock:
+            for idle in self.pool.values():
+                for conn in idle:
+                    conn.close()
+            self.pool = {}
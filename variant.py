@@ -13,20 +13,36 @@
 #       since recordLib is just an extension of IdList, hmmmmmmmm
 #   - Not sure how to handle non-existing information workflow. Keep it as
 #       a NoneType, or make user manually check?
+#   - Var uses __slots__ and interned strings to keep large inputs small;
+#       any new attribute has to be added to __slots__ too
 #
 # Author: Anthony Chen
 ##################################################################"""
 import sys
+import re
+
+#Maximum number of formatted annotations remembered by format_annotations
+ANNOTATION_MEMO_SIZE = 100000
+#Formatted annotation of each raw annotation seen, see format_annotations
+ANNOTATION_MEMO = {}
+
+class Var(object):
+    #Fixed attributes instead of a per-instance __dict__, as there can be
+    #   millions of variants in memory
+    __slots__ = ['index', 'chromosome', 'position', 'gene', 'function_type', 'annotation', 'snp',
+                 'searchable', 'anno_list', 'IdList', 'recordLib']
 
-class Var:
     #Class constructor and attributes
-    def __init__(self, chromo, pos, gene, func_type, anno, snp):
+    def __init__(self, chromo, pos, gene, func_type, anno, snp, index=None):
         #Content from file
-        self.chromosome = chromo
+        #   The columns repeated across rows (e.g. the same gene or site in
+        #   many samples) are interned, so that the rows share one string
+        self.index = index #Index of the variant in the file
+        self.chromosome = intern(chromo)
         self.position = pos
-        self.gene = gene #Gene symbol
-        self.function_type = func_type #Function type
-        self.annotation = anno #Detailed variant annotation
+        self.gene = intern(gene) #Gene symbol
+        self.function_type = intern(func_type) #Function type
+        self.annotation = intern(anno) #Detailed variant annotation
         self.snp = snp #All SNPs
         #Pre-search program-created contents
         self.searchable = True #Whether it is a wanted variant (yes for now)
@@ -34,6 +50,8 @@ class Var:
         #Post eSearch attributes
         self.IdList = None
         #Post eSummary attributes
+        #   The doc_sum dictionaries are shared by every variant with the
+        #   same record ID, not copied per variant
         self.recordLib = None
     ########## Object methods ##########
     #Method to output the clinical significance
@@ -41,6 +59,10 @@ class Var:
         #If the variant was not searched, indicate to user
         if self.searchable == False:
             return "Variant not searched"
+        #If the search of its position failed (after all retries), it is not
+        #   known whether it has records
+        if self.IdList is None:
+            return "Search failed"
         #If there are no clinical significance, output No items found
         if self.recordLib == None:
             return "No items found"
@@ -75,7 +97,62 @@ class Var:
 
 
 #Goes through the entire variant list for pre-search formatting
-def format_variantList(v_list):
+#   wanted_genes is the list of genes to filter for (an empty list for no
+#   filtering), or None to ask the user (see get_gene_filter)
+def format_variantList(v_list, wanted_genes=None):
+    #Ask the user, unless it was already decided (e.g. for an earlier chunk)
+    if wanted_genes is None:
+        wanted_genes = get_gene_filter()
+    #Single pattern matching any of the wanted genes, so that each
+    #   annotation is scanned once instead of once per gene
+    gene_filter = compile_gene_filter(wanted_genes)
+
+    #Iterate through list of variants to format variants
+    for v in v_list:
+        #Split (potential) multiple genes by the "|" delimiter
+        anno_list = v.annotation.split("|")
+
+        #Keep only the annotations containing a wanted gene
+        if gene_filter is not None:
+            anno_list = [raw_anno for raw_anno in anno_list if gene_filter.search(raw_anno)]
+
+        #Format each annotation properly for search (repeated annotations
+        #   are only formatted once)
+        v.anno_list = format_annotations(anno_list)
+
+        #If a variant has no annotations left to be searched, it is not searchable
+        if len(v.anno_list) == 0:
+            v.searchable = False
+
+    #Return success
+    return 0
+
+#Function to compile a list of wanted genes into a single regex matching any
+#   of them (anywhere in an annotation), or None for no filtering
+def compile_gene_filter(wanted_genes):
+    if len(wanted_genes) == 0:
+        return None
+    #Longest genes first, so that the alternation tries them before their
+    #   prefixes
+    return re.compile('|'.join([re.escape(g) for g in sorted(set(wanted_genes), key=len, reverse=True)]))
+
+#Function to format a list of raw annotations, reusing the formatted
+#   annotation of any raw annotation already seen (in this or an earlier
+#   variant); the memo is emptied once it holds ANNOTATION_MEMO_SIZE entries
+def format_annotations(raw_annos):
+    formatted = []
+    for raw_anno in raw_annos:
+        good_anno = ANNOTATION_MEMO.get(raw_anno)
+        if good_anno is None:
+            if len(ANNOTATION_MEMO) >= ANNOTATION_MEMO_SIZE:
+                ANNOTATION_MEMO.clear()
+            good_anno = ANNOTATION_MEMO[raw_anno] = intern(format_annotation(raw_anno))
+        formatted.append(good_anno)
+    return formatted
+
+#Asks the user whether to filter by genes; returns the list of wanted genes
+#   if so, or an empty list if not
+def get_gene_filter():
     #Initiate a list of genes
     wanted_genes = []
 
@@ -85,58 +162,17 @@ def format_variantList(v_list):
 
     #User indication
     print "[Program] Apply gene filter: %s." % str(apply_gene_filter)
-
-    #Iterate through list of variants to format variants
-    for i in range(0,len(v_list)):
-        #Split (potential) multiple genes by the "|" delimiter
-        v_list[i].anno_list = v_list[i].annotation.split("|")
-
-        #Iterate through each annotation to delete the ones not containing a wanted gene
-        if apply_gene_filter:
-            #Initiate a list of annotations to delete from this variant
-            toDelete_list = []
-
-            #Iterate through each (currently un-processed) individual annotation
-            #TODO; make below cleaner via list comprehension???
-            for raw_anno in v_list[i].anno_list:
-                if not any(s in raw_anno for s in wanted_genes):
-                    toDelete_list.append(raw_anno)
-
-            #Delete the annotations that do not have the genes we want
-            for del_anno in toDelete_list:
-                if del_anno in v_list[i].anno_list:
-                    v_list[i].anno_list.remove(del_anno)
-
-            #Delete the temp list for memory
-            del toDelete_list
-
-        #Iterate through each annotation to format them properly for search
-        for j in range(0, len(v_list[i].anno_list)):
-            #BUG: also something wrong with below when filtering genes, due to pop function
-            #BUG: need to do gene filtering in a different way
-            v_list[i].anno_list[j] = format_annotation(v_list[i].anno_list[j])
-
-    #Iterate through the list again to check for searchability (i.e. if anything is filtered out)
-    for i in range(0,len(v_list)):
-        #If a variant has no annotations left to be searched, it is not searchable
-        if len(v_list[i].anno_list) == 0:
-            v_list[i].searchable = False
-
-    #Return success
-    return 0
+    if not apply_gene_filter:
+        return []
+    return wanted_genes
 
 #Looks for a reads a list of wanted genes from the local directory
 def initiate_filter_genes(gene_list):
-    #Attempt to open the input stream
+    #Attempt to read the file
     try:
-        f = open("Wanted_Genes.txt", 'r')
+        gene_list += read_gene_file("Wanted_Genes.txt")
     #Except for I/O error in case file is not present
     except IOError: return False
-    #If the file is found, read it
-    gene_list += f.readlines()
-    #Strip off the nextline characters
-    for i in range(0, len(gene_list)):
-        gene_list[i] = gene_list[i].strip()
     #Prompt the user to see if they want to use the gene filter
     print "[Program] Detected file 'Wanted_Genes.txt' in local directory, with %d genes inside." % (len(gene_list))
     while (True):
@@ -148,6 +184,16 @@ def initiate_filter_genes(gene_list):
 
 
 
+#Reads a list of wanted genes from a file, one gene per line
+def read_gene_file(filename):
+    f = open(filename, 'r')
+    #Strip off the nextline characters
+    gene_list = [line.strip() for line in f.readlines()]
+    f.close()
+    return gene_list
+
+
+
 #Function that formats an individual annotations
 """ FEEL FREE TO CHANGE BELOW """
 #TODO: the below is problematic, especially for handling non 'NM' variants
@@ -165,16 +211,15 @@ def format_annotation(raw_anno):
     #Else, remove everything before the "NM"
     good_anno = good_anno[good_anno.find("NM"):]
     #Remove the protein mutations, if present
-    try:
-        good_anno = good_anno[:good_anno.index(":p")]
-    except ValueError: pass
+    p_start = good_anno.find(":p")
+    if p_start != -1:
+        good_anno = good_anno[:p_start]
     #Change the point mutation format, if present
     #   In essense, change something such as C123A to 123C>A
-    try:
-        mutList = list(good_anno[good_anno.index(":c.")+3:]) #Get a char array of point mutation
-        mut = ''.join(mutList[1:len(mutList)-1]) #Get the numbers
-        mut += "%s>%s" % (mutList[0], mutList[len(mutList)-1]) #Get the changes to the nucleotide
-        good_anno = good_anno[:good_anno.index(':c.')+3] + mut #Append all together
-    except ValueError: pass
+    c_start = good_anno.find(":c.")
+    if c_start != -1:
+        mut = good_anno[c_start+3:] #Get the point mutation
+        #Numbers first, then the changes to the nucleotide
+        good_anno = "%s%s%s>%s" % (good_anno[:c_start+3], mut[1:-1], mut[0], mut[-1])
     #Return the formatted annotation
     return good_anno
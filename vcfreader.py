@@ -0,0 +1,245 @@
+#!/usr/bin/python
+
+"""##################################################################
+# Helper class to read variants directly from VCF files (plain, gzip or
+#   bgzip), optionally restricted to regions via a tabix (.tbi) index
+#
+# Note to self:
+#   - Each VCF record becomes a Var:
+#       - chromosome / position from CHROM / POS
+#       - gene, function type and detailed annotation from the ANNOVAR
+#           INFO fields (Gene.refGene, ExonicFunc.refGene and
+#           AAChange.refGene), empty if the VCF is not annotated
+#       - SNP from the ID column (or the ANNOVAR avsnp INFO field)
+#   - Regions are "chromosome", "chromosome:start" (to the end of the
+#       chromosome) or "chromosome:start-end" (1-based, inclusive), same
+#       as samtools / tabix
+#       - Overlapping or adjacent regions of a chromosome are merged (see
+#           merge_regions), so each record is read (and searched) once
+#       - With a tabix index (file.vcf.gz.tbi), only the BGZF blocks of
+#           the regions are read, by seeking to the offset given by the
+#           linear index of the region start
+#       - Without one, the whole file is read and filtered
+#   - The search itself is unchanged: region reads just produce fewer
+#       variants for the eSearch ([chr] / [chrpos37]) stage
+#   - The assembly of the positions is read from the ##reference line (or
+#       the assembly of the ##contig lines) of the header, if given, e.g.
+#       "##reference=GRCh38" or "##reference=file:///ref/hg19.fa"
+#
+# Author: Anthony Chen
+##################################################################"""
+import os
+import re
+import gzip
+import struct
+#User-created files
+from variant import Var
+import connect
+
+#INFO fields (in order of preference) used for the Var attributes
+GENE_FIELDS = ['Gene.refGene', 'Gene.ensGene']
+FUNCTION_FIELDS = ['ExonicFunc.refGene', 'ExonicFunc.ensGene']
+ANNOTATION_FIELDS = ['AAChange.refGene', 'AAChange.ensGene']
+SNP_FIELDS = ['avsnp150', 'avsnp147', 'avsnp144', 'avsnp142', 'snp138']
+#Size of the windows of the tabix linear index (16 kb)
+TABIX_LINEAR_SHIFT = 14
+#Regions to read (a list of parse_region tuples), or None for all records
+REGIONS = None
+#Patterns of the names of each assembly in the header lines
+ASSEMBLY_NAMES = [('GRCh38', re.compile(r'GRCh38|hg38|hs38|b38|assembly38', re.I)),
+                  ('GRCh37', re.compile(r'GRCh37|hg19|hs37|b37|g1k_v37|assembly19', re.I))]
+
+#Function to check whether a file is a VCF file (by its extension)
+def is_vcf(filename):
+    return re.search(r'\.vcf(\.gz|\.bgz)?$', filename) is not None
+
+#Function to open a VCF file, decompressing it if it is gzipped (which
+#   includes bgzip)
+def open_vcf(filename):
+    if re.search(r'\.(gz|bgz)$', filename):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'r')
+
+#Function to read the header lines of a VCF file (the "##" meta lines and
+#   the "#CHROM" column line), without their newlines
+def read_header_lines(filename):
+    lines = []
+    f = open_vcf(filename)
+    try:
+        for line in f:
+            if not line.startswith('#'): break
+            lines.append(line.rstrip('\r\n'))
+    finally:
+        f.close()
+    return lines
+
+#Function to find the assembly that the header lines of a VCF file give
+#   (GRCh37 or GRCh38), or None if they do not say
+def header_assembly(lines):
+    for line in lines:
+        if line.startswith('##reference='):
+            value = line[len('##reference='):]
+        elif line.startswith('##contig=') and 'assembly=' in line:
+            value = line[line.index('assembly='):]
+        else: continue
+        for assembly, regex in ASSEMBLY_NAMES:
+            if regex.search(value):
+                return assembly
+    return None
+
+#Function to parse a region string into a (chromosome key, start, end)
+#   tuple; start / end are None when not given
+def parse_region(region):
+    match = re.match(r'^([^:]+)(?::([\d,]+)(?:-([\d,]*))?)?$', region.strip())
+    if match is None:
+        raise ValueError("Invalid region '%s', expected chromosome[:start[-end]]"%(region))
+    chromo, start, end = match.groups()
+    start = int(start.replace(',', '')) if start else None
+    end = int(end.replace(',', '')) if end else None
+    return (connect.location_key(chromo, 0)[0], start, end)
+
+#Function to sort parse_region tuples and merge those that overlap or are
+#   adjacent on the same chromosome, so that no record is in two of them
+def merge_regions(regions):
+    merged = []
+    for chromo, start, end in sorted(regions, key=lambda region: (region[0], region[1] or 1)):
+        if merged and merged[-1][0] == chromo and (merged[-1][2] is None or (start or 1) <= merged[-1][2] + 1):
+            last_start, last_end = merged[-1][1], merged[-1][2]
+            merged[-1] = (chromo, last_start, None if last_end is None or end is None else max(last_end, end))
+        else:
+            merged.append((chromo, start, end))
+    return merged
+
+#Function to check whether a (chromosome key, position) is in a region
+def in_region(key, region):
+    chromo, start, end = region
+    return key[0] == chromo and (start is None or key[1] >= start) and (end is None or key[1] <= end)
+
+#Generator that yields the (row, Var object) of every record of a VCF file,
+#   or only of those in the given regions (a list of parse_region tuples,
+#   REGIONS if not given); each Var is numbered by its index among the
+#   records read
+def iter_variants(filename, regions=None):
+    if regions is None:
+        regions = REGIONS
+    if regions:
+        regions = merge_regions(regions)
+    index = 0
+    if regions:
+        index_file = filename + '.tbi'
+        if os.path.isfile(index_file):
+            lines = iter_tabix_lines(filename, index_file, regions)
+        else:
+            print "[Program] No tabix index (%s), reading the whole file for the regions..."%(index_file)
+            lines = iter_lines(filename)
+    else:
+        lines = iter_lines(filename)
+    for row in lines:
+        cols = row.split('\t')
+        if len(cols) < 8: continue
+        var = record_to_var(cols, index)
+        if regions and not any(in_region(connect.location_key(var.chromosome, var.position), region) for region in regions):
+            continue
+        yield row, var
+        index += 1
+
+#Generator over the record lines of a VCF file (without their newlines)
+def iter_lines(filename):
+    f = open_vcf(filename)
+    try:
+        for line in f:
+            if line.startswith('#'): continue
+            yield line.rstrip('\r\n')
+    finally:
+        f.close()
+
+#Function to make a Var from the columns of a VCF record
+def record_to_var(cols, index):
+    info = parse_info(cols[7])
+    snp = cols[2] if cols[2] != '.' else first_field(info, SNP_FIELDS)
+    return Var(cols[0], cols[1], first_field(info, GENE_FIELDS), first_field(info, FUNCTION_FIELDS),
+               first_field(info, ANNOTATION_FIELDS), snp, index)
+
+#Function to parse the INFO column of a VCF record into a dictionary
+#   (flags have a value of None); ANNOVAR hex escapes are decoded
+def parse_info(info):
+    fields = {}
+    for field in info.split(';'):
+        name, sep, value = field.partition('=')
+        fields[name] = value.replace('\\x3b', ';').replace('\\x3d', '=') if sep else None
+    return fields
+
+#Function to return the first of the given INFO fields present with a value
+#   ("." counts as missing), or an empty string
+def first_field(info, names):
+    for name in names:
+        value = info.get(name)
+        if value and value != '.':
+            return value
+    return ''
+
+"""################## Tabix index ##################"""
+#Function to read the linear index of each sequence of a tabix (.tbi)
+#   index; returns a dictionary of chromosome key -> list of virtual offsets
+#   (one per 16 kb window)
+def read_tabix_index(index_file):
+    f = gzip.open(index_file, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    if data[:4] != 'TBI\x01':
+        raise ValueError("'%s' is not a tabix index"%(index_file))
+    n_ref, fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack_from('<8i', data, 4)
+    names = data[36:36+l_nm].split('\x00')[:n_ref]
+    offset = 36 + l_nm
+    linear = {}
+    for name in names:
+        #Skip the binning index, only the linear index is used
+        n_bin = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        for b in range(0, n_bin):
+            n_chunk = struct.unpack_from('<Ii', data, offset)[1]
+            offset += 8 + n_chunk*16
+        n_intv = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        linear[connect.location_key(name, 0)[0]] = list(struct.unpack_from('<%dQ'%(n_intv), data, offset))
+        offset += n_intv*8
+    return linear
+
+#Function to find the virtual offset to start reading a region from: the
+#   linear index entry of the window of the region start (or the closest
+#   non-empty one before it); None if the sequence is not in the index
+def region_offset(linear, region):
+    offsets = linear.get(region[0])
+    if not offsets:
+        return None
+    window = min(max((region[1] or 1) - 1, 0) >> TABIX_LINEAR_SHIFT, len(offsets) - 1)
+    while window > 0 and offsets[window] == 0:
+        window -= 1
+    return offsets[window]
+
+#Generator over the record lines of the regions of a bgzipped VCF file,
+#   using its tabix index to seek to the start of each region (the regions
+#   must not overlap, see merge_regions)
+def iter_tabix_lines(filename, index_file, regions):
+    linear = read_tabix_index(index_file)
+    raw = open(filename, 'rb')
+    try:
+        for region in regions:
+            voffset = region_offset(linear, region)
+            if voffset is None: continue
+            #Seek to the BGZF block, then to the record within the block
+            raw.seek(voffset >> 16)
+            f = gzip.GzipFile(fileobj=raw, mode='rb')
+            f.read(voffset & 0xFFFF)
+            for line in f:
+                if line.startswith('#'): continue
+                cols = line.split('\t', 2)
+                if len(cols) < 2: continue
+                key = connect.location_key(cols[0], cols[1])
+                #Records are sorted, so stop once past the region
+                if key[0] != region[0] or (region[2] is not None and key[1] > region[2]): break
+                yield line.rstrip('\r\n')
+    finally:
+        raw.close()